@@ -90,7 +90,7 @@ export async function POST(
           jobId,
           filePath: containerFilePath,
           options: options || {
-            separateStems: true,
+            separateStems: false,
             analysisDepth: 'basic',
           },
         }),
@@ -213,7 +213,7 @@ export async function GET(
         jobId,
         filePath: containerFilePath,
         options: {
-          separateStems: true,
+          separateStems: false,
           analysisDepth: 'basic',
         },
       }),
@@ -154,7 +154,7 @@ export default function AudioAnalyzer({ onScaleSelect }: AudioAnalyzerProps) {
         body: JSON.stringify({
           filePath,
           options: {
-            separateStems: true,
+            separateStems: false,
             analysisDepth: 'basic',
           },
         }),
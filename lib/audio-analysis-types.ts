@@ -59,6 +59,36 @@ export interface AnalysisResult {
   chordProgression: ChordInfo[];              // コード進行のタイムライン
   stems?: StemUrls;                           // stem分解結果（オプション）
   scaleMatch: ScaleMatchResult;               // スケールマッチング結果
+  sections?: AnalysisSection[];               // コード検出を行った区間（時刻順、実解析時のみ）
+  beatGrid?: BeatGrid;                        // 曲全体のビートグリッド（曲全体を解析した場合のみ）
+}
+
+/**
+ * 曲全体のビートグリッド（打楽器成分から推定）
+ */
+export interface BeatGrid {
+  beats: number[];                            // ビート位置（秒）
+  downbeats: number[];                        // 小節頭のビート位置（秒、4拍子を仮定）
+  tempoCurve: TempoPoint[];                   // テンポカーブ（8拍ごと）
+}
+
+/**
+ * テンポカーブの1点
+ */
+export interface TempoPoint {
+  time: number;                               // 時刻（秒）
+  tempo: number;                              // BPM
+}
+
+/**
+ * コード検出を行った区間（サビ・Aメロなど音量の大きい区間）
+ */
+export interface AnalysisSection {
+  startTime: number;                          // 開始時刻（秒）
+  endTime: number;                            // 終了時刻（秒）
+  tempo: number;                              // 区間のBPM
+  chordProgression: ChordInfo[];              // 区間のコード進行
+  label?: string;                             // 構成ラベル（A, B, ...、同じラベル = 繰り返し、構成検出時のみ）
 }
 
 /**
@@ -82,6 +112,7 @@ export interface AnalysisMetadata {
   scale: string;                              // 推定スケール（例: "メジャー"）
   confidence: number;                         // 信頼度 0.0-1.0
   detectedKeys?: DetectedKeyInfo[];           // 複数キー検出時（転調がある曲）
+  analysisDepth?: 'preview' | 'basic' | 'detailed'; // 実際に使われた解析の深さ（実解析時のみ）
 }
 
 /**
@@ -100,10 +131,10 @@ export interface ChordInfo {
  * stem分解結果のURL
  */
 export interface StemUrls {
-  vocals: string;                             // ボーカルトラックのURL or base64
-  drums: string;                              // ドラムトラックのURL
-  bass: string;                               // ベーストラックのURL
-  other: string;                              // その他のトラックのURL
+  harmonic: string;                           // ハーモニック成分のURL（/stems/...、FLAC）
+  percussive: string;                         // パーカッシブ成分のURL
+  bass: string;                               // ベース帯域（ハーモニック成分の250Hz以下）のURL
+  residual: string;                           // 残差成分のURL
 }
 
 /**
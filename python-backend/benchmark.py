@@ -0,0 +1,568 @@
+"""
+音源解析バックエンドのベンチマーク
+
+キー・テンポ・コード進行が既知の合成音源をオフラインで生成し、解析エンジン全体と
+各ステージの実行時間（wall / CPU）・ピークメモリ（RSS）・正解との一致率を計測して
+JSON に書き出す。乱数は固定シードなので、同じ引数なら毎回同じ音源になり、
+コミット間で結果を比較（diff）できる。
+
+使い方:
+    python benchmark.py                                   # 10秒〜60分の全ケース
+    python benchmark.py --durations 10,60 --output bench.json
+    python benchmark.py --baseline bench-main.json        # 基準より遅い・精度が落ちたケースがあれば終了コード 1
+
+Essentia の計測は USE_ESSENTIA=true で essentia をインストールした環境でのみ行う。
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 解析は常に実音源モードで、キャッシュを使わずに計測する（main の import 前に設定）
+os.environ.setdefault("USE_REAL_ANALYSIS", "true")
+for _name in ("RESULT_CACHE_ENABLED", "PCM_CACHE_ENABLED", "STEM_CACHE_ENABLED"):
+    os.environ.setdefault(_name, "false")
+
+import numpy as np
+import soundfile as sf
+
+import main
+
+BENCHMARK_VERSION = 2
+SAMPLE_RATE = 22050  # analyze_audio_librosa と同じ
+SEED = 20240101
+
+DEFAULT_DURATIONS = [10, 60, 300, 1800, 3600]
+DEFAULT_DEPTHS = ["basic"]
+STAGE_MAX_DURATION = 600.0  # これより長い音源ではステージ単位の計測を行わない（曲全体の STFT が重いため）
+
+NOTE_NAMES = main.ChordTemplates.NOTE_NAMES
+
+# スケール度数 → (ルートの半音オフセット, quality)
+DIATONIC_CHORDS = {
+    "メジャー": {
+        "I": (0, "maj"), "ii": (2, "min"), "iii": (4, "min"), "IV": (5, "maj"), "V": (7, "maj"), "vi": (9, "min"),
+        "Imaj7": (0, "maj7"), "V7": (7, "7"), "vi7": (9, "m7"), "Vsus4": (7, "sus4"), "IVsus2": (5, "sus2"),
+    },
+    "マイナー": {"i": (0, "min"), "iv": (5, "min"), "v": (7, "min"), "III": (3, "maj"), "VI": (8, "maj"), "VII": (10, "maj")},
+}
+# quality → (コード名の接尾辞, 構成音のルートからの半音数)（main の CHORD_QUALITIES と同じ）
+CHORD_TONES = {quality: (suffix, tuple(intervals)) for quality, suffix, intervals, _ in main.CHORD_QUALITIES}
+
+# 検出された quality → 三和音の種類（7th などは三和音として比較する）
+TRIAD_OF_QUALITY = {
+    "maj": "maj", "7": "maj", "maj7": "maj",
+    "min": "min", "m7": "min",
+    "dim": "dim", "m7b5": "dim",
+    "aug": "aug", "sus2": "sus", "sus4": "sus",
+}
+
+# ベンチマーク用の曲（長さごとに順番に割り当てる）: 8小節の verse（小さめ）と chorus（大きめ）を交互に繰り返す
+# 最初の曲は sus・7th を含む（全音同じ音量の Cmaj7・G7・Am7・Gsus4・Fsus2）
+SONGS = [
+    {"key": "C", "scale": "メジャー", "tempo": 120.0, "verse": ["Imaj7", "V7", "vi7", "Vsus4"], "chorus": ["IV", "IVsus2", "V7", "vi"]},
+    {"key": "A", "scale": "マイナー", "tempo": 96.0, "verse": ["i", "VI", "III", "VII"], "chorus": ["iv", "v", "i", "i"]},
+    {"key": "E", "scale": "メジャー", "tempo": 140.0, "verse": ["I", "vi", "IV", "V"], "chorus": ["vi", "IV", "I", "V"]},
+    {"key": "D", "scale": "マイナー", "tempo": 84.0, "verse": ["i", "iv", "VII", "III"], "chorus": ["VI", "VII", "i", "i"]},
+    {"key": "G", "scale": "メジャー", "tempo": 105.0, "verse": ["I", "IV", "ii", "V"], "chorus": ["I", "V", "IV", "IV"]},
+]
+BARS_PER_PART = 8
+BEATS_PER_BAR = 4
+
+# 判定の許容範囲
+TEMPO_TOLERANCE = 0.04  # テンポ: 正解との差 4% 以内
+CHORD_SAMPLE_STEP = 0.1  # コード正解率: この間隔（秒）で検出結果と正解を比べる
+
+
+# ============================================
+# 合成音源
+# ============================================
+
+def song_for_duration(index: int, duration: float) -> Dict:
+    """ケース番号と長さからベンチマークの曲設定を作る"""
+    song = dict(SONGS[index % len(SONGS)])
+    scale = "major" if song["scale"] == "メジャー" else "minor"
+    song["name"] = f"{int(duration)}s-{song['key']}-{scale}-{int(song['tempo'])}bpm"
+    song["duration"] = float(duration)
+    return song
+
+
+def chord_for_degree(key: str, scale: str, degree: str):
+    """スケール度数 → (ルート音, quality, コード名)"""
+    offset, quality = DIATONIC_CHORDS[scale][degree]
+    root = NOTE_NAMES[(NOTE_NAMES.index(key) + offset) % 12]
+    return root, quality, root + CHORD_TONES[quality][0]
+
+
+def midi_to_hz(note: float) -> float:
+    return 440.0 * 2 ** ((note - 69) / 12)
+
+
+def synthesize_bar(root: str, quality: str, bar_samples: int, beat_samples: int, amplitude: float):
+    """
+    1小節分の波形（和音パッド + ベース + キック・ハイハット）
+
+    Returns:
+        ndarray: bar_samples 長の float32 波形
+    """
+    t = np.arange(bar_samples) / SAMPLE_RATE
+    root_midi = 60 + NOTE_NAMES.index(root)
+    pad = np.zeros(bar_samples)
+    intervals = CHORD_TONES[quality][1]
+    for interval in intervals:
+        f = midi_to_hz(root_midi + interval)
+        pad += np.sin(2 * np.pi * f * t) + 0.3 * np.sin(4 * np.pi * f * t) + 0.1 * np.sin(6 * np.pi * f * t)
+    pad /= len(intervals)
+    bass = np.sin(2 * np.pi * midi_to_hz(root_midi - 24) * t)
+
+    drums = np.zeros(bar_samples)
+    rng = np.random.default_rng(SEED)  # 同じ長さの小節は同じドラムになるよう固定
+    kick_t = np.arange(min(beat_samples, int(0.15 * SAMPLE_RATE))) / SAMPLE_RATE
+    kick = np.sin(2 * np.pi * 60.0 * kick_t) * np.exp(-kick_t * 30.0)
+    hat = rng.standard_normal(min(beat_samples, int(0.03 * SAMPLE_RATE))) * np.linspace(1.0, 0.0, min(beat_samples, int(0.03 * SAMPLE_RATE)))
+    for beat in range(BEATS_PER_BAR):
+        start = beat * beat_samples
+        if start >= bar_samples:
+            break
+        if beat % 2 == 0:
+            drums[start:start + len(kick)] += kick[:bar_samples - start]
+        drums[start:start + len(hat)] += 0.4 * hat[:bar_samples - start]
+
+    return (amplitude * (0.6 * pad + 0.4 * bass) + 0.3 * drums).astype(np.float32)
+
+
+def synthesize_song(song: Dict, path: str) -> List[Dict]:
+    """
+    曲を合成して WAV（16bit）に書き出す
+
+    小節ごとに書き出すため、60分の曲でもメモリには数小節分しか載らない。
+
+    Returns:
+        List[Dict]: 正解のコード進行（startTime / endTime / chord / rootNote / quality）
+    """
+    rng = np.random.default_rng(SEED)
+    beat_samples = int(round(60.0 / song["tempo"] * SAMPLE_RATE))
+    bar_samples = beat_samples * BEATS_PER_BAR
+    total_samples = int(song["duration"] * SAMPLE_RATE)
+    bars_cache = {}
+    truth = []
+    written = 0
+    bar_index = 0
+    with sf.SoundFile(path, "w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16") as out:
+        while written < total_samples:
+            part = "chorus" if (bar_index // BARS_PER_PART) % 2 else "verse"
+            degrees = song[part]
+            root, quality, name = chord_for_degree(song["key"], song["scale"], degrees[bar_index % len(degrees)])
+            cache_key = (root, quality, part)
+            if cache_key not in bars_cache:
+                bars_cache[cache_key] = synthesize_bar(
+                    root, quality, bar_samples, beat_samples, 0.5 if part == "chorus" else 0.25
+                )
+            n = min(bar_samples, total_samples - written)
+            noise = rng.standard_normal(n).astype(np.float32) * 0.005
+            out.write(bars_cache[cache_key][:n] + noise)
+            truth.append({
+                "startTime": written / SAMPLE_RATE,
+                "endTime": (written + n) / SAMPLE_RATE,
+                "chord": name,
+                "rootNote": root,
+                "quality": quality,
+            })
+            written += n
+            bar_index += 1
+    return truth
+
+
+# ============================================
+# 計測
+# ============================================
+
+def current_rss_bytes() -> int:
+    """現在の RSS（/proc がない環境ではプロセスのピーク RSS）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Measurement:
+    """
+    with ブロックの wall 時間・CPU 時間（全スレッド）・ピーク RSS を計測する
+
+    RSS は別スレッドで RSS_SAMPLE_INTERVAL 秒ごとにサンプリングする。
+    """
+
+    RSS_SAMPLE_INTERVAL = 0.01
+
+    def __enter__(self):
+        self.peak_rss = current_rss_bytes()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = time.process_time() - self._cpu
+        self._stop.set()
+        self._sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+    def to_dict(self) -> Dict:
+        return {
+            "wallSeconds": round(self.wall_seconds, 4),
+            "cpuSeconds": round(self.cpu_seconds, 4),
+            "peakRssMb": round(self.peak_rss / (1024 * 1024), 1),
+        }
+
+
+# ============================================
+# 正解との比較
+# ============================================
+
+def key_accuracy(song: Dict, key: str, scale: str) -> Dict:
+    return {"detectedKey": f"{key} {scale}", "keyCorrect": key == song["key"] and scale == song["scale"]}
+
+
+def tempo_accuracy(song: Dict, tempo: float) -> Dict:
+    """テンポの誤差（倍・半分のテンポも正解とする tempoCorrectOctave を併記）"""
+    error = abs(tempo - song["tempo"]) / song["tempo"]
+    octave_error = min(abs(tempo * factor - song["tempo"]) / song["tempo"] for factor in (0.5, 1.0, 2.0))
+    return {
+        "detectedTempo": round(float(tempo), 2),
+        "tempoError": round(float(error), 4),
+        "tempoCorrect": bool(error <= TEMPO_TOLERANCE),
+        "tempoCorrectOctave": bool(octave_error <= TEMPO_TOLERANCE),
+    }
+
+
+def chord_accuracy(truth: List[Dict], chords: List[Dict], duration: float) -> Dict:
+    """
+    コード正解率（検出結果がある時間のうち、ルートと三和音の種類が正解と一致する割合）
+
+    chordExactAccuracy は sus・7th まで含めて quality が一致する割合。
+
+    Args:
+        truth: 正解のコード進行
+        chords: 検出されたコード進行（ChordInfo の dict）
+        duration: 曲の長さ（秒、coverage の分母）
+    """
+    truth_starts = np.array([c["startTime"] for c in truth])
+    correct = exact = total = 0
+    covered = 0.0
+    for chord in chords:
+        times = np.arange(chord["startTime"], chord["endTime"], CHORD_SAMPLE_STEP)
+        if len(times) == 0:
+            continue
+        covered += chord["endTime"] - chord["startTime"]
+        expected = [truth[i] for i in np.clip(np.searchsorted(truth_starts, times, side="right") - 1, 0, len(truth) - 1)]
+        triad = TRIAD_OF_QUALITY.get(chord["quality"], chord["quality"])
+        for e in expected:
+            if e["rootNote"] == chord["rootNote"]:
+                correct += TRIAD_OF_QUALITY[e["quality"]] == triad
+                exact += e["quality"] == chord["quality"]
+        total += len(times)
+    return {
+        "chordAccuracy": round(correct / total, 4) if total else 0.0,
+        "chordExactAccuracy": round(exact / total, 4) if total else 0.0,
+        "chordCoverage": round(min(1.0, covered / duration), 4) if duration > 0 else 0.0,
+    }
+
+
+def result_accuracy(song: Dict, truth: List[Dict], result) -> Dict:
+    metadata = result.metadata
+    return {
+        **key_accuracy(song, metadata.detectedKey, metadata.scale),
+        **tempo_accuracy(song, metadata.tempo),
+        **chord_accuracy(truth, [c.dict() for c in result.chordProgression], song["duration"]),
+    }
+
+
+# ============================================
+# ケースの実行（ケースごとに別プロセス）
+# ============================================
+
+def run_engines(song: Dict, truth: List[Dict], path: str, depths: List[str]) -> List[Dict]:
+    """解析エンジン全体（analyze_audio_librosa / analyze_audio_essentia）を計測する"""
+    runs = []
+    engines = [("librosa", main.analyze_audio_librosa)]
+    if main.ESSENTIA_AVAILABLE:
+        engines.append(("essentia", main.analyze_audio_essentia))
+    else:
+        runs.append({"engine": "essentia", "skipped": "essentia is not available (requires USE_ESSENTIA=true)"})
+
+    for engine, analyze in engines:
+        for depth in depths:
+            run = {"engine": engine, "depth": depth}
+            try:
+                with Measurement() as m:
+                    result = analyze(path, {"analysisDepth": depth, "separateStems": False})
+                run.update(m.to_dict())
+                run["accuracy"] = result_accuracy(song, truth, result)
+            except Exception as e:
+                run["error"] = str(e)
+            runs.append(run)
+    return runs
+
+
+def run_stages(song: Dict, truth: List[Dict], path: str) -> List[Dict]:
+    """
+    パイプラインの各ステージを単独で計測する
+
+    前のステージの結果を次のステージの入力に使う。コード検出はキー推定の誤りの影響を
+    受けないよう、正解のキーで行う。
+    """
+    stages = []
+
+    def stage(name: str, func, accuracy=None):
+        record = {"stage": name}
+        try:
+            with Measurement() as m:
+                value = func()
+            record.update(m.to_dict())
+            if accuracy is not None:
+                record["accuracy"] = accuracy(value)
+        except Exception as e:
+            record["error"] = str(e)
+            value = None
+        stages.append(record)
+        return value
+
+    y = main.DecodedAudio(path).at(SAMPLE_RATE)
+    sr = SAMPLE_RATE
+    duration = song["duration"]
+
+    segment = stage("select_loudest_segment", lambda: main.select_loudest_segment(y, sr))
+    separated = stage("separate_stems", lambda: main.separate_stems(y, sr, names=("harmonic", "percussive")))
+    if separated is None:
+        return stages
+    y_harmonic = separated[0]["harmonic"]
+    grid = stage(
+        "track_beat_grid",
+        lambda: main.track_beat_grid(separated[1], sr),
+        lambda g: tempo_accuracy(song, g["tempo"]),
+    )
+    stage(
+        "detect_keys_with_modulation",
+        lambda: main.detect_keys_with_modulation(y_harmonic, sr),
+        lambda keys: key_accuracy(song, keys[1], keys[2]),
+    )
+    if segment is not None and grid is not None:
+        _, start_time, end_time = segment
+        _, beats, bar_offset = main.slice_beat_grid(grid, start_time, end_time)
+        start, end = int(start_time * sr), int(end_time * sr)
+        stage(
+            "detect_chords_beat_synced",
+            lambda: main.detect_chords_beat_synced(
+                y_harmonic[start:end], sr, beats, song["key"], song["scale"], time_offset=start_time,
+                bar_offset=bar_offset,
+            ),
+            lambda chords: chord_accuracy(truth, [c.dict() for c in chords], end_time - start_time),
+        )
+
+    if main.ESSENTIA_AVAILABLE:
+        audio = main.DecodedAudio(path).at(44100)
+        key = stage(
+            "estimate_key_essentia",
+            lambda: main.estimate_key_essentia(audio),
+            lambda k: key_accuracy(song, k[0], k[1]),
+        )
+        rhythm = stage(
+            "detect_tempo_essentia",
+            lambda: main.detect_tempo_essentia(audio),
+            lambda r: tempo_accuracy(song, r[0]),
+        )
+        if key is not None and rhythm is not None:
+            stage(
+                "detect_chords_essentia",
+                lambda: main.detect_chords_essentia(audio, rhythm[1], song["key"], song["scale"]),
+                lambda chords: chord_accuracy(truth, [c.dict() for c in chords], duration),
+            )
+    return stages
+
+
+def run_case(song: Dict, work_dir: str, depths: List[str], stage_max_duration: float) -> Dict:
+    """1ケース（合成 → ウォームアップ → エンジン → ステージ）を実行する"""
+    path = str(Path(work_dir) / f"{song['name']}.wav")
+    started = time.perf_counter()
+    truth = synthesize_song(song, path)
+    synthesis_seconds = time.perf_counter() - started
+
+    warmup = main.warm_up_analysis()
+    case = {
+        "name": song["name"],
+        "duration": song["duration"],
+        "key": song["key"],
+        "scale": song["scale"],
+        "tempo": song["tempo"],
+        "progression": {
+            part: [chord_for_degree(song["key"], song["scale"], d)[2] for d in song[part]]
+            for part in ("verse", "chorus")
+        },
+        "synthesisSeconds": round(synthesis_seconds, 2),
+        "warmupSeconds": warmup["seconds"],
+        "runs": run_engines(song, truth, path, depths),
+    }
+    if song["duration"] <= stage_max_duration:
+        case["stages"] = run_stages(song, truth, path)
+    else:
+        case["stages"] = []
+        case["stagesSkipped"] = f"duration > {stage_max_duration:.0f}s"
+    Path(path).unlink(missing_ok=True)
+    return case
+
+
+# ============================================
+# 基準との比較
+# ============================================
+
+def find_regressions(report: Dict, baseline: Dict, tolerance: float, min_seconds: float) -> List[str]:
+    """
+    基準の結果と比べて遅くなった・精度が落ちた項目を列挙する
+
+    Args:
+        report: 今回の結果
+        baseline: 基準の結果（以前の benchmark.py の出力）
+        tolerance: wall 時間の許容増加率（0.2 = 20%）
+        min_seconds: これより小さい wall 時間の増加は無視する（計測ノイズ）
+    """
+    def index(data):
+        entries = {}
+        for case in data.get("cases", []):
+            for run in case.get("runs", []):
+                entries[(case["name"], run["engine"], run.get("depth"))] = run
+            for stage in case.get("stages", []):
+                entries[(case["name"], stage["stage"], None)] = stage
+        return entries
+
+    before = index(baseline)
+    regressions = []
+    for key, entry in index(report).items():
+        old = before.get(key)
+        if old is None or "wallSeconds" not in old or "wallSeconds" not in entry:
+            continue
+        label = " / ".join(str(k) for k in key if k is not None)
+        delta = entry["wallSeconds"] - old["wallSeconds"]
+        if delta > min_seconds and entry["wallSeconds"] > old["wallSeconds"] * (1 + tolerance):
+            regressions.append(f"{label}: wall {old['wallSeconds']:.2f}s → {entry['wallSeconds']:.2f}s")
+        old_acc, new_acc = old.get("accuracy", {}), entry.get("accuracy", {})
+        for flag in ("keyCorrect", "tempoCorrect"):
+            if old_acc.get(flag) and new_acc.get(flag) is False:
+                regressions.append(f"{label}: {flag} true → false")
+        for metric in ("chordAccuracy", "chordExactAccuracy"):
+            if metric in old_acc and new_acc.get(metric, 0.0) < old_acc[metric] - 0.05:
+                regressions.append(f"{label}: {metric} {old_acc[metric]:.2f} → {new_acc.get(metric, 0.0):.2f}")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="音源解析バックエンドのベンチマーク（合成音源）")
+    parser.add_argument("--durations", default=",".join(str(d) for d in DEFAULT_DURATIONS),
+                        help="音源の長さ（秒、カンマ区切り）")
+    parser.add_argument("--depths", default=",".join(DEFAULT_DEPTHS),
+                        help="解析の深さ（preview / basic / detailed、カンマ区切り）")
+    parser.add_argument("--output", default="benchmark.json", help="結果の JSON ファイル")
+    parser.add_argument("--baseline", help="比較する基準の JSON ファイル（遅くなった・精度が落ちた場合は終了コード 1）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="wall 時間の許容増加率（デフォルト 0.2 = 20%%）")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="無視する wall 時間の増加（秒）")
+    parser.add_argument("--stage-max-duration", type=float, default=STAGE_MAX_DURATION,
+                        help="ステージ単位の計測を行う音源の長さの上限（秒）")
+    parser.add_argument("--work-dir", help="合成音源の一時保存先（デフォルト: 一時ディレクトリ）")
+    args = parser.parse_args()
+
+    durations = [float(d) for d in args.durations.split(",") if d.strip()]
+    depths = [d.strip() for d in args.depths.split(",") if d.strip()]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark_")
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+
+    report = {
+        "benchmarkVersion": BENCHMARK_VERSION,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "gitCommit": git_commit(),
+        "pipelineVersion": main.ANALYSIS_PIPELINE_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "librosa": main.librosa.__version__,
+            "essentia": main.ESSENTIA_AVAILABLE,
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "analysisThreads": main.ANALYSIS_THREADS,
+        },
+        "cases": [],
+    }
+
+    try:
+        # ケースごとに新しいプロセスで実行する（ピーク RSS・JIT キャッシュを前のケースと分ける）
+        for i, duration in enumerate(durations):
+            song = song_for_duration(i, duration)
+            print(f"\n[Benchmark] Case {i + 1}/{len(durations)}: {song['name']}")
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                case = pool.submit(run_case, song, work_dir, depths, args.stage_max_duration).result()
+            report["cases"].append(case)
+            for run in case["runs"]:
+                if "wallSeconds" in run:
+                    acc = run["accuracy"]
+                    print(f"  ✓ {run['engine']}/{run['depth']}: {run['wallSeconds']:.2f}s wall, "
+                          f"{run['cpuSeconds']:.2f}s CPU, {run['peakRssMb']:.0f}MB, key={acc['keyCorrect']}, "
+                          f"tempo={acc['detectedTempo']}, chords={acc['chordAccuracy']:.2f}")
+                else:
+                    print(f"  ⚠ {run['engine']}: {run.get('skipped') or run.get('error')}")
+            for stage in case["stages"]:
+                if "wallSeconds" in stage:
+                    print(f"    {stage['stage']}: {stage['wallSeconds']:.3f}s wall, {stage['peakRssMb']:.0f}MB")
+                else:
+                    print(f"    ⚠ {stage['stage']}: {stage['error']}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"✗ {len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"✓ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -12,15 +12,33 @@ Phase 4 以降で実装予定：
 - テンポ・キー検出
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import collections
+import hashlib
+import json
+import multiprocessing
 import os
+import re
+import shutil
+import signal
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 import tempfile
+from urllib.parse import urlparse
 
 # 環境変数を読み込み
 load_dotenv()
@@ -58,8 +76,9 @@ app.add_middleware(
 
 class AnalysisOptions(BaseModel):
     """解析オプション"""
-    separateStems: bool = True
-    analysisDepth: str = "basic"  # "basic" | "detailed"
+    separateStems: bool = False  # true で stem を分離して AnalysisResult.stems に URL を返す（STEM_CACHE_ENABLED=true の場合のみ）
+    analysisDepth: str = "basic"  # "preview" | "basic" | "detailed"
+    timeBudgetMs: Optional[int] = None  # 指定すると analysisDepth を上限に、時間内に終わる最も詳細な段階を選ぶ
 
 
 class AnalyzeRequest(BaseModel):
@@ -86,6 +105,7 @@ class AnalysisMetadata(BaseModel):
     scale: str
     confidence: float
     detectedKeys: Optional[List[DetectedKeyInfo]] = None  # 複数キー検出時
+    analysisDepth: Optional[str] = None  # 実際に使われた解析の深さ（timeBudgetMs で下がる場合がある）
 
 
 class ChordInfo(BaseModel):
@@ -111,12 +131,36 @@ class ScaleMatchResult(BaseModel):
     matchingScales: List[ScaleMatchInfo]
 
 
+class AnalysisSection(BaseModel):
+    """コード検出を行った区間（セクション）"""
+    startTime: float
+    endTime: float
+    tempo: float
+    chordProgression: List[ChordInfo]
+    label: Optional[str] = None  # 構成ラベル（ANALYSIS_STRUCTURE 有効時、同じラベル = 繰り返し）
+
+
+class TempoPoint(BaseModel):
+    """テンポカーブの1点"""
+    time: float  # 秒
+    tempo: float  # BPM
+
+
+class BeatGrid(BaseModel):
+    """曲全体のビートグリッド"""
+    beats: List[float]  # ビート位置（秒）
+    downbeats: List[float]  # 小節頭のビート位置（秒）
+    tempoCurve: List[TempoPoint]
+
+
 class AnalysisResult(BaseModel):
     """解析結果"""
     metadata: AnalysisMetadata
     chordProgression: List[ChordInfo]
     scaleMatch: ScaleMatchResult
     stems: Optional[Dict[str, str]] = None
+    sections: Optional[List[AnalysisSection]] = None  # コード検出を行った区間（時刻順）
+    beatGrid: Optional[BeatGrid] = None  # 曲全体の打楽器成分がある場合のみ
 
 
 class AnalyzeResponse(BaseModel):
@@ -128,6 +172,19 @@ class AnalyzeResponse(BaseModel):
     error: Optional[str] = None
 
 
+class JobStatusResponse(BaseModel):
+    """非同期ジョブのステータスレスポンス"""
+    success: bool
+    jobId: str
+    status: str  # "queued" | "running" | "completed" | "failed" | "cancelled"
+    queuePosition: Optional[int] = None  # queued の場合のみ（0 = 次に実行）
+    createdAt: str  # ISO 8601
+    startedAt: Optional[str] = None
+    completedAt: Optional[str] = None
+    result: Optional[AnalysisResult] = None
+    error: Optional[str] = None
+
+
 # ============================================
 # 環境変数による解析モード切り替え
 # ============================================
@@ -135,6 +192,169 @@ class AnalyzeResponse(BaseModel):
 USE_REAL_ANALYSIS = os.getenv("USE_REAL_ANALYSIS", "true").lower() == "true"
 USE_ESSENTIA = os.getenv("USE_ESSENTIA", "false").lower() == "true"
 
+# 解析ワーカープロセスプール設定
+# - ANALYSIS_WORKERS: 同時に解析できるジョブ数（0 = プロセスプールを使わずスレッドで実行）
+# - ANALYSIS_MAX_TASKS_PER_CHILD: 1ワーカーが処理するジョブ数の上限（メモリリーク対策で再起動、0 = 無制限）
+# - ANALYSIS_JOB_TIMEOUT: 1ジョブあたりのタイムアウト秒数（0 = 無制限）
+# - ANALYSIS_THREADS: 1ジョブ内でブロック・区間の解析を並列に行うスレッド数
+#   （HPSS / CQT などの numpy・FFT 処理は GIL を解放する、デフォルトは CPUコア数をワーカー数で割った数）
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(min(2, os.cpu_count() or 1))))
+ANALYSIS_MAX_TASKS_PER_CHILD = int(os.getenv("ANALYSIS_MAX_TASKS_PER_CHILD", "20"))
+ANALYSIS_JOB_TIMEOUT = float(os.getenv("ANALYSIS_JOB_TIMEOUT", "300"))
+ANALYSIS_THREADS = max(1, int(os.getenv(
+    "ANALYSIS_THREADS", str((os.cpu_count() or 1) // max(1, ANALYSIS_WORKERS))
+)))
+
+# 非同期ジョブAPI設定
+# - JOB_QUEUE_MAX: 待機できるジョブ数の上限（超えると 429）
+# - JOB_RESULT_TTL: 完了/失敗したジョブを保持する秒数
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+
+# URLダウンロード設定
+# - DOWNLOAD_MAX_BYTES: ダウンロードできるファイルサイズの上限（超えると 413、0 = 無制限）
+# - DOWNLOAD_TIMEOUT: 読み込みタイムアウト（秒）
+# - DOWNLOAD_MAX_RETRIES: 接続が切れた場合に Range リクエストで再開する回数
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "3"))
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# 解析結果キャッシュ設定（同じ音源・同じ設定の再解析をスキップ）
+# - RESULT_CACHE_ENABLED: キャッシュの有効/無効
+# - RESULT_CACHE_DIR: キャッシュの保存先ディレクトリ
+# - RESULT_CACHE_MAX_BYTES: キャッシュ全体の上限サイズ（超えると古い順に削除）
+# - RESULT_CACHE_TTL: キャッシュの有効期限（秒）
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_DIR = Path(os.getenv("RESULT_CACHE_DIR", str(Path(__file__).parent / "cache" / "results")))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+
+# 長時間の録音（ライブ・アルバム・練習の録音）の分割処理
+# - ANALYSIS_CHUNKED_MIN_DURATION: これより長い音源は全体を読み込まず、ブロック単位で処理する
+#   （メモリ使用量が長さに依存しなくなる、0 = 常に全体を読み込む）
+ANALYSIS_CHUNKED_MIN_DURATION = float(os.getenv("ANALYSIS_CHUNKED_MIN_DURATION", "300"))
+
+# キー検出の範囲
+# - KEY_MODULATION_ANALYSIS: 曲全体をセグメント分割してキーを検出する（転調対応）。
+#   false の場合はコード検出区間だけで HPSS・キー検出を行う（全体の HPSS を省略して高速化）
+KEY_MODULATION_ANALYSIS = os.getenv("KEY_MODULATION_ANALYSIS", "true").lower() == "true"
+# - KEY_PROFILE: キー推定に使うプロファイル（krumhansl / temperley / bgate / simple）
+KEY_PROFILE = os.getenv("KEY_PROFILE", "krumhansl").lower()
+
+# Essentia エンジンで解析する範囲（計算量は ESSENTIA_EXCERPT_DURATION 秒分で一定）
+# - ESSENTIA_EXCERPT_MODE:
+#     loudest = 最も音量が大きい区間を解析
+#     windows = 曲全体から等間隔に ESSENTIA_EXCERPT_WINDOWS 個の区間を取り出して解析
+#     full    = キーは曲全体をストリーミングで解析（メモリ一定）、テンポ・コードは loudest と同じ区間
+# - ESSENTIA_EXCERPT_DURATION: 解析する長さの合計（秒）
+# - ESSENTIA_EXCERPT_WINDOWS: windows モードの区間数
+ESSENTIA_EXCERPT_MODE = os.getenv("ESSENTIA_EXCERPT_MODE", "loudest").lower()
+ESSENTIA_EXCERPT_DURATION = float(os.getenv("ESSENTIA_EXCERPT_DURATION", "60"))
+ESSENTIA_EXCERPT_WINDOWS = int(os.getenv("ESSENTIA_EXCERPT_WINDOWS", "3"))
+if ESSENTIA_EXCERPT_MODE not in ("loudest", "windows", "full"):
+    print(f"⚠ Unknown ESSENTIA_EXCERPT_MODE={ESSENTIA_EXCERPT_MODE}, using loudest")
+    ESSENTIA_EXCERPT_MODE = "loudest"
+
+# コード検出を行う区間の数
+# - ANALYSIS_SECTIONS: 音量の大きい順に、互いに重ならない30秒の区間を最大この数だけ選び、並列にコード検出する
+#   （サビだけでなく A メロやブリッジのコード進行も返す、1 = 最も音量が大きい区間のみ）
+ANALYSIS_SECTIONS = max(1, int(os.getenv("ANALYSIS_SECTIONS", "3")))
+# - ANALYSIS_STRUCTURE: 曲の構成（繰り返しセクション）を検出し、曲全体のコード進行を返す
+#   （ラベルごとに1回だけコード検出して繰り返しにコピー、曲全体を読み込む場合のみ。
+#     ANALYSIS_SECTIONS の区間選択の代わりに使う）
+ANALYSIS_STRUCTURE = os.getenv("ANALYSIS_STRUCTURE", "false").lower() == "true"
+
+# 解析の深さ（AnalysisOptions.analysisDepth）ごとの設定
+# - preview:  コード検出区間（1区間・20秒）だけで HPSS・キー推定、CQT は粗いホップ、三和音のみ
+#             （1オクターブ36ビンは保つ: 12ビンだと隣の半音に漏れてメジャー/マイナーを誤る）
+# - basic:    上記の環境変数どおり
+# - detailed: 全体の HPSS・転調検出（KEY_MODULATION_ANALYSIS に関わらず）、曲の構成検出による曲全体のコード進行
+#             （キーのセグメントは basic と同じ15秒: 10秒だと4小節ほどしか入らず、短調の曲を平行調と誤る）
+# cost は basic を 1 とした解析時間の比（timeBudgetMs の見積もりに使用）
+ANALYSIS_TIERS = {
+    "preview": {
+        "keyModulation": False,
+        "keySegmentDuration": 15.0,
+        "sections": 1,
+        "sectionDuration": 20.0,
+        "structure": False,
+        "hopLength": 1024,
+        "binsPerOctave": 36,
+        "chordVocabulary": "triads",
+        "essentiaExcerptDuration": min(30.0, ESSENTIA_EXCERPT_DURATION),
+        "cost": 0.3,
+    },
+    "basic": {
+        "keyModulation": KEY_MODULATION_ANALYSIS,
+        "keySegmentDuration": 15.0,
+        "sections": ANALYSIS_SECTIONS,
+        "sectionDuration": 30.0,
+        "structure": ANALYSIS_STRUCTURE,
+        "hopLength": 512,
+        "binsPerOctave": 36,
+        "chordVocabulary": "full",
+        "essentiaExcerptDuration": ESSENTIA_EXCERPT_DURATION,
+        "cost": 1.0,
+    },
+    "detailed": {
+        "keyModulation": True,
+        "keySegmentDuration": 15.0,
+        "sections": max(3, ANALYSIS_SECTIONS),
+        "sectionDuration": 30.0,
+        "structure": True,
+        "hopLength": 512,
+        "binsPerOctave": 36,
+        "chordVocabulary": "full",
+        "essentiaExcerptDuration": max(120.0, ESSENTIA_EXCERPT_DURATION),
+        "cost": 1.3,
+    },
+}
+ANALYSIS_TIER_ORDER = ["preview", "basic", "detailed"]  # 簡易 → 詳細
+
+# 起動時ウォームアップ（numba の JIT コンパイルやフィルタバンク生成を最初のリクエスト前に済ませる）
+# - ANALYSIS_WARMUP: 起動時に短い合成音源で解析パイプラインを1回実行する（完了するまで /ready は 503）
+ANALYSIS_WARMUP = os.getenv("ANALYSIS_WARMUP", "true").lower() == "true"
+
+# アドミッション制御（同時解析数・メモリ使用量の上限）
+# - ANALYSIS_MAX_DURATION: 受け付ける音源の最大長（秒、超えると 413、0 = 無制限）
+#   ブロック単位で処理する音源（ANALYSIS_CHUNKED_MIN_DURATION より長い）には適用しない
+# - ADMISSION_MEMORY_BUDGET_MB: 解析ワーカー全体で使ってよいメモリ（MB）
+# - ADMISSION_WORKER_BASE_MB: 解析ワーカー1つが常駐で使うメモリ（MB、librosa/numba の読み込み分）
+# - ADMISSION_MB_PER_AUDIO_SECOND: 音源1秒あたりの解析用メモリ（MB、22050Hz モノラル換算）
+# - ADMISSION_SECONDS_PER_AUDIO_SECOND: 音源1秒あたりの解析時間（秒、Retry-After の見積もりに使用）
+# - ADMISSION_WAIT_TIMEOUT: /analyze が空きを待つ秒数（超えると 429、0 = 待たずに 429）
+# - ADMISSION_MAX_WAITING: 空きを待てるリクエスト数の上限（超えると即 429）
+ANALYSIS_MAX_DURATION = float(os.getenv("ANALYSIS_MAX_DURATION", "600"))
+ADMISSION_MEMORY_BUDGET_MB = float(os.getenv("ADMISSION_MEMORY_BUDGET_MB", "1200"))
+ADMISSION_WORKER_BASE_MB = float(os.getenv("ADMISSION_WORKER_BASE_MB", "250"))
+ADMISSION_MB_PER_AUDIO_SECOND = float(os.getenv("ADMISSION_MB_PER_AUDIO_SECOND", "2.5"))
+ADMISSION_SECONDS_PER_AUDIO_SECOND = float(os.getenv("ADMISSION_SECONDS_PER_AUDIO_SECOND", "0.3"))
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "30"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "16"))
+
+# デコード済みPCMキャッシュ設定（別の設定・エンジンで再解析する際にデコードをスキップ）
+# - PCM_CACHE_ENABLED: キャッシュの有効/無効
+# - PCM_CACHE_DIR: キャッシュの保存先ディレクトリ
+# - PCM_CACHE_MAX_BYTES: キャッシュ全体の上限サイズ（超えると古い順に削除）
+PCM_CACHE_ENABLED = os.getenv("PCM_CACHE_ENABLED", "true").lower() == "true"
+PCM_CACHE_DIR = Path(os.getenv("PCM_CACHE_DIR", str(Path(__file__).parent / "cache" / "pcm")))
+PCM_CACHE_MAX_BYTES = int(os.getenv("PCM_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# stem 分離結果のキャッシュ設定（options.separateStems、分離結果を FLAC で保存して GET /stems/... で返す）
+# - STEM_CACHE_ENABLED: stem 分離・キャッシュの有効/無効（無効の場合 separateStems は無視される）
+#   stem 分離は bass・residual の計算と FLAC 書き込みの分だけ初回解析が遅くなるため、
+#   separateStems=true を指定したリクエストだけで行う（separateStems のデフォルトは false）
+# - STEM_CACHE_DIR: キャッシュの保存先ディレクトリ
+# - STEM_CACHE_MAX_BYTES: キャッシュ全体の上限サイズ（超えると古い順に削除）
+STEM_CACHE_ENABLED = os.getenv("STEM_CACHE_ENABLED", "true").lower() == "true"
+STEM_CACHE_DIR = Path(os.getenv("STEM_CACHE_DIR", str(Path(__file__).parent / "cache" / "stems")))
+STEM_CACHE_MAX_BYTES = int(os.getenv("STEM_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 解析パイプラインのバージョン
+# 解析結果が変わる変更を入れたら上げる（古いキャッシュが使われなくなる）
+ANALYSIS_PIPELINE_VERSION = "17"
+
 print("=" * 60)
 print("🎵 Audio Analysis API - Startup")
 print("=" * 60)
@@ -143,6 +363,21 @@ if USE_REAL_ANALYSIS:
     print(f"  Engine: {'Essentia (高精度)' if USE_ESSENTIA else 'librosa (標準)'}")
 print(f"Environment: USE_REAL_ANALYSIS={os.getenv('USE_REAL_ANALYSIS', 'not set')}")
 print(f"Environment: USE_ESSENTIA={os.getenv('USE_ESSENTIA', 'not set')}")
+print(f"Worker Pool: workers={ANALYSIS_WORKERS}, max_tasks_per_child={ANALYSIS_MAX_TASKS_PER_CHILD}, timeout={ANALYSIS_JOB_TIMEOUT:.0f}s, threads/job={ANALYSIS_THREADS}")
+print(f"Job Queue: max={JOB_QUEUE_MAX}, result_ttl={JOB_RESULT_TTL:.0f}s")
+print(f"Download: max={DOWNLOAD_MAX_BYTES // (1024 * 1024)}MB, timeout={DOWNLOAD_TIMEOUT:.0f}s, retries={DOWNLOAD_MAX_RETRIES}")
+print(f"PCM Cache: {'enabled' if PCM_CACHE_ENABLED else 'disabled'} ({PCM_CACHE_DIR}, max={PCM_CACHE_MAX_BYTES // (1024 * 1024)}MB)")
+print(f"Stem Cache: {'enabled' if STEM_CACHE_ENABLED else 'disabled'} ({STEM_CACHE_DIR}, max={STEM_CACHE_MAX_BYTES // (1024 * 1024)}MB)")
+print(f"Chunked Pipeline: {'disabled' if ANALYSIS_CHUNKED_MIN_DURATION <= 0 else f'audio longer than {ANALYSIS_CHUNKED_MIN_DURATION:.0f}s'}")
+print(f"Key Detection: {'full track (modulation analysis)' if KEY_MODULATION_ANALYSIS else 'selected segment only'}, profile={KEY_PROFILE}")
+if USE_ESSENTIA:
+    print(f"Essentia Excerpt: mode={ESSENTIA_EXCERPT_MODE}, duration={ESSENTIA_EXCERPT_DURATION:.0f}s" + (f", windows={ESSENTIA_EXCERPT_WINDOWS}" if ESSENTIA_EXCERPT_MODE == "windows" else ""))
+print(f"Chord Sections: up to {ANALYSIS_SECTIONS} x 30s")
+print(f"Song Structure: {'full track with repeat detection' if ANALYSIS_STRUCTURE else 'disabled'}")
+print(f"Analysis Depths: {' / '.join(ANALYSIS_TIER_ORDER)} (default basic)")
+print(f"Warm-up: {'enabled' if ANALYSIS_WARMUP else 'disabled'}")
+print(f"Admission: max_duration={ANALYSIS_MAX_DURATION:.0f}s, memory_budget={ADMISSION_MEMORY_BUDGET_MB:.0f}MB, wait_timeout={ADMISSION_WAIT_TIMEOUT:.0f}s, max_waiting={ADMISSION_MAX_WAITING}")
+print(f"Result Cache: {'enabled' if RESULT_CACHE_ENABLED else 'disabled'} ({RESULT_CACHE_DIR}, max={RESULT_CACHE_MAX_BYTES // (1024 * 1024)}MB, ttl={RESULT_CACHE_TTL:.0f}s)")
 
 # librosa/essentiaは実解析モードでのみインポート（依存関係を減らすため）
 ESSENTIA_AVAILABLE = False
@@ -151,6 +386,10 @@ if USE_REAL_ANALYSIS:
     try:
         import librosa
         import numpy as np
+        import soundfile as sf
+        import scipy.cluster.vq
+        import scipy.ndimage
+        import scipy.sparse.csgraph
         print("✓ librosa loaded successfully")
         print("✓ numpy loaded successfully")
     except ImportError as e:
@@ -161,7 +400,9 @@ if USE_REAL_ANALYSIS:
     # Essentiaのインポートを試行
     if USE_ESSENTIA:
         try:
+            import essentia
             import essentia.standard as es
+            import essentia.streaming as ess
             ESSENTIA_AVAILABLE = True
             print("✓ essentia loaded successfully")
         except ImportError as e:
@@ -178,72 +419,1696 @@ else:
 # ユーティリティ関数
 # ============================================
 
-def download_file_if_url(file_path: str) -> str:
+_download_session: Optional[requests.Session] = None
+_download_session_lock = threading.Lock()
+
+
+def get_download_session() -> requests.Session:
+    """
+    URLダウンロード用の共有セッションを取得（コネクションプール + keep-alive）
+
+    同じストレージ（Vercel Blob など）への接続を使い回し、
+    リクエストごとのTCP/TLSハンドシェイクを省く。
+    """
+    global _download_session
+
+    with _download_session_lock:
+        if _download_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=max(4, ANALYSIS_WORKERS * 2),
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _download_session = session
+        return _download_session
+
+
+def _download_too_large(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File is too large: {size} bytes (max {DOWNLOAD_MAX_BYTES} bytes)"
+    )
+
+
+def download_file_if_url(file_path: str) -> Tuple[str, Optional[str]]:
     """
     URLの場合はダウンロードして一時ファイルに保存、
     ローカルパスの場合はそのまま返す
 
+    ダウンロードはチャンク単位でディスクに直接書き込み（全体をメモリに載せない）、
+    同時にSHA-256を計算する。途中で接続が切れた場合は Range リクエストで続きから再開する。
+
     Args:
         file_path: ファイルパスまたはURL
 
     Returns:
-        str: ローカルファイルパス
+        Tuple[str, Optional[str]]: (ローカルファイルパス, SHA-256)
+            ローカルパスの場合はハッシュ未計算のため None
+
+    Raises:
+        HTTPException: ダウンロード失敗（400）、サイズ上限超過（413）
     """
     # URLかどうかを判定
-    if file_path.startswith('http://') or file_path.startswith('https://'):
-        print(f"  → Downloading file from URL: {file_path}")
+    if not (file_path.startswith('http://') or file_path.startswith('https://')):
+        # ローカルパスの場合はそのまま返す
+        print(f"  → Using local file: {file_path}")
+        return file_path, None
+
+    print(f"  → Downloading file from URL: {file_path}")
+
+    # 拡張子を取得（URLのパス部分から、クエリパラメータは除外）
+    ext = Path(urlparse(file_path).path).suffix or '.mp3'
+
+    session = get_download_session()
+    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
+    local_path = tmp_file.name
+    digest = hashlib.sha256()
+    downloaded = 0
+    attempt = 0
+
+    try:
+        with tmp_file:
+            while True:
+                headers = {"Range": f"bytes={downloaded}-"} if downloaded > 0 else {}
+
+                try:
+                    with session.get(
+                        file_path,
+                        headers=headers,
+                        stream=True,
+                        timeout=(10, DOWNLOAD_TIMEOUT),
+                    ) as response:
+                        response.raise_for_status()
+
+                        if downloaded > 0 and response.status_code != 206:
+                            # Range 非対応のサーバーは最初からやり直す
+                            print(f"    ⚠ Server ignored Range request, restarting download")
+                            tmp_file.seek(0)
+                            tmp_file.truncate()
+                            digest = hashlib.sha256()
+                            downloaded = 0
+
+                        # Content-Length で事前にサイズを確認
+                        content_length = response.headers.get("Content-Length")
+                        if content_length is not None and content_length.isdigit():
+                            expected_total = downloaded + int(content_length)
+                            if DOWNLOAD_MAX_BYTES > 0 and expected_total > DOWNLOAD_MAX_BYTES:
+                                raise _download_too_large(expected_total)
+
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            downloaded += len(chunk)
+                            # Content-Length がない/偽っている場合もストリーム中に上限を確認
+                            if DOWNLOAD_MAX_BYTES > 0 and downloaded > DOWNLOAD_MAX_BYTES:
+                                raise _download_too_large(downloaded)
+                            tmp_file.write(chunk)
+                            digest.update(chunk)
+                    break
+
+                except (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout,
+                ) as e:
+                    attempt += 1
+                    if attempt > DOWNLOAD_MAX_RETRIES:
+                        raise
+                    print(f"    ⚠ Download interrupted at {downloaded} bytes ({e.__class__.__name__}), retrying ({attempt}/{DOWNLOAD_MAX_RETRIES})...")
+                    time.sleep(min(2.0 ** attempt, 10.0))
+
+        print(f"  → Downloaded to: {local_path} ({downloaded} bytes)")
+        return local_path, digest.hexdigest()
+
+    except HTTPException:
+        Path(local_path).unlink(missing_ok=True)
+        raise
+
+    except requests.RequestException as e:
+        Path(local_path).unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to download file from URL: {str(e)}"
+        )
+
+    except BaseException:
+        Path(local_path).unlink(missing_ok=True)
+        raise
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    ファイル内容のSHA-256を計算（チャンク単位で読み込むためメモリを消費しない）
+
+    Args:
+        file_path: ファイルパス
+        chunk_size: 読み込み単位（バイト）
+
+    Returns:
+        str: 16進数のハッシュ値
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ============================================
+# 解析結果キャッシュ（コンテンツアドレス方式）
+# ============================================
+#
+# キー: 音源ファイルのSHA-256 + 解析エンジン + 解析オプション + パイプラインバージョン
+# 1エントリ = 1 JSONファイル。ヒット時に mtime を更新し、容量超過時は mtime の古い順に削除（LRU）。
+# 書き込みは一時ファイル → os.replace で行うため、複数プロセスから同時に使っても壊れない。
+
+_result_cache_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "errors": 0}
+_result_cache_lock = threading.Lock()
+
+
+def _count_result_cache(stat: str, n: int = 1):
+    with _result_cache_lock:
+        _result_cache_stats[stat] += n
 
+
+def get_analysis_engine() -> str:
+    """現在の設定で使われる解析エンジン名"""
+    if not USE_REAL_ANALYSIS:
+        return "dummy"
+    return "essentia" if ESSENTIA_AVAILABLE else "librosa"
+
+
+def result_cache_key(audio_hash: str, options: Dict) -> str:
+    """
+    解析結果キャッシュのキーを生成
+
+    Args:
+        audio_hash: 音源ファイルのSHA-256
+        options: 解析オプション
+
+    Returns:
+        str: キャッシュキー（SHA-256）
+    """
+    key_source = json.dumps({
+        "audio": audio_hash,
+        "engine": get_analysis_engine(),
+        "options": options,
+        "keyModulation": KEY_MODULATION_ANALYSIS,
+        "keyProfile": KEY_PROFILE,
+        "sections": ANALYSIS_SECTIONS,
+        "structure": ANALYSIS_STRUCTURE,
+        "chunkedMinDuration": ANALYSIS_CHUNKED_MIN_DURATION,
+        "stems": STEM_CACHE_ENABLED,
+        "essentiaExcerpt": [ESSENTIA_EXCERPT_MODE, ESSENTIA_EXCERPT_DURATION, ESSENTIA_EXCERPT_WINDOWS],
+        "version": ANALYSIS_PIPELINE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def _result_cache_path(key: str) -> Path:
+    return RESULT_CACHE_DIR / f"{key}.json"
+
+
+def result_cache_get(key: str) -> Optional[AnalysisResult]:
+    """
+    キャッシュから解析結果を取得
+
+    Returns:
+        Optional[AnalysisResult]: ヒットしなかった/期限切れの場合は None
+    """
+    path = _result_cache_path(key)
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        _count_result_cache("misses")
+        return None
+    except (OSError, ValueError) as e:
+        print(f"  ⚠ Result cache read failed: {e}")
+        _count_result_cache("errors")
+        _count_result_cache("misses")
+        path.unlink(missing_ok=True)
+        return None
+
+    if RESULT_CACHE_TTL > 0 and time.time() - entry.get("storedAt", 0) > RESULT_CACHE_TTL:
+        _count_result_cache("expired")
+        _count_result_cache("misses")
+        path.unlink(missing_ok=True)
+        return None
+
+    # stem の参照先がキャッシュから削除されている場合は解析し直す（stem を作り直す）
+    stems = entry["result"].get("stems")
+    if stems and not all(stem_cache_path(*url.split("/")[-2:]) for url in stems.values()):
+        _count_result_cache("misses")
+        path.unlink(missing_ok=True)
+        return None
+
+    # LRU用にアクセス時刻を更新
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    _count_result_cache("hits")
+    return AnalysisResult(**entry["result"])
+
+
+def result_cache_put(key: str, result: AnalysisResult):
+    """解析結果をキャッシュに保存し、容量超過分を削除"""
+    try:
+        RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = _result_cache_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "storedAt": time.time(),
+                "version": ANALYSIS_PIPELINE_VERSION,
+                "result": result.dict(),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"  ⚠ Result cache write failed: {e}")
+        _count_result_cache("errors")
+        return
+
+    evict_result_cache()
+
+
+def _scan_result_cache() -> List[tuple]:
+    """キャッシュエントリの一覧 [(mtime, size, path), ...] を取得"""
+    entries = []
+    if not RESULT_CACHE_DIR.exists():
+        return entries
+    for path in RESULT_CACHE_DIR.glob("*.json"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def evict_result_cache():
+    """RESULT_CACHE_MAX_BYTES を超えた分を最終アクセスの古い順に削除"""
+    entries = _scan_result_cache()
+    total_bytes = sum(size for _, size, _ in entries)
+    if total_bytes <= RESULT_CACHE_MAX_BYTES:
+        return
+
+    entries.sort(key=lambda e: e[0])
+    for _, size, path in entries:
+        if total_bytes <= RESULT_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total_bytes -= size
+        _count_result_cache("evictions")
+
+
+def result_cache_stats() -> Dict:
+    """キャッシュの統計情報"""
+    entries = _scan_result_cache()
+    with _result_cache_lock:
+        stats = dict(_result_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "enabled": RESULT_CACHE_ENABLED,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "maxBytes": RESULT_CACHE_MAX_BYTES,
+        "ttl": RESULT_CACHE_TTL,
+        "pipelineVersion": ANALYSIS_PIPELINE_VERSION,
+        "hitRate": stats["hits"] / lookups if lookups else 0.0,
+        **stats,
+    }
+
+
+# ============================================
+# デコード済みPCMキャッシュ（np.memmap で読み込み）
+# ============================================
+#
+# キー: 音源ファイルのSHA-256 + サンプルレート。モノラル float32 の生データ（.f32）を1ファイルずつ保存する
+# （ヘッダーが無いため、長時間の録音をブロック単位でデコードしながら追記できる）。
+# 読み込みは np.memmap で行うため、曲全体をプロセスのメモリにコピーせず、
+# 必要な区間だけがページキャッシュ経由で読まれる。
+# 書き込みは一時ファイル → os.replace、削除は unlink のみなので、複数ワーカーから同時に読んでも壊れない
+# （削除されたファイルも、既に開いている memmap からは読み続けられる）。
+
+def _pcm_cache_path(audio_hash: str, sr: int) -> Path:
+    return PCM_CACHE_DIR / f"{audio_hash}_{sr}.f32"
+
+
+def pcm_cache_get(audio_hash: str, sr: int):
+    """
+    キャッシュからデコード済みPCMを取得
+
+    Returns:
+        Optional[np.memmap]: 読み取り専用の memmap（ヒットしなかった場合は None）
+    """
+    path = _pcm_cache_path(audio_hash, sr)
+    try:
+        y = np.memmap(path, dtype=np.float32, mode="r")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"    ⚠ PCM cache read failed: {e}")
+        path.unlink(missing_ok=True)
+        return None
+
+    # LRU用にアクセス時刻を更新
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return y
+
+
+def pcm_cache_put(audio_hash: str, sr: int, y) -> None:
+    """デコード済みPCMをキャッシュに保存し、容量超過分を削除"""
+    try:
+        PCM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = _pcm_cache_path(audio_hash, sr)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.asarray(y, dtype=np.float32).tofile(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"    ⚠ PCM cache write failed: {e}")
+        return
+
+    evict_pcm_cache()
+
+
+def _scan_pcm_cache() -> List[tuple]:
+    """キャッシュエントリの一覧 [(mtime, size, path), ...] を取得"""
+    entries = []
+    if not PCM_CACHE_DIR.exists():
+        return entries
+    for path in PCM_CACHE_DIR.glob("*.f32"):
         try:
-            # URLからファイルをダウンロード
-            response = requests.get(file_path, timeout=30)
-            response.raise_for_status()
-
-            # 拡張子を取得（URLから）
-            ext = '.mp3'  # デフォルト
-            if '.' in file_path:
-                ext = '.' + file_path.split('.')[-1].split('?')[0]  # クエリパラメータを除去
-
-            # 一時ファイルに保存
-            with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp_file:
-                tmp_file.write(response.content)
-                local_path = tmp_file.name
-
-            print(f"  → Downloaded to: {local_path} ({len(response.content)} bytes)")
-            return local_path
-
-        except requests.RequestException as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to download file from URL: {str(e)}"
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def evict_pcm_cache():
+    """PCM_CACHE_MAX_BYTES を超えた分を最終アクセスの古い順に削除"""
+    entries = _scan_pcm_cache()
+    total_bytes = sum(size for _, size, _ in entries)
+    if total_bytes <= PCM_CACHE_MAX_BYTES:
+        return
+
+    entries.sort(key=lambda e: e[0])
+    for _, size, path in entries:
+        if total_bytes <= PCM_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total_bytes -= size
+
+
+def pcm_cache_stats() -> Dict:
+    """PCMキャッシュの使用状況"""
+    entries = _scan_pcm_cache()
+    return {
+        "enabled": PCM_CACHE_ENABLED,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "maxBytes": PCM_CACHE_MAX_BYTES,
+    }
+
+
+# ============================================
+# stem キャッシュ（分離結果を FLAC で保存し、参照で返す）
+# ============================================
+#
+# キー: 音源ファイルのSHA-256 + サンプルレート + 分離方式のバージョン。1エントリ = 1ディレクトリで、
+# stem ごとに FLAC（16bit、可逆圧縮）を置く。一時ディレクトリに書いてから os.replace で置き換えるため、
+# 読み手から書きかけのエントリは見えない。解析結果の stems にはファイルではなく URL（GET /stems/...）を返す。
+
+STEM_NAMES = ("harmonic", "percussive", "bass", "residual")
+STEM_SEPARATION_VERSION = "1"  # 分離方式を変えたら上げる（古いキャッシュが使われなくなる）
+STEM_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}_\d+_v\w+$")
+
+
+def stem_cache_key(audio_hash: str, sr: int) -> str:
+    return f"{audio_hash}_{sr}_v{STEM_SEPARATION_VERSION}"
+
+
+def _stem_cache_dir(key: str) -> Path:
+    return STEM_CACHE_DIR / key
+
+
+def stem_cache_path(key: str, name: str) -> Optional[Path]:
+    """キャッシュ済みの stem ファイルのパス（不正なキー・存在しない場合は None）"""
+    if not STEM_KEY_PATTERN.match(key) or name not in STEM_NAMES:
+        return None
+    path = _stem_cache_dir(key) / f"{name}.flac"
+    return path if path.exists() else None
+
+
+def stem_urls(key: str) -> Dict[str, str]:
+    """解析結果に入れる stem の参照（GET /stems/{key}/{name} の URL）"""
+    return {name: f"/stems/{key}/{name}" for name in STEM_NAMES}
+
+
+def stem_cache_get(key: str) -> bool:
+    """すべての stem がキャッシュにあるか（ある場合は LRU 用にアクセス時刻を更新）"""
+    entry_dir = _stem_cache_dir(key)
+    if not all((entry_dir / f"{name}.flac").exists() for name in STEM_NAMES):
+        return False
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    return True
+
+
+def stem_cache_load(key: str, name: str) -> "np.ndarray":
+    """キャッシュ済みの stem を読み込む（float32 モノラル）"""
+    y, _ = sf.read(str(_stem_cache_dir(key) / f"{name}.flac"), dtype="float32")
+    return y
+
+
+def stem_cache_put(key: str, stems: Dict[str, "np.ndarray"], sr: int) -> bool:
+    """
+    stem をキャッシュに保存し、容量超過分を削除
+
+    Returns:
+        bool: 保存できたか（別のワーカーが先に保存した場合も True）
+    """
+    entry_dir = _stem_cache_dir(key)
+    tmp_dir = STEM_CACHE_DIR / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for name in STEM_NAMES:
+            sf.write(
+                str(tmp_dir / f"{name}.flac"), np.clip(stems[name], -1.0, 1.0), sr,
+                format="FLAC", subtype="PCM_16"
             )
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # 別のワーカーが同じ音源の stem を先に保存した
+            if not stem_cache_get(key):
+                raise
+    except OSError as e:
+        print(f"    ⚠ Stem cache write failed: {e}")
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict_stem_cache()
+    return True
+
+
+def _scan_stem_cache() -> List[tuple]:
+    """キャッシュエントリの一覧 [(mtime, size, path), ...] を取得"""
+    entries = []
+    if not STEM_CACHE_DIR.exists():
+        return entries
+    for path in STEM_CACHE_DIR.iterdir():
+        if not STEM_KEY_PATTERN.match(path.name):
+            continue
+        try:
+            mtime = path.stat().st_mtime
+            size = sum(f.stat().st_size for f in path.iterdir())
+        except FileNotFoundError:
+            continue
+        entries.append((mtime, size, path))
+    return entries
+
+
+def evict_stem_cache():
+    """STEM_CACHE_MAX_BYTES を超えた分を最終アクセスの古い順に削除"""
+    entries = _scan_stem_cache()
+    total_bytes = sum(size for _, size, _ in entries)
+    if total_bytes <= STEM_CACHE_MAX_BYTES:
+        return
+
+    entries.sort(key=lambda e: e[0])
+    for _, size, path in entries:
+        if total_bytes <= STEM_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+
+
+def stem_cache_stats() -> Dict:
+    """stem キャッシュの使用状況"""
+    entries = _scan_stem_cache()
+    return {
+        "enabled": STEM_CACHE_ENABLED,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "maxBytes": STEM_CACHE_MAX_BYTES,
+    }
+
+
+# ============================================
+# アドミッション制御（解析コストの見積もりと受付）
+# ============================================
+#
+# 音源をデコードせずにヘッダーから長さ・サンプルレートを読み取り、解析に必要なメモリと時間を見積もる。
+# 実行中の解析の見積もり合計が ADMISSION_MEMORY_BUDGET_MB を超える場合や、
+# ワーカーがすべて埋まっている場合は空きが出るまで待たせ、待ちきれない場合は 429 を返す。
+# 受付状態はイベントループ上でのみ更新するためロック不要。
+
+_admission_running: Dict[int, dict] = {}  # チケットID → 実行中の解析の見積もり
+_admission_waiters: collections.deque = collections.deque()  # (チケットID, 見積もり, Future) の待ち行列（先着順）
+_admission_next_ticket = 0
+
+
+def probe_audio_header(file_path: str) -> Dict:
+    """
+    音源ファイルのヘッダーから長さ・サンプルレート・チャンネル数を取得（デコードしない）
+
+    soundfile で読めない形式（m4a など）はファイルサイズから長さを推定する。
+
+    Returns:
+        Dict: duration（秒）, sampleRate, channels, estimated（推定値なら True）
+    """
+    try:
+        info = sf.info(file_path)
+        if info.frames > 0 and info.samplerate > 0:
+            return {
+                "duration": info.frames / info.samplerate,
+                "sampleRate": int(info.samplerate),
+                "channels": int(info.channels),
+                "estimated": False,
+            }
+    except Exception as e:
+        print(f"  ⚠ Could not read audio header ({e}), estimating duration from file size")
+
+    # 128kbps 相当として推定（低めのビットレートを仮定して長めに見積もる）
+    size = Path(file_path).stat().st_size
+    return {
+        "duration": size * 8 / 128_000,
+        "sampleRate": 44100,
+        "channels": 2,
+        "estimated": True,
+    }
+
+
+def is_chunked_duration(duration: float) -> bool:
+    """ANALYSIS_CHUNKED_MIN_DURATION より長く、ブロック単位で処理する音源か"""
+    return ANALYSIS_CHUNKED_MIN_DURATION > 0 and duration > ANALYSIS_CHUNKED_MIN_DURATION
+
+
+def estimate_analysis_cost(probe: Dict, time_factor: float = 1.0) -> Dict:
+    """
+    ヘッダー情報から解析に必要なメモリ（MB）と時間（秒）を見積もる
+
+    メモリは解析用（22050Hz モノラル換算）に加え、リサンプリング前のデコード結果（float32）を含める。
+    ANALYSIS_CHUNKED_MIN_DURATION を超える音源はブロック単位で処理するため、長さに関係なく一定とする。
+    時間は time_factor（解析の深さの cost）倍する。
+    """
+    duration = probe["duration"]
+    if is_chunked_duration(duration):
+        # ブロック単位で処理する長い音源は、ブロック（余白込み）+ コード検出区間の約60秒分で一定
+        working_seconds, decoded_seconds = 60.0, 10.0
     else:
-        # ローカルパスの場合はそのまま返す
-        print(f"  → Using local file: {file_path}")
-        return file_path
+        working_seconds, decoded_seconds = duration, duration
+    decoded_mb = decoded_seconds * probe["sampleRate"] * probe["channels"] * 4 / (1024 * 1024)
+    return {
+        "duration": duration,
+        "memoryMb": working_seconds * ADMISSION_MB_PER_AUDIO_SECOND + decoded_mb,
+        "expectedSeconds": duration * ADMISSION_SECONDS_PER_AUDIO_SECOND * time_factor,
+    }
+
+
+def check_max_duration(probe: Dict):
+    """
+    ANALYSIS_MAX_DURATION を超える音源を拒否（librosa.load の前に呼ぶ）
+
+    ファイルサイズからの推定値では拒否しない（ビットレート次第で大きく外れるため）。
+    ブロック単位で処理する音源（ANALYSIS_CHUNKED_MIN_DURATION より長い）はメモリ使用量が
+    長さに依存しないため、最大長を適用しない。
+
+    Raises:
+        HTTPException: 最大長を超えている場合（413）
+    """
+    if is_chunked_duration(probe["duration"]):
+        return
+    if ANALYSIS_MAX_DURATION > 0 and not probe["estimated"] and probe["duration"] > ANALYSIS_MAX_DURATION:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio is too long ({probe['duration']:.0f}s). Maximum duration is {ANALYSIS_MAX_DURATION:.0f}s."
+        )
+
+
+def _admission_memory_available() -> float:
+    """実行中の解析に割り当てられる残りメモリ（MB）"""
+    resident = max(1, ANALYSIS_WORKERS) * ADMISSION_WORKER_BASE_MB
+    in_use = sum(t["memoryMb"] for t in _admission_running.values())
+    return ADMISSION_MEMORY_BUDGET_MB - resident - in_use
+
+
+def _admission_fits(cost: Dict) -> bool:
+    if not _admission_running:
+        # 何も実行していなければ、見積もりが予算を超えていても1件は受け付ける
+        return True
+    if len(_admission_running) >= max(1, ANALYSIS_WORKERS):
+        return False
+    return cost["memoryMb"] <= _admission_memory_available()
+
+
+def _admit(ticket: int, cost: Dict):
+    _admission_running[ticket] = {**cost, "admittedAt": time.monotonic()}
+
+
+def _wake_admission_waiters():
+    """空きができた分だけ、待ち行列の先頭から順に受け付ける"""
+    while _admission_waiters:
+        ticket, cost, waiter = _admission_waiters[0]
+        if waiter.done():
+            _admission_waiters.popleft()
+            continue
+        if not _admission_fits(cost):
+            break
+        _admission_waiters.popleft()
+        _admit(ticket, cost)
+        waiter.set_result(ticket)
+
+
+def admission_retry_after() -> int:
+    """空きが出るまでの見積もり秒数（Retry-After ヘッダー用）"""
+    now = time.monotonic()
+    remaining = [
+        t["admittedAt"] + t["expectedSeconds"] - now for t in _admission_running.values()
+    ]
+    soonest = max(1.0, min(remaining)) if remaining else 1.0
+    waiting = sum(cost["expectedSeconds"] for _, cost, _ in _admission_waiters)
+    return int(soonest + waiting / max(1, ANALYSIS_WORKERS)) + 1
+
+
+def _admission_rejected(reason: str) -> HTTPException:
+    retry_after = admission_retry_after()
+    return HTTPException(
+        status_code=429,
+        detail=f"{reason} Please retry after {retry_after}s.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def acquire_admission(cost: Dict, wait_timeout: Optional[float]) -> int:
+    """
+    解析の実行枠を確保（空きが無ければ先着順で待つ）
+
+    Args:
+        cost: estimate_analysis_cost() の見積もり
+        wait_timeout: 待機する最大秒数（None = 無制限、0 = 待たない）
+
+    Returns:
+        int: release_admission() に渡すチケットID
+
+    Raises:
+        HTTPException: 待機数の上限を超えた、または時間内に空きが出なかった場合（429）
+    """
+    global _admission_next_ticket
+    _admission_next_ticket += 1
+    ticket = _admission_next_ticket
+
+    if not _admission_waiters and _admission_fits(cost):
+        _admit(ticket, cost)
+        return ticket
+
+    if wait_timeout == 0 or len(_admission_waiters) >= ADMISSION_MAX_WAITING:
+        raise _admission_rejected("Analysis capacity is exhausted.")
+
+    waiter = asyncio.get_running_loop().create_future()
+    entry = (ticket, cost, waiter)
+    _admission_waiters.append(entry)
+    print(f"→ Waiting for analysis capacity ({cost['duration']:.0f}s audio, ~{cost['memoryMb']:.0f}MB, {len(_admission_waiters)} waiting)")
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(waiter), timeout=wait_timeout)
+    except asyncio.TimeoutError:
+        if waiter.done():
+            # タイムアウトと同時に受け付けられた
+            return waiter.result()
+        waiter.cancel()
+        _admission_waiters.remove(entry)
+        raise _admission_rejected("Timed out waiting for analysis capacity.")
+    except asyncio.CancelledError:
+        if waiter.done() and not waiter.cancelled():
+            release_admission(waiter.result())
+        else:
+            waiter.cancel()
+            _admission_waiters.remove(entry)
+        raise
+
+
+def release_admission(ticket: int):
+    """解析の実行枠を解放して待機中のリクエストを起こす"""
+    if _admission_running.pop(ticket, None) is not None:
+        _wake_admission_waiters()
+
+
+# ============================================
+# 解析進捗レポート（ワーカー → メインプロセス）
+# ============================================
+#
+# ワーカーは各ステージの開始/終了を (progressToken, event) として共有キューに送り、
+# メインプロセスのリスナースレッドがイベントループ上のジョブ情報に転送する。
+# progressToken が無い呼び出し（/analyze やベンチマーク）では何もしない。
+
+_progress_queue = None  # multiprocessing.Queue（メインプロセス側）
+_progress_listener: Optional[threading.Thread] = None
+_worker_progress_queue = None  # ワーカー側から見た送信先キュー
+_progress_context = threading.local()
+
+
+def _pool_mp_context():
+    """ワーカープールと進捗キューで共通に使う multiprocessing コンテキスト"""
+    if ANALYSIS_MAX_TASKS_PER_CHILD > 0:
+        # max_tasks_per_child は fork では使えないため spawn で起動
+        return multiprocessing.get_context("spawn")
+    return multiprocessing.get_context()
+
+
+def get_progress_queue():
+    """進捗キューを取得（未作成なら作成）"""
+    global _progress_queue, _worker_progress_queue
+    if _progress_queue is None:
+        _progress_queue = _pool_mp_context().Queue()
+        # スレッド実行（ANALYSIS_WORKERS=0）の場合はメインプロセス内から直接送る
+        _worker_progress_queue = _progress_queue
+    return _progress_queue
+
+
+def _init_analysis_worker(progress_queue, warmup: bool = False, warmup_barrier=None):
+    """ワーカープロセスの初期化（進捗キューを受け取り、必要ならウォームアップ）"""
+    global _worker_progress_queue, _worker_warmup, _worker_warmup_barrier
+    _worker_progress_queue = progress_queue
+    _worker_warmup_barrier = warmup_barrier
+    if warmup:
+        # ジョブを受け取る前に済ませるため、作り直されたワーカーも温まった状態で動き始める
+        _worker_warmup = warm_up_analysis()
+
+
+def start_progress_listener(loop: asyncio.AbstractEventLoop):
+    """ワーカーからの進捗イベントをイベントループに転送するスレッドを起動"""
+    global _progress_listener
+
+    if _progress_listener is not None:
+        return
+
+    queue = get_progress_queue()
+
+    def listen():
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            token, event, data = item
+            loop.call_soon_threadsafe(dispatch_progress_event, token, event, data)
+
+    _progress_listener = threading.Thread(target=listen, name="progress-listener", daemon=True)
+    _progress_listener.start()
+
+
+def stop_progress_listener():
+    """進捗リスナースレッドを停止"""
+    global _progress_listener
+    if _progress_listener is not None:
+        _progress_queue.put(None)
+        _progress_listener.join(timeout=2.0)
+        _progress_listener = None
+
+
+def _send_progress(event: str, data: Dict):
+    token = getattr(_progress_context, "token", None)
+    if token is None or _worker_progress_queue is None:
+        return
+    data["elapsedMs"] = round((time.monotonic() - _progress_context.job_started) * 1000)
+    try:
+        _worker_progress_queue.put_nowait((token, event, data))
+    except Exception:
+        # 進捗の送信失敗で解析を止めない
+        pass
+
+
+def progress_stage_start(stage: str, step: int, total_steps: int, label: str):
+    """
+    解析ステージの開始を通知
+
+    Args:
+        stage: ステージID（例: "key"）
+        step: ステップ番号（1始まり）
+        total_steps: 全ステップ数
+        label: 表示用の説明
+    """
+    starts = getattr(_progress_context, "stage_starts", None)
+    if starts is not None:
+        starts[stage] = time.monotonic()
+    _send_progress("stage_start", {
+        "stage": stage,
+        "step": step,
+        "totalSteps": total_steps,
+        "label": label,
+    })
+
+
+def progress_partial(kind: str, **payload):
+    """
+    ステージ途中の部分結果を通知（NDJSONストリーミング・SSE用）
+
+    Args:
+        kind: "metadata" | "chords"
+        **payload: 部分結果（JSON 化できる値）
+    """
+    _send_progress("partial", {"kind": kind, **payload})
+
+
+# 部分結果としてコードを送る間隔（検出区間の数）
+CHORD_BATCH_SIZE = 8
+
+
+def emit_chord_batch(chord_progression: List[ChordInfo], emitted: int, final: bool = False, merge: bool = True) -> int:
+    """
+    確定したコードを部分結果として送信
+
+    merge=True の場合は merge_consecutive_chords() 後の列を送る。末尾のコードは
+    次の小節とマージされる可能性があるため、final=True になるまで送らない。
+
+    Args:
+        chord_progression: ここまでに検出したコード（マージ前）
+        emitted: 送信済みのコード数
+        final: 最後の送信かどうか
+        merge: 連続する同じコードをマージした列を送るかどうか
+
+    Returns:
+        int: 送信済みのコード数
+    """
+    if getattr(_progress_context, "token", None) is None:
+        return emitted
+
+    chords = merge_consecutive_chords(chord_progression) if merge else chord_progression
+    ready = chords if final else chords[:-1]
+    if len(ready) > emitted:
+        progress_partial("chords", chords=[c.dict() for c in ready[emitted:]])
+        emitted = len(ready)
+    return emitted
+
+
+def progress_stage_end(stage: str, status: str = "ok", **outputs):
+    """
+    解析ステージの終了を通知
+
+    Args:
+        stage: ステージID
+        status: "ok" | "fallback"（失敗してデフォルト値を使った場合）
+        **outputs: 途中結果（キー、テンポなど JSON 化できる値）
+    """
+    starts = getattr(_progress_context, "stage_starts", None) or {}
+    started = starts.pop(stage, None)
+    _send_progress("stage_end", {
+        "stage": stage,
+        "status": status,
+        "durationMs": round((time.monotonic() - started) * 1000) if started is not None else None,
+        "outputs": outputs,
+    })
+
+
+# ============================================
+# 解析ワーカープロセスプール
+# ============================================
+
+_analysis_pool: Optional[ProcessPoolExecutor] = None
+_analysis_pool_lock = threading.Lock()
+
+
+class _JobTimeout(BaseException):
+    """
+    ワーカー内でのジョブタイムアウト通知
+
+    解析関数は各ステップを except Exception でフォールバックしているため、
+    そこで握りつぶされないよう BaseException を継承する。
+    """
+
+
+def _raise_job_timeout(signum, frame):
+    raise _JobTimeout()
+
+
+def get_analysis_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    解析用プロセスプールを取得（未作成なら作成）
+
+    Returns:
+        Optional[ProcessPoolExecutor]: ANALYSIS_WORKERS=0 の場合は None
+    """
+    global _analysis_pool
+
+    if ANALYSIS_WORKERS <= 0:
+        return None
+
+    with _analysis_pool_lock:
+        if _analysis_pool is None:
+            pool_kwargs = {
+                "max_workers": ANALYSIS_WORKERS,
+                "mp_context": _pool_mp_context(),
+                "initializer": _init_analysis_worker,
+                "initargs": (
+                    get_progress_queue(),
+                    USE_REAL_ANALYSIS and ANALYSIS_WARMUP,
+                    _pool_mp_context().Barrier(ANALYSIS_WORKERS),
+                ),
+            }
+            if ANALYSIS_MAX_TASKS_PER_CHILD > 0:
+                pool_kwargs["max_tasks_per_child"] = ANALYSIS_MAX_TASKS_PER_CHILD
+            _analysis_pool = ProcessPoolExecutor(**pool_kwargs)
+            print(f"✓ Analysis worker pool started ({ANALYSIS_WORKERS} workers)")
+        return _analysis_pool
+
+
+def shutdown_analysis_pool(wait: bool = False):
+    """解析用プロセスプールを停止"""
+    global _analysis_pool
+
+    with _analysis_pool_lock:
+        if _analysis_pool is not None:
+            _analysis_pool.shutdown(wait=wait, cancel_futures=True)
+            _analysis_pool = None
+
+
+def run_analysis_job(
+    file_path: str,
+    options: Dict,
+    timeout: float = 0.0,
+    progress_token: Optional[str] = None,
+    audio_hash: Optional[str] = None,
+) -> AnalysisResult:
+    """
+    解析ジョブ本体（ワーカープロセス内で実行）
+
+    ワーカーのメインスレッドで実行される場合は SIGALRM でタイムアウトを掛け、
+    時間切れになったジョブがワーカーを占有し続けないようにする。
+
+    Args:
+        file_path: ローカルの音源ファイルパス
+        options: 解析オプション
+        timeout: タイムアウト秒数（0 = 無制限）
+        progress_token: 進捗イベントの送信先ジョブID（None = 送信しない）
+        audio_hash: 音源ファイルのSHA-256（PCMキャッシュのキー、None = キャッシュしない）
+
+    Returns:
+        AnalysisResult: 解析結果
+
+    Raises:
+        TimeoutError: timeout を超過した場合
+    """
+    _progress_context.token = progress_token
+    _progress_context.job_started = time.monotonic()
+    _progress_context.stage_starts = {}
+
+    use_alarm = (
+        timeout > 0
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_job_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        if USE_REAL_ANALYSIS:
+            return analyze_audio_real(file_path=file_path, options=options, audio_hash=audio_hash)
+        return analyze_audio_dummy(file_path=file_path, options=options)
+    except _JobTimeout:
+        raise TimeoutError(f"Analysis timed out after {timeout:.0f}s")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        _progress_context.token = None
+
+
+async def run_analysis_in_pool(
+    file_path: str, options: Dict, progress_token: Optional[str] = None, audio_hash: Optional[str] = None
+) -> AnalysisResult:
+    """
+    解析ジョブをワーカープールで実行（イベントループをブロックしない）
+
+    Args:
+        file_path: ローカルの音源ファイルパス
+        options: 解析オプション
+        progress_token: 進捗イベントの送信先ジョブID
+        audio_hash: 音源ファイルのSHA-256（PCMキャッシュのキー）
+
+    Returns:
+        AnalysisResult: 解析結果
+
+    Raises:
+        TimeoutError: ANALYSIS_JOB_TIMEOUT を超過した場合
+        BrokenProcessPool: ワーカーが異常終了した場合（プールは作り直される）
+    """
+    global _analysis_pool
+
+    loop = asyncio.get_running_loop()
+    pool = get_analysis_pool()
+
+    if pool is None:
+        # スレッドではSIGALRMを使えないため、タイムアウトは呼び出し側の待機のみ
+        future = loop.run_in_executor(
+            None, run_analysis_job, file_path, options, 0.0, progress_token, audio_hash
+        )
+    else:
+        future = loop.run_in_executor(
+            pool, run_analysis_job, file_path, options, ANALYSIS_JOB_TIMEOUT, progress_token, audio_hash
+        )
+
+    # ワーカー側のタイムアウトを優先し、待機側は少し余裕を持たせる
+    wait_timeout = ANALYSIS_JOB_TIMEOUT + 5.0 if ANALYSIS_JOB_TIMEOUT > 0 else None
+
+    try:
+        return await asyncio.wait_for(future, timeout=wait_timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Analysis timed out after {ANALYSIS_JOB_TIMEOUT:.0f}s")
+    except BrokenProcessPool:
+        # OOM Kill などでワーカーが落ちた場合は次のジョブのためにプールを作り直す
+        print("⚠ Analysis worker pool is broken, restarting...")
+        with _analysis_pool_lock:
+            if _analysis_pool is pool:
+                _analysis_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+async def run_admitted_analysis(
+    file_path: str,
+    options: Dict,
+    cost: Dict,
+    progress_token: Optional[str] = None,
+    admission_timeout: Optional[float] = ADMISSION_WAIT_TIMEOUT,
+    audio_hash: Optional[str] = None,
+) -> AnalysisResult:
+    """実行枠を確保してからワーカープールで解析（終了後に枠を解放）"""
+    ticket = await acquire_admission(cost, admission_timeout)
+    try:
+        print("→ Dispatching analysis to worker pool...")
+        return await run_analysis_in_pool(file_path, options, progress_token, audio_hash)
+    finally:
+        release_admission(ticket)
+
+
+async def execute_analysis(
+    file_path_or_url: str,
+    options: Dict,
+    progress_token: Optional[str] = None,
+    admission_timeout: Optional[float] = ADMISSION_WAIT_TIMEOUT,
+) -> AnalysisResult:
+    """
+    ダウンロード・ファイル確認・受付制御・ワーカープールでの解析をまとめて実行
+
+    /analyze と非同期ジョブの両方から使用する。
+
+    Args:
+        file_path_or_url: ファイルパスまたはURL
+        options: 解析オプション
+        progress_token: 進捗イベントの送信先ジョブID（非同期ジョブの場合のみ）
+        admission_timeout: 実行枠の空きを待つ最大秒数（None = 無制限）
+
+    Returns:
+        AnalysisResult: 解析結果
+
+    Raises:
+        FileNotFoundError: 音源ファイルが存在しない場合
+        HTTPException: 音源が ANALYSIS_MAX_DURATION を超える場合（413）、実行枠が空かない場合（429）
+    """
+    # URLの場合はダウンロード、ローカルパスの場合はそのまま使用
+    # （ダウンロードはブロッキングI/Oのためスレッドで実行、ハッシュはダウンロード中に計算済み）
+    local_file_path, audio_hash = await run_in_threadpool(download_file_if_url, file_path_or_url)
+
+    # ダウンロードした一時ファイルは解析後に削除する
+    temp_file_path = local_file_path if local_file_path != file_path_or_url else None
+
+    try:
+        if not Path(local_file_path).exists():
+            raise FileNotFoundError(f"Audio file not found: {local_file_path}")
+
+        # ダミー解析は音源を読まないため、受付制御・キャッシュの対象外
+        if not USE_REAL_ANALYSIS:
+            print("→ Dispatching analysis to worker pool...")
+            return await run_analysis_in_pool(local_file_path, options, progress_token)
+
+        # デコード前にヘッダーだけ読んで長さを確認し、解析コストを見積もる
+        probe = await run_in_threadpool(probe_audio_header, local_file_path)
+        check_max_duration(probe)
+
+        # 解析の深さ（timeBudgetMs がある場合は時間内に終わる段階）をここで決めてオプションに固定する
+        # （キャッシュキーとワーカーでの解析は実際に使う段階で決まる）
+        depth, tier = resolve_analysis_tier(options, probe["duration"])
+        options = {**options, "analysisDepth": depth, "timeBudgetMs": None}
+        cost = estimate_analysis_cost(probe, tier["cost"])
+        print(
+            f"  → Audio header: {probe['duration']:.1f}s{' (estimated)' if probe['estimated'] else ''}, "
+            f"{probe['sampleRate']}Hz, {probe['channels']}ch (~{cost['memoryMb']:.0f}MB), depth={depth}"
+        )
+
+        # 解析結果キャッシュ・PCMキャッシュのキーになる音源のハッシュ（URLの場合はダウンロード中に計算済み）
+        if audio_hash is None and (RESULT_CACHE_ENABLED or PCM_CACHE_ENABLED or STEM_CACHE_ENABLED):
+            audio_hash = await run_in_threadpool(file_sha256, local_file_path)
+
+        if not RESULT_CACHE_ENABLED:
+            return await run_admitted_analysis(
+                local_file_path, options, cost, progress_token, admission_timeout, audio_hash
+            )
+
+        # 同じ音源・同じ設定の解析結果がキャッシュにあれば再利用
+        cache_key = result_cache_key(audio_hash, options)
+
+        cached = await run_in_threadpool(result_cache_get, cache_key)
+        if cached is not None:
+            print(f"✓ Result cache hit (audio sha256={audio_hash[:12]}...)")
+            if progress_token is not None:
+                dispatch_progress_event(progress_token, "cache_hit", {"audioSha256": audio_hash})
+            return cached
+
+        # 同じキーの解析が実行中なら、その結果を待つ（同時アップロードで二重解析しない）
+        # 受付待ちの上限が違う呼び出し（/analyze と /jobs）は相乗りしない（ジョブが 429 で失敗しないように）
+        inflight_key = (cache_key, admission_timeout)
+        inflight = _inflight_analyses.get(inflight_key)
+        if inflight is None:
+            # 進捗は共有のトークンで受け取り、待っている呼び出し元すべてに転送する
+            inflight = {"token": f"inflight:{uuid.uuid4().hex}", "waiters": set(), "events": []}
+            inflight["task"] = asyncio.ensure_future(
+                _analyze_and_cache(
+                    local_file_path, options, cache_key, cost, admission_timeout,
+                    audio_hash, temp_file_path, inflight["token"]
+                )
+            )
+            # 一時ファイルの削除は解析タスク側で行う（呼び出し元が先に抜けても解析を続けられるように）
+            temp_file_path = None
+            _inflight_analyses[inflight_key] = inflight
+            _inflight_progress[inflight["token"]] = inflight
+
+            def forget_inflight(_, token=inflight["token"]):
+                _inflight_analyses.pop(inflight_key, None)
+                _inflight_progress.pop(token, None)
+
+            inflight["task"].add_done_callback(forget_inflight)
+        else:
+            print(f"→ Waiting for in-flight analysis of the same audio (sha256={audio_hash[:12]}...)")
+
+        if progress_token is None:
+            return await asyncio.shield(inflight["task"])
+        # 途中から待ち始めた呼び出し元には、それまでのイベントを先に送る
+        for event, data in inflight["events"]:
+            dispatch_progress_event(progress_token, event, data)
+        inflight["waiters"].add(progress_token)
+        try:
+            return await asyncio.shield(inflight["task"])
+        finally:
+            inflight["waiters"].discard(progress_token)
+
+    finally:
+        if temp_file_path is not None:
+            Path(temp_file_path).unlink(missing_ok=True)
+
+
+# (キャッシュキー, 受付待ちの上限) → 実行中の解析（task・共有の進捗トークン・待っている呼び出し元の進捗トークン・これまでのイベント）
+_inflight_analyses: Dict[Tuple[str, Optional[float]], Dict] = {}
+# 共有の進捗トークン → 実行中の解析（dispatch_progress_event での転送用）
+_inflight_progress: Dict[str, Dict] = {}
+
+
+async def _analyze_and_cache(
+    file_path: str,
+    options: Dict,
+    cache_key: str,
+    cost: Dict,
+    admission_timeout: Optional[float],
+    audio_hash: Optional[str] = None,
+    temp_file_path: Optional[str] = None,
+    progress_token: Optional[str] = None,
+) -> AnalysisResult:
+    """ワーカープールで解析し、結果をキャッシュに保存（一時ファイルがあれば最後に削除）"""
+    try:
+        result = await run_admitted_analysis(
+            file_path, options, cost, progress_token, admission_timeout, audio_hash
+        )
+        await run_in_threadpool(result_cache_put, cache_key, result)
+        return result
+    finally:
+        if temp_file_path is not None:
+            Path(temp_file_path).unlink(missing_ok=True)
+
+
+# ============================================
+# 起動時ウォームアップ・レディネス
+# ============================================
+#
+# 初回の解析は librosa/numba のインポート・JIT コンパイル・CQT フィルタバンク生成のぶん遅い。
+# 各ワーカーの初期化時に短い合成音源で解析パイプラインを1回実行し、
+# 全ワーカーの準備ができるまで /ready は 503 を返す（ローリングデプロイで冷えたワーカーに振らない）。
+
+WARMUP_DURATION = 8.0  # ウォームアップ用の合成音源の長さ（秒）
+WARMUP_BARRIER_TIMEOUT = 300.0  # 全ワーカーのウォームアップ完了を待つ上限（秒）
+
+_worker_warmup: Optional[Dict] = None  # ワーカー側: 自プロセスのウォームアップ結果
+_worker_warmup_barrier = None  # ワーカー側: 全ワーカーが確認タスクを受け取るまで待つ Barrier（ワーカー数ぶん）
+_analysis_ready = False
+_warmup_summary: Dict = {}
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def warm_up_analysis() -> Dict:
+    """
+    合成音源（C-G-Am-F のコード + クリック）で解析パイプラインを1回実行
+
+    Returns:
+        Dict: ok（成功したか）, seconds（所要時間）
+    """
+    started = time.perf_counter()
+    sr = 22050
+    t = np.arange(int(sr * 2.0)) / sr
+    chords = [[60, 64, 67], [55, 59, 62], [57, 60, 64], [53, 57, 60]]
+    sections = []
+    for i in range(int(WARMUP_DURATION / 2.0)):
+        tone = sum(np.sin(2 * np.pi * 440.0 * 2 ** ((m - 69) / 12) * t) for m in chords[i % 4]) / 3
+        click = np.zeros_like(t)
+        for beat in range(4):
+            k = int(beat * 0.5 * sr)
+            click[k:k + 200] = np.linspace(1.0, 0.0, 200)
+        sections.append(0.3 * tone + 0.3 * click)
+    y = np.concatenate(sections).astype(np.float32)
+
+    fd, path = tempfile.mkstemp(suffix=".wav", prefix="warmup_")
+    os.close(fd)
+    ok = True
+    try:
+        sf.write(path, y, sr)
+        print(f"[Warm-up] Running analysis pipeline on {WARMUP_DURATION:.0f}s synthetic audio (pid={os.getpid()})...")
+        run_analysis_job(path, {}, ANALYSIS_JOB_TIMEOUT)
+    except Exception as e:
+        print(f"⚠ [Warm-up] Failed: {e}")
+        ok = False
+    finally:
+        Path(path).unlink(missing_ok=True)
+
+    seconds = time.perf_counter() - started
+    print(f"{'✓' if ok else '⚠'} [Warm-up] Finished in {seconds:.1f}s (pid={os.getpid()})")
+    return {"ok": ok, "seconds": round(seconds, 2)}
+
+
+def worker_warmup_status() -> Dict:
+    """
+    ワーカーのウォームアップ結果を返す（初期化が終わったワーカーでのみ実行される）
+
+    全ワーカーがこのタスクを実行中になるまで Barrier で待つ。待っている間はそのワーカーが
+    次のタスクを受け取れないため、ワーカー数ぶんのタスクは必ず別々のワーカーで実行される。
+    """
+    status = {"pid": os.getpid(), **(_worker_warmup or {"ok": False, "seconds": 0.0})}
+    if _worker_warmup_barrier is not None:
+        try:
+            _worker_warmup_barrier.wait(WARMUP_BARRIER_TIMEOUT)
+        except threading.BrokenBarrierError:
+            status.update(ok=False, error="Timed out waiting for other workers to warm up")
+    return status
+
+
+async def warm_up_workers():
+    """全ワーカーのウォームアップ完了を待ってレディ状態にする"""
+    global _analysis_ready, _warmup_summary
+
+    started = time.perf_counter()
+    pool = get_analysis_pool()
+
+    if pool is None:
+        results = [{"pid": os.getpid(), **await run_in_threadpool(warm_up_analysis)}]
+    else:
+        # ワーカーはウォームアップ（初期化）が終わるまでタスクを受け取らない。確認タスクは
+        # 全ワーカーがそろうまで Barrier で待つため、温まったワーカーが1つで全タスクを返すことはなく、
+        # ワーカー数ぶんの pid がそろった時点で全ワーカーのウォームアップが終わっている
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(
+            *[loop.run_in_executor(pool, worker_warmup_status) for _ in range(ANALYSIS_WORKERS)],
+            return_exceptions=True,
+        )
+        # Barrier が壊れた場合（待ちきれなかった場合）に備えて pid ごとにまとめる
+        results = list({
+            r["pid"]: r for r in outcomes if isinstance(r, dict)
+        }.values()) + [
+            {"pid": None, "ok": False, "error": str(r)} for r in outcomes if not isinstance(r, dict)
+        ]
+
+    _warmup_summary = {
+        "ok": all(r["ok"] for r in results),
+        "seconds": round(time.perf_counter() - started, 2),
+        "workers": results,
+    }
+    _analysis_ready = True
+    print(f"✓ Analysis workers ready (warm-up {_warmup_summary['seconds']:.1f}s)")
+
+
+def start_warmup():
+    """起動時ウォームアップを開始（無効な場合は即レディ）"""
+    global _warmup_task, _analysis_ready
+    if USE_REAL_ANALYSIS and ANALYSIS_WARMUP:
+        _warmup_task = asyncio.create_task(warm_up_workers())
+    else:
+        _analysis_ready = True
+
+
+async def stop_warmup():
+    """実行中のウォームアップ待ちを止める"""
+    global _warmup_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        await asyncio.gather(_warmup_task, return_exceptions=True)
+        _warmup_task = None
+
+
+def admission_stats() -> Dict:
+    """アドミッション制御の状態"""
+    return {
+        "running": len(_admission_running),
+        "waiting": len(_admission_waiters),
+        "memoryReservedMb": round(sum(t["memoryMb"] for t in _admission_running.values()), 1),
+        "memoryAvailableMb": round(_admission_memory_available(), 1),
+    }
+
+
+# ============================================
+# 非同期ジョブキュー（POST /jobs → GET /jobs/{jobId} でポーリング）
+# ============================================
+
+# ジョブ情報はイベントループ上でのみ更新するためロック不要
+_jobs: Dict[str, dict] = {}
+_job_queue: Optional[asyncio.Queue] = None
+_job_dispatchers: List[asyncio.Task] = []
+
+JOB_FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def purge_expired_jobs():
+    """JOB_RESULT_TTL を過ぎた完了/失敗ジョブを削除"""
+    now = time.monotonic()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job["status"] in JOB_FINISHED_STATUSES and job["expiresAt"] <= now
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def job_progress_token(job: dict) -> str:
+    """
+    ワーカーからの進捗イベントを紐付けるトークン
+
+    同じ jobId で再投入された場合に古い実行のイベントが混ざらないよう、登録順の seq を含める。
+    """
+    return f"{job['jobId']}#{job['seq']}"
+
+
+# NDJSON ストリーミング中の /analyze リクエスト: トークン → asyncio.Queue
+_stream_channels: Dict[str, asyncio.Queue] = {}
+
+
+def dispatch_progress_event(token: str, event: str, data: Dict):
+    """ワーカーからの進捗イベントを NDJSON ストリームまたはジョブに振り分け（イベントループ上で呼ぶ）"""
+    inflight = _inflight_progress.get(token)
+    if inflight is not None:
+        # 相乗りしている解析: 待っている呼び出し元すべてに転送する
+        inflight["events"].append((event, data))
+        for waiter in list(inflight["waiters"]):
+            dispatch_progress_event(waiter, event, data)
+        return
+    channel = _stream_channels.get(token)
+    if channel is not None:
+        channel.put_nowait((event, data))
+        return
+    publish_job_event(token, event, data)
+
+
+def publish_job_event(token: str, event: str, data: Dict):
+    """
+    ジョブにイベントを記録し、SSE購読者に配信（イベントループ上で呼ぶ）
+
+    Args:
+        token: job_progress_token() で生成したトークン
+        event: イベント名（"status" | "stage_start" | "stage_end" | "partial" | "cache_hit"）
+        data: イベントの内容
+    """
+    job_id, _, seq = token.rpartition("#")
+    job = _jobs.get(job_id)
+    if job is None or str(job["seq"]) != seq:
+        return
+
+    record = {"id": len(job["events"]) + 1, "event": event, "data": data}
+    job["events"].append(record)
+    for subscriber in job["subscribers"]:
+        subscriber.put_nowait(record)
+
+
+def publish_job_status(job: dict):
+    """ジョブのステータス変化をイベントとして配信"""
+    data = {"status": job["status"]}
+    if job["status"] == "completed" and job["result"] is not None:
+        data["result"] = job["result"].dict()
+    if job["error"] is not None:
+        data["error"] = job["error"]
+    publish_job_event(job_progress_token(job), "status", data)
+
+
+def job_to_response(job: dict) -> JobStatusResponse:
+    """ジョブ情報をレスポンスモデルに変換"""
+    queue_position = None
+    if job["status"] == "queued":
+        queue_position = sum(
+            1 for other in _jobs.values()
+            if other["status"] == "queued" and other["seq"] < job["seq"]
+        )
+
+    return JobStatusResponse(
+        success=job["status"] != "failed",
+        jobId=job["jobId"],
+        status=job["status"],
+        queuePosition=queue_position,
+        createdAt=job["createdAt"],
+        startedAt=job["startedAt"],
+        completedAt=job["completedAt"],
+        result=job["result"],
+        error=job["error"],
+    )
+
+
+def enqueue_job(request: AnalyzeRequest) -> dict:
+    """
+    ジョブを登録してキューに投入
+
+    Returns:
+        dict: 登録したジョブ情報
+
+    Raises:
+        HTTPException: 同じjobIdが実行中（409）またはキューが満杯（429）の場合
+    """
+    purge_expired_jobs()
+
+    existing = _jobs.get(request.jobId)
+    if existing is not None and existing["status"] not in JOB_FINISHED_STATUSES:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job {request.jobId} is already {existing['status']}"
+        )
+
+    job = {
+        "jobId": request.jobId,
+        "filePath": request.filePath,
+        "options": (request.options or AnalysisOptions()).dict(),
+        "status": "queued",
+        "seq": time.monotonic_ns(),
+        "createdAt": _now_iso(),
+        "startedAt": None,
+        "completedAt": None,
+        "expiresAt": None,
+        "result": None,
+        "error": None,
+        "events": [],  # SSE 再接続時に再送するためのイベント履歴
+        "subscribers": set(),  # SSE 購読者ごとの asyncio.Queue
+    }
+
+    try:
+        get_job_queue().put_nowait(request.jobId)
+    except asyncio.QueueFull:
+        raise _admission_rejected("Job queue is full.")
+
+    _jobs[request.jobId] = job
+    publish_job_status(job)
+    return job
+
+
+def finish_job(job: dict, status: str, result: Optional[AnalysisResult] = None, error: Optional[str] = None):
+    """ジョブを完了状態にして保持期限を設定"""
+    job["status"] = status
+    job["result"] = result
+    job["error"] = error
+    job["completedAt"] = _now_iso()
+    job["expiresAt"] = time.monotonic() + JOB_RESULT_TTL
+    publish_job_status(job)
+
+
+def get_job_queue() -> asyncio.Queue:
+    """ジョブキューを取得（未作成なら作成）"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = asyncio.Queue(maxsize=JOB_QUEUE_MAX)
+    return _job_queue
+
+
+async def job_dispatcher_loop(worker_index: int):
+    """
+    キューからジョブを取り出して順に解析するディスパッチャ
+
+    ANALYSIS_WORKERS と同数だけ起動し、プールに投入するジョブ数を
+    ワーカー数以下に保つ（待機中のジョブはキャンセル可能なまま残す）。
+    """
+    queue = get_job_queue()
+
+    while True:
+        job_id = await queue.get()
+        try:
+            job = _jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                # 待機中に DELETE されたジョブ
+                continue
+
+            job["status"] = "running"
+            job["startedAt"] = _now_iso()
+            publish_job_status(job)
+            print(f"[Job Dispatcher {worker_index}] Running job {job_id}")
+
+            try:
+                # キュー済みのジョブは 429 にせず、実行枠が空くまで待つ
+                result = await execute_analysis(
+                    job["filePath"], job["options"],
+                    progress_token=job_progress_token(job), admission_timeout=None
+                )
+                status, error = "completed", None
+            except HTTPException as e:
+                result, status, error = None, "failed", str(e.detail)
+            except Exception as e:
+                result, status, error = None, "failed", str(e) or e.__class__.__name__
+
+            # 実行中に DELETE された場合は結果を破棄
+            if _jobs.get(job_id) is job:
+                finish_job(job, status, result=result, error=error)
+                print(f"[Job Dispatcher {worker_index}] Job {job_id} {status}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠ Job dispatcher error ({job_id}): {e}")
+        finally:
+            queue.task_done()
+
+
+def start_job_dispatchers():
+    """ジョブディスパッチャを起動"""
+    if _job_dispatchers:
+        return
+    for i in range(max(1, ANALYSIS_WORKERS)):
+        _job_dispatchers.append(asyncio.create_task(job_dispatcher_loop(i)))
+
+
+async def stop_job_dispatchers():
+    """ジョブディスパッチャを停止"""
+    for task in _job_dispatchers:
+        task.cancel()
+    await asyncio.gather(*_job_dispatchers, return_exceptions=True)
+    _job_dispatchers.clear()
 
 
 # ============================================
 # エンドポイント
 # ============================================
 
+@app.on_event("startup")
+async def on_startup():
+    """起動時にワーカープール・進捗リスナー・ジョブディスパッチャを準備し、ウォームアップを開始"""
+    start_progress_listener(asyncio.get_running_loop())
+    if USE_REAL_ANALYSIS:
+        get_analysis_pool()
+    start_job_dispatchers()
+    start_warmup()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """終了時にジョブディスパッチャ・ワーカープール・進捗リスナーを停止"""
+    await stop_warmup()
+    await stop_job_dispatchers()
+    shutdown_analysis_pool()
+    stop_progress_listener()
+
+
 @app.get("/")
 def read_root():
     """ヘルスチェック"""
     return {
-        "status": "ok",
-        "message": "Audio Analysis API is running",
-        "version": "0.1.0 (Phase 3 - Dummy)",
-        "endpoints": [
-            {"path": "/analyze", "method": "POST", "description": "音源解析"}
-        ]
+        "status": "ok",
+        "message": "Audio Analysis API is running",
+        "version": "0.1.0 (Phase 3 - Dummy)",
+        "endpoints": [
+            {"path": "/analyze", "method": "POST", "description": "音源解析"},
+            {"path": "/jobs", "method": "POST", "description": "非同期解析ジョブの登録"},
+            {"path": "/jobs/{jobId}", "method": "GET", "description": "ジョブのステータス・結果取得"},
+            {"path": "/jobs/{jobId}", "method": "DELETE", "description": "ジョブのキャンセル・削除"},
+            {"path": "/jobs/{jobId}/events", "method": "GET", "description": "ジョブ進捗のSSEストリーム"},
+            {"path": "/cache/stats", "method": "GET", "description": "解析結果キャッシュの統計"},
+            {"path": "/health", "method": "GET", "description": "死活監視（プロセスが応答できるか）"},
+            {"path": "/ready", "method": "GET", "description": "レディネス（ウォームアップ完了後に 200）"}
+        ]
+    }
+
+
+@app.get("/health")
+def health():
+    """
+    死活監視（liveness）
+
+    解析ワーカーの状態は見ず、APIプロセスが応答できるかだけを返す。
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """
+    レディネス（readiness）
+
+    起動時ウォームアップが終わるまでは 503 を返し、ロードバランサーが冷えたワーカーに振らないようにする。
+    """
+    if not _analysis_ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+
+    return {
+        "status": "ready",
+        "warmup": _warmup_summary or None,
+        "workers": ANALYSIS_WORKERS,
+        "queuedJobs": get_job_queue().qsize(),
+        "admission": admission_stats(),
     }
 
 
 @app.post("/analyze", response_model=AnalyzeResponse)
-async def analyze_audio(request: AnalyzeRequest):
+async def analyze_audio(request: AnalyzeRequest, stream: Optional[str] = None):
     """
     音源解析エンドポイント
 
+    stream=ndjson を指定すると、解析結果をセクションごとに NDJSON で逐次返す
+    （stream_analysis_ndjson を参照）。
+
     Phase 3 実装：
     - ダミーの解析結果を返却
     - ファイルパスの存在確認のみ実施
@@ -255,6 +2120,11 @@ async def analyze_audio(request: AnalyzeRequest):
     - テンポ・キー検出
     """
 
+    if stream is not None:
+        if stream != "ndjson":
+            raise HTTPException(status_code=400, detail=f"Unsupported stream format: {stream}")
+        return await stream_analysis_ndjson(request)
+
     try:
         print("\n" + "=" * 60)
         print(f"🎵 Analyzing audio file")
@@ -265,31 +2135,10 @@ async def analyze_audio(request: AnalyzeRequest):
         print(f"Analysis Mode: {'REAL (librosa)' if USE_REAL_ANALYSIS else 'DUMMY (固定値)'}")
         print("=" * 60)
 
-        # URLの場合はダウンロード、ローカルパスの場合はそのまま使用
-        local_file_path = download_file_if_url(request.filePath)
-
-        # ファイルパスのバリデーション
-        file_path = Path(local_file_path)
-
-        if not file_path.exists():
-            raise HTTPException(
-                status_code=404,
-                detail=f"Audio file not found: {local_file_path}"
-            )
-
-        # 環境変数に応じて実解析 or ダミー解析を選択
-        if USE_REAL_ANALYSIS:
-            print("→ Calling analyze_audio_real()...")
-            result = analyze_audio_real(
-                file_path=local_file_path,
-                options=request.options.dict() if request.options else {}
-            )
-        else:
-            print("→ Calling analyze_audio_dummy()...")
-            result = analyze_audio_dummy(
-                file_path=local_file_path,
-                options=request.options.dict() if request.options else {}
-            )
+        result = await execute_analysis(
+            request.filePath,
+            (request.options or AnalysisOptions()).dict()
+        )
 
         # レスポンスを返却
         print(f"\n✓ Analysis completed for job {request.jobId}")
@@ -302,20 +2151,293 @@ async def analyze_audio(request: AnalyzeRequest):
             result=result
         )
 
-    except FileNotFoundError as e:
-        print(f"\n✗ File not found error: {str(e)}")
-        print("=" * 60 + "\n")
-        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
 
     except Exception as e:
-        print(f"\n✗ Analysis error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        http_error = to_analysis_http_exception(e)
+        print(f"\n✗ Analysis error ({http_error.status_code}): {http_error.detail}")
+        if http_error.status_code == 500:
+            import traceback
+            traceback.print_exc()
         print("=" * 60 + "\n")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Analysis failed: {str(e)}"
+        raise http_error
+
+
+def to_analysis_http_exception(e: Exception) -> HTTPException:
+    """
+    解析中の例外を HTTPException に変換
+
+    - FileNotFoundError → 404
+    - BrokenProcessPool（ワーカー異常終了）→ 503
+    - TimeoutError（ANALYSIS_JOB_TIMEOUT 超過）→ 504
+    - その他 → 500
+    """
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, FileNotFoundError):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, BrokenProcessPool):
+        return HTTPException(
+            status_code=503,
+            detail="Analysis worker crashed (possibly out of memory). Please retry."
         )
+    if isinstance(e, TimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+
+def _ndjson_line(payload: Dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+async def stream_analysis_ndjson(request: AnalyzeRequest) -> StreamingResponse:
+    """
+    解析結果をセクションごとに NDJSON で逐次返す（POST /analyze?stream=ndjson）
+
+    出力する行（1行 = 1 JSON）:
+    - {"type": "metadata", ...}: キー・テンポが確定した時点で送る
+    - {"type": "chords", "chords": [...], "reset": false}: 確定したコードをバッチで送る
+      （reset=true の場合はそれまでのコードを破棄して置き換える）
+    - {"type": "scaleMatch", ...}
+    - {"type": "done", ...} または {"type": "error", ...}
+
+    ダウンロード失敗・ファイル未検出など、最初の行を送る前に起きたエラーは
+    通常どおり HTTP ステータスで返す。
+    """
+    options = (request.options or AnalysisOptions()).dict()
+    token = f"stream:{request.jobId}:{uuid.uuid4().hex}"
+    channel: asyncio.Queue = asyncio.Queue()
+    _stream_channels[token] = channel
+
+    print(f"\n🎵 Streaming analysis (NDJSON): {request.jobId} (File Path/URL: {request.filePath})")
+
+    task = asyncio.ensure_future(execute_analysis(request.filePath, options, progress_token=token))
+
+    # 最初の進捗イベントか解析の終了を待つ
+    first_event = asyncio.ensure_future(channel.get())
+    await asyncio.wait({task, first_event}, return_when=asyncio.FIRST_COMPLETED)
+    pending_events = []
+    if first_event.done():
+        pending_events.append(first_event.result())
+    else:
+        first_event.cancel()
+        if task.exception() is not None:
+            _stream_channels.pop(token, None)
+            raise to_analysis_http_exception(task.exception())
+
+    async def body():
+        sent_metadata = False
+        sent_chords: List[Dict] = []
+
+        def handle(event: str, data: Dict) -> List[str]:
+            nonlocal sent_metadata, sent_chords
+            if event != "partial":
+                return []
+            if data["kind"] == "metadata" and not sent_metadata:
+                sent_metadata = True
+                return [_ndjson_line({"type": "metadata", "metadata": data["metadata"]})]
+            if data["kind"] == "chords":
+                reset = bool(data.get("reset"))
+                sent_chords = (list(data["chords"]) if reset else sent_chords + list(data["chords"]))
+                return [_ndjson_line({"type": "chords", "chords": data["chords"], "reset": reset})]
+            return []
+
+        try:
+            for event, data in pending_events:
+                for line in handle(event, data):
+                    yield line
+
+            while not task.done():
+                getter = asyncio.ensure_future(channel.get())
+                await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    for line in handle(*getter.result()):
+                        yield line
+                else:
+                    getter.cancel()
+
+            # 解析終了までに届いたイベントを送り切る
+            while not channel.empty():
+                for line in handle(*channel.get_nowait()):
+                    yield line
+
+            try:
+                result = task.result()
+            except Exception as e:
+                http_error = to_analysis_http_exception(e)
+                print(f"✗ Streaming analysis failed ({http_error.status_code}): {http_error.detail}")
+                yield _ndjson_line({
+                    "type": "error",
+                    "success": False,
+                    "jobId": request.jobId,
+                    "status": "failed",
+                    "statusCode": http_error.status_code,
+                    "error": http_error.detail,
+                })
+                return
+
+            # 進捗イベントと最終結果は別経路で届くため、最終結果を正として差分を補う
+            if not sent_metadata:
+                yield _ndjson_line({"type": "metadata", "metadata": result.metadata.dict()})
+
+            final_chords = [c.dict() for c in result.chordProgression]
+            if final_chords[:len(sent_chords)] == sent_chords:
+                if len(final_chords) > len(sent_chords) or not sent_chords:
+                    yield _ndjson_line({"type": "chords", "chords": final_chords[len(sent_chords):], "reset": False})
+            else:
+                yield _ndjson_line({"type": "chords", "chords": final_chords, "reset": True})
+
+            yield _ndjson_line({"type": "scaleMatch", "scaleMatch": result.scaleMatch.dict()})
+            if result.stems is not None:
+                yield _ndjson_line({"type": "stems", "stems": result.stems})
+            yield _ndjson_line({"type": "done", "success": True, "jobId": request.jobId, "status": "completed"})
+            print(f"✓ Streaming analysis completed for job {request.jobId}")
+        finally:
+            _stream_channels.pop(token, None)
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def submit_job(request: AnalyzeRequest, response: Response):
+    """
+    非同期解析ジョブの登録
+
+    解析の完了を待たずに 202 を返す。結果は GET /jobs/{jobId} でポーリングする。
+    """
+    job = enqueue_job(request)
+
+    print(f"\n🎵 Job queued: {request.jobId} (File Path/URL: {request.filePath})")
+
+    response.headers["Location"] = f"/jobs/{request.jobId}"
+    return job_to_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """ジョブのステータスと解析結果を取得"""
+    purge_expired_jobs()
+
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    return job_to_response(job)
+
+
+@app.delete("/jobs/{job_id}", response_model=JobStatusResponse)
+async def delete_job(job_id: str):
+    """
+    ジョブのキャンセル・削除
+
+    - queued: キューから外してキャンセル
+    - running: 結果を破棄（実行中のワーカーはタイムアウトまたは完了で解放される）
+    - completed / failed: 保持している結果を削除
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    if job["status"] not in JOB_FINISHED_STATUSES:
+        # 削除前に cancelled を配信して SSE 購読者のストリームを閉じる
+        finish_job(job, "cancelled")
+        print(f"🗑 Job cancelled: {job_id}")
+    else:
+        print(f"🗑 Job deleted: {job_id}")
+
+    del _jobs[job_id]
+    return job_to_response(job)
+
+
+def format_sse(record: Dict) -> str:
+    """イベント記録を Server-Sent Events 形式に変換"""
+    data = json.dumps(record["data"], ensure_ascii=False)
+    return f"id: {record['id']}\nevent: {record['event']}\ndata: {data}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """
+    ジョブの進捗を Server-Sent Events で配信
+
+    イベント:
+    - status: ジョブのステータス変化（completed の場合は result を含む）
+    - stage_start / stage_end: 解析ステージの開始・終了（経過時間と途中結果を含む）
+    - cache_hit: キャッシュ済みの結果を返した
+
+    接続前のイベントも履歴から再送する。Last-Event-ID ヘッダーがあればその続きから送る。
+    ジョブが completed / failed / cancelled になった時点でストリームを閉じる。
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    # 履歴の取得と購読登録の間に await を挟まないことでイベントの取りこぼしを防ぐ
+    history = [record for record in job["events"] if record["id"] > last_event_id]
+    subscriber: asyncio.Queue = asyncio.Queue()
+    job["subscribers"].add(subscriber)
+
+    def is_final(record: Dict) -> bool:
+        return record["event"] == "status" and record["data"]["status"] in JOB_FINISHED_STATUSES
+
+    async def event_stream():
+        try:
+            for record in history:
+                yield format_sse(record)
+                if is_final(record):
+                    return
+
+            while True:
+                try:
+                    record = await asyncio.wait_for(subscriber.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    # プロキシにアイドル切断されないよう定期的にコメント行を送る
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield format_sse(record)
+                if is_final(record):
+                    return
+        finally:
+            job["subscribers"].discard(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """解析結果キャッシュの統計（ヒット/ミス数・エントリ数・使用容量）とPCM・stem キャッシュの使用状況"""
+    stats = await run_in_threadpool(result_cache_stats)
+    stats["pcm"] = await run_in_threadpool(pcm_cache_stats)
+    stats["stems"] = await run_in_threadpool(stem_cache_stats)
+    return stats
+
+
+@app.get("/stems/{stem_key}/{name}")
+async def get_stem(stem_key: str, name: str):
+    """
+    分離済みの stem（FLAC）を返す
+
+    解析結果の stems に入っている URL。キャッシュから削除された場合は 404（再解析すると作り直される）。
+    """
+    path = stem_cache_path(stem_key, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Stem not found: {stem_key}/{name}")
+    return FileResponse(path, media_type="audio/flac", filename=f"{name}.flac")
+
+
 # ============================================
 # ダミー解析ロジック（Phase 3 実装）
 # ============================================
@@ -356,7 +2478,7 @@ def analyze_audio_dummy(file_path: str, options: Dict) -> AnalysisResult:
     #
     # 5. stem 分解（オプション）
     # if options.get('separateStems'):
-    #     stems = separate_stems(file_path)
+    #     stems, _ = separate_stems(y, sr)
 
     # Phase 3: ダミーデータを返す
     metadata = AnalysisMetadata(
@@ -434,11 +2556,219 @@ def analyze_audio_dummy(file_path: str, options: Dict) -> AnalysisResult:
     )
 
 
+# ============================================
+# 音声読み込み（デコードは1回だけ、各エンジン・フォールバックで共有）
+# ============================================
+
+class DecodedAudio:
+    """
+    デコード済み音声（ネイティブのサンプルレート・モノラル・float32）
+
+    デコードは最初にアクセスされた時に1回だけ行い、エンジンごとのサンプルレートへの
+    リサンプリングも at() で最初に要求された時に1回だけ計算してキャッシュする。
+    Essentia が失敗して librosa にフォールバックしても再デコードしない。
+
+    audio_hash を渡すとサンプルレートごとのPCMをディスクにキャッシュし、次回以降は
+    デコードせずに memmap で開く（別の設定・エンジンでの再解析が速くなる）。
+    """
+
+    def __init__(self, file_path: str, audio_hash: Optional[str] = None):
+        self.file_path = file_path
+        self.audio_hash = audio_hash if PCM_CACHE_ENABLED else None
+        self._native = None
+        self._native_sr: Optional[int] = None
+        self._resampled: Dict[int, "np.ndarray"] = {}
+
+    def _decode(self):
+        if self._native is None:
+            y, sr = librosa.load(self.file_path, sr=None, mono=True, dtype=np.float32)
+            self._native = np.ascontiguousarray(y)
+            self._native_sr = int(sr)
+
+    def stream(self, sr: int) -> "np.ndarray":
+        """
+        曲全体をメモリに載せずにデコードし、ディスク上のPCMを memmap で開く（長時間の録音用）
+
+        audio_hash があればPCMキャッシュに書き出し、無ければ一時ファイルに書き出す
+        （一時ファイルは開いた直後に削除する。memmap からはそのまま読める）。
+
+        Returns:
+            np.memmap: モノラル float32 の音声（読み取り専用）
+        """
+        if sr in self._resampled:
+            return self._resampled[sr]
+        if self._native is not None:
+            # 既に全体をデコード済み（Essentia からのフォールバックなど）
+            return self.at(sr)
+
+        if self.audio_hash is not None:
+            cached = pcm_cache_get(self.audio_hash, sr)
+            if cached is not None:
+                print(f"    ✓ PCM cache hit ({sr}Hz, {len(cached) / sr:.1f}s)")
+                self._resampled[sr] = cached
+                return cached
+            PCM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            path = _pcm_cache_path(self.audio_hash, sr)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        else:
+            path = None
+            fd, tmp_name = tempfile.mkstemp(suffix=".f32", prefix="pcm_")
+            os.close(fd)
+            tmp_path = Path(tmp_name)
+
+        try:
+            with open(tmp_path, "wb") as f:
+                samples = decode_audio_to_file(self.file_path, sr, f)
+            if samples == 0:
+                raise ValueError("decoded audio is empty")
+            if path is not None:
+                os.replace(tmp_path, path)
+                y = np.memmap(path, dtype=np.float32, mode="r")
+                evict_pcm_cache()
+            else:
+                y = np.memmap(tmp_path, dtype=np.float32, mode="r")
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        self._resampled[sr] = y
+        return y
+
+    def at(self, sr: Optional[int] = None) -> "np.ndarray":
+        """
+        指定サンプルレートの音声を取得
+
+        Args:
+            sr: サンプルレート（None = ネイティブのまま）
+
+        Returns:
+            np.ndarray: モノラル float32 の音声（読み取り専用の memmap の場合あり。書き換えないこと）
+        """
+        if sr is None:
+            self._decode()
+            return self._native
+        if sr in self._resampled:
+            return self._resampled[sr]
+
+        if self.audio_hash is not None:
+            cached = pcm_cache_get(self.audio_hash, sr)
+            if cached is not None:
+                print(f"    ✓ PCM cache hit ({sr}Hz, {len(cached) / sr:.1f}s)")
+                self._resampled[sr] = cached
+                return cached
+
+        self._decode()
+        if sr == self._native_sr:
+            y = self._native
+        else:
+            # librosa.load(sr=...) と同じリサンプラー（soxr_hq）を使う
+            y = np.ascontiguousarray(
+                librosa.resample(self._native, orig_sr=self._native_sr, target_sr=sr),
+                dtype=np.float32,
+            )
+
+        if self.audio_hash is not None:
+            pcm_cache_put(self.audio_hash, sr, y)
+        self._resampled[sr] = y
+        return y
+
+
+def _iter_decoded_blocks(file_path: str, block_seconds: float = 10.0):
+    """
+    音源をブロック単位でデコードしてモノラル float32 で返すジェネレーター
+
+    最初に (ネイティブのサンプルレート) を返し、以降は各ブロックの波形を返す。
+    soundfile で読めない形式（m4a など）は audioread（ffmpeg）で読む。
+    """
+    try:
+        info = sf.info(file_path)
+        native_sr = int(info.samplerate)
+        blocks = sf.blocks(
+            file_path, blocksize=int(native_sr * block_seconds), dtype="float32", always_2d=True
+        )
+    except Exception:
+        import audioread
+        with audioread.audio_open(file_path) as f:
+            yield int(f.samplerate)
+            for buf in f:
+                block = librosa.util.buf_to_float(buf, dtype=np.float32)
+                yield block.reshape(-1, f.channels).mean(axis=1)
+        return
+
+    yield native_sr
+    for block in blocks:
+        yield block.mean(axis=1)
+
+
+def decode_audio_to_file(file_path: str, sr: int, f) -> int:
+    """
+    音源をブロック単位でデコード → モノラル化 → リサンプリングしてファイルに書き出す
+
+    曲全体をメモリに載せないため、長さに関係なくメモリ使用量は一定。
+
+    Args:
+        file_path: 音源ファイルのパス
+        sr: 出力サンプルレート
+        f: 書き込み先（バイナリモードのファイル）
+
+    Returns:
+        int: 書き出したサンプル数
+    """
+    import soxr
+
+    blocks = _iter_decoded_blocks(file_path)
+    native_sr = next(blocks)
+    # librosa.load(sr=...) と同じ soxr の HQ 品質でストリーミング変換
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality="HQ") if native_sr != sr else None
+
+    samples = 0
+    for block in blocks:
+        out = resampler.resample_chunk(block) if resampler is not None else block
+        np.asarray(out, dtype=np.float32).tofile(f)
+        samples += len(out)
+    if resampler is not None:
+        out = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        np.asarray(out, dtype=np.float32).tofile(f)
+        samples += len(out)
+    return samples
+
+
 # ============================================
 # 実解析ロジック（Phase 4 - librosa ベース）
 # ============================================
 
-def analyze_audio_real(file_path: str, options: Dict) -> AnalysisResult:
+def resolve_analysis_tier(options: Dict, duration: float) -> Tuple[str, Dict]:
+    """
+    analysisDepth と timeBudgetMs から解析の深さを決める
+
+    timeBudgetMs がある場合は analysisDepth を上限に、見積もり時間
+    （音源の長さ × ADMISSION_SECONDS_PER_AUDIO_SECOND × cost）が予算内に収まる最も詳細な段階を選ぶ。
+    どの段階も収まらない場合は最も簡易な段階を使う。
+
+    Args:
+        options: 解析オプション
+        duration: 音源の長さ（秒）
+
+    Returns:
+        Tuple[str, Dict]: (段階名, ANALYSIS_TIERS の設定)
+    """
+    depth = options.get("analysisDepth") or "basic"
+    if depth not in ANALYSIS_TIERS:
+        print(f"    ⚠ Unknown analysisDepth={depth}, using basic")
+        depth = "basic"
+
+    budget_ms = options.get("timeBudgetMs")
+    if budget_ms:
+        candidates = ANALYSIS_TIER_ORDER[:ANALYSIS_TIER_ORDER.index(depth) + 1]
+        fitting = [
+            tier for tier in candidates
+            if duration * ADMISSION_SECONDS_PER_AUDIO_SECOND * ANALYSIS_TIERS[tier]["cost"] * 1000 <= budget_ms
+        ]
+        depth = fitting[-1] if fitting else candidates[0]
+
+    return depth, ANALYSIS_TIERS[depth]
+
+
+def analyze_audio_real(file_path: str, options: Dict, audio_hash: Optional[str] = None) -> AnalysisResult:
     """
     実際の音源解析ロジック
 
@@ -446,28 +2776,34 @@ def analyze_audio_real(file_path: str, options: Dict) -> AnalysisResult:
     - USE_ESSENTIA=true かつ essentia利用可能 → Essentia解析
     - それ以外 → librosa解析
 
+    音源のデコードは1回だけ行い、フォールバック時も同じデコード結果を使う。
+
     Args:
         file_path: 音源ファイルのパス
         options: 解析オプション
+        audio_hash: 音源ファイルのSHA-256（PCMキャッシュのキー、None = キャッシュしない）
 
     Returns:
         AnalysisResult: 解析結果
     """
+    audio = DecodedAudio(file_path, audio_hash)
 
     # Essentia優先
     if ESSENTIA_AVAILABLE:
         try:
             print(f"\n[Real Analysis] Using Essentia (高精度モード)...")
-            return analyze_audio_essentia(file_path, options)
+            return analyze_audio_essentia(file_path, options, audio=audio)
         except Exception as e:
             print(f"⚠ Essentia analysis failed: {e}")
             print("  Falling back to librosa analysis...")
 
     # librosaフォールバック
-    return analyze_audio_librosa(file_path, options)
+    return analyze_audio_librosa(file_path, options, audio=audio, audio_hash=audio_hash)
 
 
-def analyze_audio_librosa(file_path: str, options: Dict) -> AnalysisResult:
+def analyze_audio_librosa(
+    file_path: str, options: Dict, audio: Optional[DecodedAudio] = None, audio_hash: Optional[str] = None
+) -> AnalysisResult:
     """
     librosaベースの音源解析ロジック（高精度版）
 
@@ -476,10 +2812,15 @@ def analyze_audio_librosa(file_path: str, options: Dict) -> AnalysisResult:
     - HPSS（Harmonic-Percussive Source Separation）でハーモニック成分を抽出
     - CQT/CENSベースのChroma特徴量で安定したピッチ検出
     - ビート同期コード検出
+    - ANALYSIS_CHUNKED_MIN_DURATION より長い音源はブロック単位で処理（メモリ使用量が一定）
+    - options の analysisDepth / timeBudgetMs で解析の深さ（ANALYSIS_TIERS）を切り替え
+    - options の separateStems で stem 分離（キャッシュ済みの stem があれば分離を省略）
 
     Args:
         file_path: 音源ファイルのパス
         options: 解析オプション
+        audio: デコード済み音声（None の場合はここでデコード）
+        audio_hash: 音源ファイルのSHA-256（stem キャッシュのキー、None = stem 分離を行わない）
 
     Returns:
         AnalysisResult: 解析結果
@@ -490,29 +2831,158 @@ def analyze_audio_librosa(file_path: str, options: Dict) -> AnalysisResult:
 
     # 1. 音声読み込み（全体を読み込んでから最適な区間を選択）
     try:
-        print(f"  Step 1/6: Loading audio file...")
-        y_full, sr = librosa.load(file_path, sr=22050, mono=True)  # 22050Hzで統一
+        print(f"  Step 1/7: Loading audio file...")
+        progress_stage_start("load", 1, 7, "Loading audio file")
+        if audio is None:
+            audio = DecodedAudio(file_path)
+        sr = 22050  # 22050Hzで統一
+        chunked = is_chunked_duration(probe_audio_header(file_path)["duration"])
+        if chunked:
+            # 長時間の録音はディスクに書き出しながらデコードし、memmap で少しずつ読む
+            y_full = audio.stream(sr)
+        else:
+            y_full = audio.at(sr)
         full_duration = len(y_full) / sr
-        print(f"    ✓ Loaded: {full_duration:.2f}s, sr={sr}Hz, samples={len(y_full)}")
+        print(f"    ✓ Loaded: {full_duration:.2f}s, sr={sr}Hz, samples={len(y_full)}{' (chunked)' if chunked else ''}")
+        progress_stage_end("load", duration=full_duration, sampleRate=sr, chunked=chunked)
     except Exception as e:
         print(f"    ✗ Failed to load audio file: {str(e)}")
         raise Exception(f"Failed to load audio file: {str(e)}")
 
-    # 2. HPSS（ハーモニック・パーカッシブ分離）- 全体に適用
-    try:
-        print(f"  Step 2/7: Applying Harmonic-Percussive separation (full track)...")
-        y_harmonic_full, y_percussive_full = librosa.effects.hpss(y_full)
-        print(f"    ✓ Separated harmonic and percussive components")
-    except Exception as e:
-        print(f"    ⚠ HPSS failed: {e}, using original signal")
-        y_harmonic_full = y_full
+    depth, tier = resolve_analysis_tier(options, full_duration)
+    vocabulary = tier["chordVocabulary"]
+    print(f"    ✓ Analysis depth: {depth}")
+
+    # 全体の特徴量（全体 HPSS を行った場合）と、コード検出区間（セクション）
+    harmonic_features = None
+    sections = []
+    segment_only = not tier["keyModulation"]
+
+    # stem（options.separateStems、曲全体を読み込む場合のみ）: キャッシュ済みなら分離をやり直さず、
+    # ハーモニック成分の stem をキー・コード検出に使う
+    stem_key = None
+    stems_ready = False
+    y_harmonic_full = None
+    onset_envelope = None  # 曲全体の打楽器成分のオンセット強度（ビートグリッド用）
+    if options.get("separateStems") and STEM_CACHE_ENABLED and audio_hash and not chunked:
+        stem_key = stem_cache_key(audio_hash, sr)
+        if stem_cache_get(stem_key):
+            try:
+                y_harmonic_full = stem_cache_load(stem_key, "harmonic")
+                y_percussive_full = stem_cache_load(stem_key, "percussive")
+                stems_ready = True
+            except Exception as e:
+                print(f"    ⚠ Stem cache read failed: {e}")
+                y_harmonic_full = None
+
+    if stems_ready:
+        # 2. キャッシュ済みの stem を使う（HPSS・stem 分離は行わない）
+        print(f"  Step 2/7: Using cached stems ({', '.join(STEM_NAMES)})...")
+        progress_stage_start("hpss", 2, 7, "Loading cached stems")
+        onset_envelope = librosa.onset.onset_strength(y=y_percussive_full, sr=sr)
+        print(f"    ✓ Stem cache hit")
+        progress_stage_end("hpss", cached=True)
+        if segment_only:
+            try:
+                bounds = select_chord_sections(
+                    y_full, sr, count=tier["sections"], target_duration=tier["sectionDuration"]
+                )
+                segment_status = "ok"
+            except Exception as e:
+                print(f"    ⚠ Segment selection failed: {e}, using first {tier['sectionDuration']:.0f}s")
+                bounds = [snap_segment_to_frames(0.0, tier["sectionDuration"], sr, len(y_full))]
+                segment_status = "fallback"
+            sections = [prepare_chord_section(y_full, sr, *bound, y_harmonic_full) for bound in bounds]
+    elif segment_only:
+        # 2. 区間選択 + 選択区間だけの HPSS（全体のキー分析を行わない場合）
+        try:
+            print(f"  Step 2/7: Selecting sections and applying HPSS (sections only)...")
+            progress_stage_start("hpss", 2, 7, "Harmonic-percussive separation (selected sections)")
+            rms = None
+            if chunked:
+                _, rms, _ = scan_track_in_blocks(y_full, sr, block_duration=15.0, estimate_keys=False)
+            bounds = select_chord_sections(
+                y_full, sr, rms=rms, count=tier["sections"], target_duration=tier["sectionDuration"]
+            )
+            segment_status = "ok"
+        except Exception as e:
+            print(f"    ⚠ Segment selection failed: {e}, using first {tier['sectionDuration']:.0f}s")
+            bounds = [snap_segment_to_frames(0.0, tier["sectionDuration"], sr, len(y_full))]
+            segment_status = "fallback"
+        sections = map_in_threads(lambda bound: prepare_chord_section(y_full, sr, *bound), bounds)
+        print(f"    ✓ Separated harmonic and percussive components ({sum(len(sec['y']) for sec in sections) / sr:.1f}s)")
+        progress_stage_end("hpss")
+    elif chunked:
+        # 2. ブロック単位の HPSS・キー推定・RMS 計算（全体の HPSS は行わない）
+        try:
+            print(f"  Step 2/7: Scanning track in blocks (HPSS, key, loudness)...")
+            progress_stage_start("hpss", 2, 7, "Block-wise harmonic-percussive separation")
+            segment_keys, rms, num_blocks = scan_track_in_blocks(y_full, sr, block_duration=tier["keySegmentDuration"])
+            print(f"    ✓ Scanned {num_blocks} blocks")
+            progress_stage_end("hpss", blocks=num_blocks)
+        except Exception as e:
+            print(f"    ⚠ Block scan failed: {e}")
+            segment_keys, rms = [], None
+            progress_stage_end("hpss", status="fallback")
+    elif stem_key is not None:
+        # 2. stem 分離（HPSS に bass・residual を加えたもの）- 全体に適用し、キャッシュに保存
+        try:
+            print(f"  Step 2/7: Separating stems (full track)...")
+            progress_stage_start("hpss", 2, 7, "Stem separation")
+            stems, onset_envelope = separate_stems(y_full, sr)
+            y_harmonic_full, y_percussive_full = stems["harmonic"], stems["percussive"]
+            stems_ready = stem_cache_put(stem_key, stems, sr)
+            del stems
+            print(f"    ✓ Separated stems: {', '.join(STEM_NAMES)}{'' if stems_ready else ' (not cached)'}")
+            progress_stage_end("hpss")
+        except Exception as e:
+            print(f"    ⚠ Stem separation failed: {e}, using original signal")
+            y_harmonic_full = y_full
+            progress_stage_end("hpss", status="fallback")
+    else:
+        # 2. HPSS（ハーモニック・パーカッシブ分離）- 全体に適用
+        try:
+            print(f"  Step 2/7: Applying Harmonic-Percussive separation (full track)...")
+            progress_stage_start("hpss", 2, 7, "Harmonic-percussive separation")
+            stems, onset_envelope = separate_stems(y_full, sr, names=("harmonic", "percussive"))
+            y_harmonic_full, y_percussive_full = stems["harmonic"], stems["percussive"]
+            del stems
+            print(f"    ✓ Separated harmonic and percussive components")
+            progress_stage_end("hpss")
+        except Exception as e:
+            print(f"    ⚠ HPSS failed: {e}, using original signal")
+            y_harmonic_full = y_full
+            progress_stage_end("hpss", status="fallback")
 
     # 3. セグメント分割キー検出（転調対応）
     try:
-        print(f"  Step 3/7: Detecting keys with modulation analysis...")
-        detected_keys_info, detected_key, scale_name, confidence = detect_keys_with_modulation(
-            y_harmonic_full, sr, segment_duration=15.0
-        )
+        if segment_only:
+            print(f"  Step 3/7: Detecting key from selected sections...")
+            progress_stage_start("key", 3, 7, "Detecting key from selected sections")
+            features = map_in_threads(
+                lambda sec: ChromaFeatures(sec['y_harmonic'], sr, tier["hopLength"], tier["binsPerOctave"]), sections
+            )
+            for section, section_features in zip(sections, features):
+                section['features'] = section_features
+            detected_key, scale_name, confidence = estimate_key_from_chroma(
+                np.mean(np.hstack([section['features'].key_chroma for section in sections]), axis=1)
+            )
+            detected_keys_info = [
+                {"key": detected_key, "scale": scale_name, "confidence": confidence, "occurrence": 1.0}
+            ]
+        else:
+            print(f"  Step 3/7: Detecting keys with modulation analysis...")
+            progress_stage_start("key", 3, 7, "Detecting keys with modulation analysis")
+            if not chunked:
+                # 全体の特徴量はコード検出区間でも切り出して再利用する
+                harmonic_features = ChromaFeatures(y_harmonic_full, sr, tier["hopLength"], tier["binsPerOctave"])
+                detected_keys_info, detected_key, scale_name, confidence = detect_keys_with_modulation(
+                    y_harmonic_full, sr, segment_duration=tier["keySegmentDuration"], features=harmonic_features
+                )
+            elif segment_keys:
+                detected_keys_info, detected_key, scale_name, confidence = aggregate_segment_keys(segment_keys)
+            else:
+                raise ValueError("no block key estimates")
 
         if len(detected_keys_info) == 1:
             print(f"    ✓ Single key detected: {detected_key} {scale_name} (confidence: {confidence:.2f})")
@@ -520,106 +2990,482 @@ def analyze_audio_librosa(file_path: str, options: Dict) -> AnalysisResult:
             print(f"    ✓ Multiple keys detected:")
             for ki in detected_keys_info:
                 print(f"      - {ki['key']} {ki['scale']}: {ki['occurrence']*100:.0f}%")
+        key_status = "ok"
     except Exception as e:
         print(f"    ⚠ Key detection failed: {e}, using default C major")
         detected_key = "C"
         scale_name = "メジャー"
         confidence = 0.5
         detected_keys_info = [{"key": "C", "scale": "メジャー", "confidence": 0.5, "occurrence": 1.0}]
+        key_status = "fallback"
 
-    # 4. ラウドネスベースの最適区間選択（コード検出用）
-    try:
-        print(f"  Step 4/7: Selecting optimal segment for chord detection...")
-        y, start_time, end_time = select_loudest_segment(y_full, sr, target_duration=30.0)
-        y_harmonic, _ = librosa.effects.hpss(y)  # 選択区間のHPSS
-        duration = len(y) / sr
-        print(f"    ✓ Selected segment: {start_time:.1f}s - {end_time:.1f}s ({duration:.1f}s)")
-    except Exception as e:
-        print(f"    ⚠ Segment selection failed: {e}, using first 30s")
-        y = y_full[:int(30.0 * sr)]
-        y_harmonic = y_harmonic_full[:int(30.0 * sr)]
-        duration = len(y) / sr
-        start_time = 0.0
-        end_time = duration
-
-    # 5. テンポ・ビート推定（選択区間から）
+    progress_stage_end(
+        "key",
+        status=key_status,
+        detectedKey=detected_key,
+        scale=scale_name,
+        confidence=float(confidence),
+        detectedKeys=[
+            {**ki, "confidence": float(ki["confidence"]), "occurrence": float(ki["occurrence"])}
+            for ki in detected_keys_info
+        ],
+    )
+
+    # 曲全体のビートグリッド（step 2 の打楽器成分から1回だけ追跡し、区間ごとに切り出す）
+    beat_grid = None
+    if onset_envelope is not None:
+        try:
+            beat_grid = track_beat_grid(onset_envelope, sr)
+        except Exception as e:
+            print(f"    ⚠ Full-track beat tracking failed: {e}")
+        del onset_envelope
+
+    # 4. 構成検出（structure、曲全体の特徴量がある場合）
+    #    またはラウドネスベースの区間選択（コード検出用、音量の大きい順に最大 sections 区間）
+    structure = None
+    if tier["structure"] and harmonic_features is not None:
+        print(f"  Step 4/7: Detecting song structure...")
+        progress_stage_start("segment", 4, 7, "Detecting song structure")
+        try:
+            if beat_grid is not None:
+                tempo, beats = beat_grid['tempo'], beat_grid['beats']
+            else:
+                tempo, beat_frames = librosa.beat.beat_track(y=y_full, sr=sr)
+                tempo = float(tempo)
+                beats = librosa.frames_to_time(beat_frames, sr=sr)
+            structure = detect_song_structure(
+                harmonic_features, librosa.time_to_frames(beats, sr=sr, hop_length=harmonic_features.hop_length)
+            )
+            if structure is None:
+                raise ValueError("too few beats")
+        except Exception as e:
+            print(f"    ⚠ Structure detection failed: {e}, selecting sections instead")
+            structure = None
+    else:
+        print(f"  Step 4/7: Selecting sections for chord detection...")
+        progress_stage_start("segment", 4, 7, "Selecting sections for chord detection")
+
+    if structure is not None:
+        # 曲全体を構成セクションに分けてコード検出する
+        beat_times = structure['beat_times']
+        section_bounds = [
+            (float(beat_times[seg['start_beat']]), float(beat_times[seg['end_beat']]), seg['label'])
+            for seg in structure['segments']
+        ]
+        start_time, end_time, duration = 0.0, full_duration, full_duration
+        for seg_start, seg_end, label in section_bounds:
+            print(f"    ✓ Section {label}: {seg_start:.1f}s - {seg_end:.1f}s ({seg_end - seg_start:.1f}s)")
+        progress_stage_end(
+            "segment",
+            startTime=start_time,
+            endTime=end_time,
+            sections=[[seg_start, seg_end] for seg_start, seg_end, _ in section_bounds],
+            labels=[label for _, _, label in section_bounds],
+        )
+    elif not segment_only:
+        try:
+            if chunked and rms is None:
+                raise ValueError("no loudness data")
+            bounds = select_chord_sections(
+                y_full, sr, rms=rms if chunked else None,
+                count=tier["sections"], target_duration=tier["sectionDuration"]
+            )
+            segment_status = "ok"
+        except Exception as e:
+            print(f"    ⚠ Segment selection failed: {e}, using first {tier['sectionDuration']:.0f}s")
+            bounds = [snap_segment_to_frames(0.0, tier["sectionDuration"], sr, len(y_full))]
+            segment_status = "fallback"
+        if chunked:
+            # 全体の HPSS 結果がないため、選択区間だけ分離する
+            sections = map_in_threads(lambda bound: prepare_chord_section(y_full, sr, *bound), bounds)
+        else:
+            # 全体の HPSS 結果をフレーム境界で切り出して再利用（区間の HPSS はやり直さない）
+            sections = [
+                prepare_chord_section(y_full, sr, start, end, y_harmonic_full, harmonic_features)
+                for start, end in bounds
+            ]
+    if structure is None:
+        # 先頭が最も音量の大きい区間（テンポ・メタデータに使う）
+        primary = sections[0]
+        start_time = primary['start'] / sr
+        end_time = primary['end'] / sr
+        duration = len(primary['y']) / sr
+        sections.sort(key=lambda sec: sec['start'])
+        section_bounds = [(sec['start'] / sr, sec['end'] / sr, None) for sec in sections]
+        for section in sections:
+            marker = " (loudest)" if section is primary and len(sections) > 1 else ""
+            print(f"    ✓ Selected segment: {section['start'] / sr:.1f}s - {section['end'] / sr:.1f}s ({len(section['y']) / sr:.1f}s){marker}")
+        progress_stage_end(
+            "segment",
+            status=segment_status,
+            startTime=float(start_time),
+            endTime=float(end_time),
+            sections=[[seg_start, seg_end] for seg_start, seg_end, _ in section_bounds],
+        )
+
+    # 5. テンポ・ビート推定（ビートグリッドまたは構成検出では曲全体で推定済み、それ以外は最も音量の大きい区間から）
     try:
         print(f"  Step 5/7: Detecting tempo and beats...")
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        tempo = float(tempo)
-        beats = librosa.frames_to_time(beat_frames, sr=sr)
-        print(f"    ✓ Tempo detected: {tempo:.1f} BPM, {len(beats)} beats")
+        progress_stage_start("tempo", 5, 7, "Detecting tempo and beats")
+        if beat_grid is not None:
+            tempo, beats = beat_grid['tempo'], beat_grid['beats']
+        elif structure is None:
+            tempo, beat_frames = librosa.beat.beat_track(y=primary['y'], sr=sr)
+            tempo = float(tempo)
+            beats = librosa.frames_to_time(beat_frames, sr=sr)
+        scope = "full track" if beat_grid is not None or structure is not None else "loudest section"
+        print(f"    ✓ Tempo detected: {tempo:.1f} BPM, {len(beats)} beats ({scope})")
+        progress_stage_end("tempo", tempo=tempo, beatCount=len(beats))
     except Exception as e:
         print(f"    ⚠ Tempo detection failed: {e}, using default 120 BPM")
         tempo = 120.0
         beats = []
+        progress_stage_end("tempo", status="fallback", tempo=tempo, beatCount=0)
+
+    # メタデータの構築（キーとテンポが確定した時点で部分結果として先に送る）
+    # 複数キーが検出された場合はdetectedKeysに格納
+    detected_keys_list = None
+    if len(detected_keys_info) > 1:
+        detected_keys_list = [
+            DetectedKeyInfo(
+                key=ki['key'],
+                scale=ki['scale'],
+                confidence=ki['confidence'],
+                occurrence=ki['occurrence']
+            )
+            for ki in detected_keys_info
+        ]
+
+    metadata = AnalysisMetadata(
+        duration=full_duration,
+        tempo=tempo,
+        timeSignature="4/4",
+        detectedKey=detected_key,
+        scale=scale_name,
+        confidence=confidence,
+        detectedKeys=detected_keys_list,
+        analysisDepth=depth
+    )
 
-    # 6. ビート同期コード進行検出（選択区間のハーモニック成分を使用）
+    progress_partial("metadata", metadata=metadata.dict())
+
+    def section_beats(section):
+        """区間のテンポ・ビート位置・小節頭までの拍数（ビートグリッドがなければ最も音量の大きい区間だけ推定済み）"""
+        if beat_grid is not None:
+            return slice_beat_grid(beat_grid, section['start'] / sr, section['end'] / sr)
+        return (tempo, beats, 0) if section is primary else (None, None, 0)
+
+    # 6. ビート同期コード進行検出（各区間のハーモニック成分を使用、複数区間は並列）
+    section_results = []
     try:
         print(f"  Step 6/7: Detecting chord progression (beat-synced)...")
-        if len(beats) >= 4:
-            chord_progression = detect_chords_beat_synced(
-                y_harmonic, sr, beats, detected_key, scale_name, start_time
+        progress_stage_start("chords", 6, 7, "Detecting chord progression")
+        if structure is not None:
+            # 構成ラベルごとに1回だけ照合し、繰り返しセクションにコピーする
+            section_chords, unique_bars, total_bars = detect_structure_chords(
+                structure, harmonic_features, detected_key, scale_name, vocabulary=vocabulary
             )
+            for (seg_start, seg_end, _), chords in zip(section_bounds, section_chords):
+                section_tempo = slice_beat_grid(beat_grid, seg_start, seg_end)[0] if beat_grid is not None else tempo
+                section_results.append((section_tempo, None, chords))
+                progress_partial("chords", chords=[c.dict() for c in chords])
+            print(f"    ✓ Matched {unique_bars} unique bars for {total_bars} bars")
+        elif len(sections) == 1:
+            # 1区間の場合は小節ごとの部分結果をそのまま送る
+            section_tempo, section_beat_times, bar_offset = section_beats(primary)
+            section_results = [
+                detect_section_chords(
+                    primary, sr, detected_key, scale_name, section_tempo, section_beat_times, vocabulary, bar_offset
+                )
+            ]
         else:
-            chord_progression = detect_chords_enhanced(
-                y_harmonic, sr, detected_key, scale_name, start_time
-            )
-        print(f"    ✓ Detected {len(chord_progression)} chord segments")
+            with ThreadPoolExecutor(max_workers=max(1, min(len(sections), ANALYSIS_THREADS))) as section_pool:
+                futures = []
+                for section in sections:
+                    section_tempo, section_beat_times, bar_offset = section_beats(section)
+                    futures.append(section_pool.submit(
+                        detect_section_chords, section, sr, detected_key, scale_name,
+                        section_tempo, section_beat_times, vocabulary, bar_offset
+                    ))
+                # スレッドからは進捗を送れないため、完了した区間から時刻順に送る
+                for future in futures:
+                    result = future.result()
+                    section_results.append(result)
+                    progress_partial("chords", chords=[c.dict() for c in result[2]])
+        chord_progression = [chord for _, _, chords in section_results for chord in chords]
+        print(f"    ✓ Detected {len(chord_progression)} chord segments in {len(section_results)} section(s)")
         if len(chord_progression) > 0:
             print(f"    First chord: {chord_progression[0].chord} ({chord_progression[0].startTime:.1f}s - {chord_progression[0].endTime:.1f}s)")
+        chords_status = "ok"
     except Exception as e:
         print(f"    ⚠ Chord detection failed: {e}, using fallback")
         chord_progression = generate_fallback_chords(detected_key, full_duration)
+        section_results = []
+        chords_status = "fallback"
+        # 途中まで送ったコードは破棄してフォールバックに置き換える
+        progress_partial("chords", chords=[c.dict() for c in chord_progression], reset=True)
+
+    analysis_sections = [
+        AnalysisSection(
+            startTime=seg_start,
+            endTime=seg_end,
+            tempo=section_tempo,
+            chordProgression=chords,
+            label=label,
+        )
+        for (seg_start, seg_end, label), (section_tempo, _, chords) in zip(section_bounds, section_results)
+    ] or None
+
+    progress_stage_end(
+        "chords",
+        status=chords_status,
+        chordProgression=[c.dict() for c in chord_progression],
+    )
 
     # 7. スケールマッチング（キーに基づいて）
     print(f"  Step 7/7: Generating scale matches...")
+    progress_stage_start("scales", 7, 7, "Generating scale matches")
 
     try:
         scale_match = generate_scale_match(detected_key, scale_name, chord_progression)
         print(f"    ✓ Generated {len(scale_match.matchingScales)} scale matches")
+        progress_stage_end("scales", scaleMatch=scale_match.dict())
     except Exception as e:
         print(f"    ⚠ Scale matching failed: {e}")
         scale_match = ScaleMatchResult(matchingScales=[])
+        progress_stage_end("scales", status="fallback")
 
-    # メタデータの構築
-    # 複数キーが検出された場合はdetectedKeysに格納
-    detected_keys_list = None
-    if len(detected_keys_info) > 1:
-        detected_keys_list = [
-            DetectedKeyInfo(
-                key=ki['key'],
-                scale=ki['scale'],
-                confidence=ki['confidence'],
-                occurrence=ki['occurrence']
-            )
-            for ki in detected_keys_info
-        ]
+    print(f"\n[Librosa Analysis] Analysis completed successfully!")
+    print(f"  Result: {detected_key} {scale_name}, {tempo:.1f} BPM, {len(chord_progression)} chords")
+    if structure is not None:
+        print(f"  Analyzed full track: {len(section_bounds)} sections ({'-'.join(label for _, _, label in section_bounds)})")
+    else:
+        print(f"  Analyzed segment: {start_time:.1f}s - {end_time:.1f}s (loudest {duration:.1f}s)"
+              + (f", {len(sections) - 1} more section(s)" if len(sections) > 1 else ""))
+    print("=" * 60)
+
+    return AnalysisResult(
+        metadata=metadata,
+        chordProgression=chord_progression,
+        scaleMatch=scale_match,
+        stems=stem_urls(stem_key) if stems_ready else None,
+        sections=analysis_sections,
+        beatGrid=BeatGrid(
+            beats=beat_grid['beats'].tolist(),
+            downbeats=beat_grid['downbeats'].tolist(),
+            tempoCurve=[TempoPoint(time=t, tempo=bpm) for t, bpm in beat_grid['tempo_curve']],
+        ) if beat_grid is not None else None
+    )
+
+
+def map_in_threads(func, items, max_workers: Optional[int] = None) -> List:
+    """
+    items の各要素に func を適用し、結果を items の順に返す
+
+    最大 ANALYSIS_THREADS 本のスレッドで並列に実行する（結果の順序は実行順に依存しない）。
+
+    Args:
+        func: 各要素に適用する関数
+        items: 入力の列
+        max_workers: スレッド数の上限（None の場合は ANALYSIS_THREADS）
+
+    Returns:
+        List: func の結果（items と同じ順）
+    """
+    items = list(items)
+    workers = min(max_workers or ANALYSIS_THREADS, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items))
+
+
+STEM_RESIDUAL_MARGIN = 2.0  # residual: この比で調波・打楽器のどちらにも寄らない成分
+STEM_BASS_CUTOFF = 250.0  # bass: 調波成分のうちこの周波数（Hz）以下
+
+
+def separate_stems(y, sr, n_fft=2048, names=STEM_NAMES):
+    """
+    HPSS ベースの CPU 向け stem 分離
+
+    STFT のメディアンフィルタ（時間方向 = 調波、周波数方向 = 打楽器）を1回だけ計算し、
+    ソフトマスクで以下の stem を作る。harmonic / percussive は librosa.effects.hpss(y) と同じ結果になる。
+    - harmonic: 調波成分（キー・コード検出に使う）
+    - percussive: 打楽器成分
+    - bass: 調波成分のうち STEM_BASS_CUTOFF Hz 以下
+    - residual: margin STEM_RESIDUAL_MARGIN で調波・打楽器のどちらにも分類されない成分（ボーカル・ノイズなど）
+
+    打楽器成分のオンセット強度（ビート追跡用）も同じ STFT から求める。
+
+    Args:
+        y: 音声波形
+        sr: サンプリングレート
+        n_fft: STFT のサイズ
+        names: 作る stem（("harmonic", "percussive") なら HPSS のみ）
+
+    Returns:
+        Tuple[Dict[str, ndarray], ndarray]: (stem 名 → 波形（y と同じ長さ、float32）,
+            打楽器成分のオンセット強度（hop_length = n_fft // 4）)
+    """
+    D = librosa.stft(y, n_fft=n_fft)
+    S, phase = librosa.magphase(D)
+    del D
+    harm = np.empty_like(S)
+    harm[:] = scipy.ndimage.median_filter(S, size=(1, 31), mode="reflect")
+    perc = np.empty_like(S)
+    perc[:] = scipy.ndimage.median_filter(S, size=(31, 1), mode="reflect")
+
+    def invert(mask):
+        return librosa.istft(S * mask * phase, n_fft=n_fft, dtype=y.dtype, length=len(y))
+
+    mask_harm = librosa.util.softmask(harm, perc, power=2.0, split_zeros=True)
+    mask_perc = librosa.util.softmask(perc, harm, power=2.0, split_zeros=True)
+    stems = {"harmonic": invert(mask_harm), "percussive": invert(mask_perc)}
+    # onset_strength(y=percussive) と同じく log-power メルスペクトログラムから求める（STFT はやり直さない）
+    mel = librosa.feature.melspectrogram(S=(S * mask_perc) ** 2, sr=sr, n_fft=n_fft)
+    onset_envelope = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr)
+    del mask_perc, mel
+    if "bass" in names:
+        bass_bins = librosa.fft_frequencies(sr=sr, n_fft=n_fft) <= STEM_BASS_CUTOFF
+        stems["bass"] = invert(mask_harm * bass_bins[:, None])
+    del mask_harm
+    if "residual" in names:
+        stems["residual"] = invert(
+            1.0
+            - librosa.util.softmask(harm, perc * STEM_RESIDUAL_MARGIN, power=2.0)
+            - librosa.util.softmask(perc, harm * STEM_RESIDUAL_MARGIN, power=2.0)
+        )
+    return stems, onset_envelope
+
+
+BEAT_GRID_TEMPO_WINDOW = 8  # テンポカーブ: この拍数の区間ごとにビート間隔の中央値からテンポを求める
+
+
+def track_beat_grid(onset_envelope, sr, hop_length=512, beats_per_bar=4):
+    """
+    曲全体のビートグリッド（ビート・小節頭・テンポカーブ）を推定する
+
+    打楽器成分のオンセット強度から1回だけビート追跡を行う。
+    小節頭は、beats_per_bar 拍ごとの位相のうちオンセット強度の平均が最も大きいものとする。
+
+    Args:
+        onset_envelope: 曲全体のオンセット強度（separate_stems() の結果など）
+        sr: サンプリングレート
+        hop_length: オンセット強度のホップ長
+        beats_per_bar: 1小節の拍数
+
+    Returns:
+        Dict: 'tempo'（曲全体のテンポ）、'beats' / 'downbeats'（秒）、
+            'tempo_curve'（(時刻, テンポ) のリスト）
+    """
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length)
+    beats = librosa.frames_to_time(beat_frames, sr=sr, hop_length=hop_length)
 
-    metadata = AnalysisMetadata(
-        duration=full_duration,
-        tempo=tempo,
-        timeSignature="4/4",
-        detectedKey=detected_key,
-        scale=scale_name,
-        confidence=confidence,
-        detectedKeys=detected_keys_list
-    )
+    downbeats = beats[:0]
+    if len(beat_frames) >= beats_per_bar:
+        strength = onset_envelope[beat_frames]
+        phase = int(np.argmax([strength[p::beats_per_bar].mean() for p in range(beats_per_bar)]))
+        downbeats = beats[phase::beats_per_bar]
 
-    print(f"\n[Librosa Analysis] Analysis completed successfully!")
-    print(f"  Result: {detected_key} {scale_name}, {tempo:.1f} BPM, {len(chord_progression)} chords")
-    print(f"  Analyzed segment: {start_time:.1f}s - {end_time:.1f}s (loudest {duration:.1f}s)")
-    print("=" * 60)
+    tempo_curve = []
+    for i in range(0, len(beats) - 1, BEAT_GRID_TEMPO_WINDOW):
+        window = beats[i:i + BEAT_GRID_TEMPO_WINDOW + 1]
+        if len(window) >= 2:
+            tempo_curve.append((float(window[0]), float(60.0 / np.median(np.diff(window)))))
 
-    return AnalysisResult(
-        metadata=metadata,
-        chordProgression=chord_progression,
-        scaleMatch=scale_match,
-        stems=None  # Phase 4 では未実装
-    )
+    return {
+        'tempo': float(tempo),
+        'beats': beats,
+        'downbeats': downbeats,
+        'tempo_curve': tempo_curve,
+    }
+
+
+def slice_beat_grid(grid, start_time, end_time):
+    """
+    ビートグリッドから1区間のテンポとビート位置を切り出す
+
+    Args:
+        grid: track_beat_grid() の結果
+        start_time: 区間の開始時刻（秒）
+        end_time: 区間の終了時刻（秒）
 
+    Returns:
+        Tuple[float, ndarray, int]: (区間のテンポ, ビート位置（秒、区間の先頭を 0 とする）,
+            区間の最初の小節頭までの拍数（小節をコードの切り替わりに揃えるため）)
+    """
+    in_section = (grid['beats'] >= start_time) & (grid['beats'] < end_time)
+    beats = grid['beats'][in_section] - start_time
+    tempo = float(60.0 / np.median(np.diff(beats))) if len(beats) >= 2 else grid['tempo']
+    downbeats = grid['downbeats']
+    downbeats = downbeats[(downbeats >= start_time) & (downbeats < end_time)]
+    bar_offset = int(np.searchsorted(beats, downbeats[0] - start_time - 1e-6)) if len(downbeats) else 0
+    return tempo, beats, bar_offset
+
+
+class ChromaFeatures:
+    """
+    ハーモニック成分の特徴量ストア（1トラック分）
+
+    CQT を固定ホップで1回だけ計算し、chroma（CQT）と CENS をそこから導出する。
+    キー検出のセグメントやコード検出の小節は、区間ごとに CQT をやり直さず、
+    フレーム番号で切り出して集計する。
+    """
 
-def detect_keys_with_modulation(y_harmonic, sr, segment_duration=15.0, min_occurrence=0.15):
+    BINS_PER_OCTAVE = 36  # librosa.feature.chroma_cqt のデフォルトと同じ
+    N_OCTAVES = 7
+
+    def __init__(self, y_harmonic, sr, hop_length=512, bins_per_octave=BINS_PER_OCTAVE):
+        self.sr = sr
+        self.hop_length = hop_length
+        C = np.abs(librosa.cqt(
+            y=np.asarray(y_harmonic, dtype=np.float32),
+            sr=sr,
+            hop_length=hop_length,
+            n_bins=self.N_OCTAVES * bins_per_octave,
+            bins_per_octave=bins_per_octave,
+        ))
+        self.chroma = librosa.feature.chroma_cqt(
+            C=C, sr=sr, hop_length=hop_length, bins_per_octave=bins_per_octave
+        )
+        self.cens = librosa.feature.chroma_cens(
+            C=C, sr=sr, hop_length=hop_length, bins_per_octave=bins_per_octave
+        )
+        # キー推定用（CQTの精度 + CENSの安定性）
+        self.key_chroma = (self.chroma + self.cens) / 2
+        self.n_frames = self.chroma.shape[1]
+
+    def frames(self, start_time, end_time):
+        """区間 [start_time, end_time) に中心があるフレームの範囲（最低1フレーム）"""
+        f0 = min(self.n_frames - 1, max(0, int(np.ceil(start_time * self.sr / self.hop_length))))
+        f1 = min(self.n_frames, int(np.ceil(end_time * self.sr / self.hop_length)))
+        return f0, max(f1, f0 + 1)
+
+    def mean(self, feature, start_time, end_time):
+        """区間内の特徴量（12次元）の時間平均"""
+        f0, f1 = self.frames(start_time, end_time)
+        return np.mean(feature[:, f0:f1], axis=1)
+
+    def slice(self, start_sample, end_sample) -> "ChromaFeatures":
+        """
+        サンプル区間 [start_sample, end_sample) の特徴量（時刻は区間の先頭を 0 とする）
+
+        境界は hop_length の倍数（snap_segment_to_frames で揃えた値）を想定。
+        区間の波形から計算し直した場合と同じフレーム数になる。
+        """
+        f0 = start_sample // self.hop_length
+        f1 = min(self.n_frames, f0 + 1 + (end_sample - start_sample) // self.hop_length)
+        view = object.__new__(ChromaFeatures)
+        view.sr = self.sr
+        view.hop_length = self.hop_length
+        view.chroma = self.chroma[:, f0:f1]
+        view.cens = self.cens[:, f0:f1]
+        view.key_chroma = self.key_chroma[:, f0:f1]
+        view.n_frames = view.chroma.shape[1]
+        return view
+
+
+def detect_keys_with_modulation(y_harmonic, sr, segment_duration=15.0, min_occurrence=0.15, features=None):
     """
     セグメント分割によるキー検出（転調対応）
 
@@ -631,6 +3477,7 @@ def detect_keys_with_modulation(y_harmonic, sr, segment_duration=15.0, min_occur
         sr: サンプリングレート
         segment_duration: セグメントの長さ（秒）
         min_occurrence: 報告する最小出現割合（これ以下は無視）
+        features: y_harmonic の ChromaFeatures（None の場合はここで計算）
 
     Returns:
         Tuple[List[dict], str, str, float]:
@@ -642,36 +3489,49 @@ def detect_keys_with_modulation(y_harmonic, sr, segment_duration=15.0, min_occur
     full_duration = len(y_harmonic) / sr
     num_segments = max(1, int(np.ceil(full_duration / segment_duration)))
 
-    # 各セグメントでキーを推定
-    segment_keys = []
+    # 特徴量は全体で1回だけ計算し、セグメントはフレームで切り出す
+    if features is None:
+        features = ChromaFeatures(y_harmonic, sr)
+
+    # 各セグメントの chroma を並べ、24キーとの相関をまとめて計算
+    segment_chroma = []
 
     for i in range(num_segments):
         start_time = i * segment_duration
         end_time = min((i + 1) * segment_duration, full_duration)
 
-        start_sample = int(start_time * sr)
-        end_sample = int(end_time * sr)
-        segment = y_harmonic[start_sample:end_sample]
-
         # 短すぎるセグメントはスキップ
-        if len(segment) < sr * 5:  # 5秒未満
+        if int(end_time * sr) - int(start_time * sr) < sr * 5:  # 5秒未満
             continue
 
-        try:
-            key, scale, conf = estimate_key_enhanced(segment, sr)
-            segment_keys.append({
-                'key': key,
-                'scale': scale,
-                'confidence': conf
-            })
-        except Exception:
-            continue
+        segment_chroma.append(features.mean(features.key_chroma, start_time, end_time))
+
+    segment_keys = []
+    if segment_chroma:
+        segment_keys = [
+            {'key': key, 'scale': scale, 'confidence': conf}
+            for key, scale, conf in estimate_keys_from_chroma(np.stack(segment_chroma))
+        ]
 
     if not segment_keys:
         # フォールバック: 全体からキー推定
-        key, scale, conf = estimate_key_enhanced(y_harmonic, sr)
+        key, scale, conf = estimate_key_from_chroma(np.mean(features.key_chroma, axis=1))
         return [{"key": key, "scale": scale, "confidence": conf, "occurrence": 1.0}], key, scale, conf
 
+    return aggregate_segment_keys(segment_keys, min_occurrence)
+
+
+def aggregate_segment_keys(segment_keys: List[Dict], min_occurrence: float = 0.15):
+    """
+    セグメントごとのキー推定結果を集計し、出現割合とともに返す
+
+    Args:
+        segment_keys: [{'key', 'scale', 'confidence'}, ...]（1件以上）
+        min_occurrence: 報告する最小出現割合（これ以下は無視）
+
+    Returns:
+        Tuple[List[dict], str, str, float]: detect_keys_with_modulation と同じ
+    """
     # キー+スケールの組み合わせで集計
     key_counts = {}
     for sk in segment_keys:
@@ -738,30 +3598,433 @@ def select_loudest_segment(y, sr, target_duration=30.0, hop_length=512):
     # RMSエネルギーを計算
     rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
 
-    # 移動平均でスムージング（target_duration相当のウィンドウ）
+    best_start_time, best_end_time = select_loudest_window(rms, sr, full_duration, target_duration, hop_length)
+
+    # 波形を切り出し
+    start_sample = int(best_start_time * sr)
+    end_sample = int(best_end_time * sr)
+
+    return y[start_sample:end_sample], best_start_time, best_end_time
+
+
+def select_chord_sections(y_full, sr, rms=None, count=1, target_duration=30.0, hop_length=512):
+    """
+    コード検出に使う区間（重ならない最大 count 区間）を選び、境界を STFT フレームに揃える
+
+    Args:
+        y_full: 音声波形（全体）
+        sr: サンプリングレート
+        rms: 全体の RMS 系列（None の場合は y_full から計算）
+        count: 選ぶ区間の最大数
+        target_duration: 1区間の長さ（秒）
+        hop_length: RMS / STFT のホップ長
+
+    Returns:
+        List[Tuple[int, int]]: [(開始サンプル, 終了サンプル), ...]（音量の大きい順）
+    """
+    if rms is None:
+        rms = librosa.feature.rms(y=y_full, hop_length=hop_length)[0]
+    windows = select_loudest_sections(rms, sr, len(y_full) / sr, count, target_duration, hop_length)
+    return [
+        snap_segment_to_frames(start_time, end_time, sr, len(y_full), hop_length)
+        for start_time, end_time in windows
+    ]
+
+
+def prepare_chord_section(y_full, sr, start_sample, end_sample, y_harmonic_full=None, harmonic_features=None):
+    """
+    コード検出区間の波形・ハーモニック成分・特徴量を用意する
+
+    y_harmonic_full（と harmonic_features）がある場合は切り出して再利用し、
+    ない場合は区間だけ HPSS を掛ける（features は None、必要になった時点で計算される）。
+
+    Returns:
+        dict: {'start', 'end', 'y', 'y_harmonic', 'features'}
+    """
+    y = np.array(y_full[start_sample:end_sample], dtype=np.float32)
+    features = None
+    if y_harmonic_full is None:
+        try:
+            y_harmonic = librosa.effects.hpss(y)[0]
+        except Exception:
+            y_harmonic = y
+    else:
+        y_harmonic = y_harmonic_full[start_sample:end_sample]
+        if harmonic_features is not None:
+            features = harmonic_features.slice(start_sample, end_sample)
+    return {'start': start_sample, 'end': end_sample, 'y': y, 'y_harmonic': y_harmonic, 'features': features}
+
+
+def detect_section_chords(section, sr, key_root, key_scale, tempo=None, beats=None, vocabulary='full', bar_offset=0):
+    """
+    1区間のテンポ・ビート推定とコード検出
+
+    区間の外の状態に触れないため、複数区間をスレッドで並列に実行できる。
+
+    Args:
+        section: prepare_chord_section() の結果
+        sr: サンプリングレート
+        key_root: キーのルート音
+        key_scale: スケール名
+        tempo: 推定済みのテンポ（beats と一緒に渡す）
+        beats: 推定済みのビート位置（秒、区間の先頭を 0 とする）。None の場合はここで推定
+        vocabulary: コードの語彙（CHORD_VOCABULARIES のキー）
+        bar_offset: beats のうち最初の小節頭の位置（slice_beat_grid() の結果、ここで推定する場合は 0）
+
+    Returns:
+        Tuple[float, ndarray, List[ChordInfo]]: (テンポ, ビート位置, コード進行)
+    """
+    if beats is None:
+        try:
+            tempo, beat_frames = librosa.beat.beat_track(y=section['y'], sr=sr)
+            tempo = float(tempo)
+            beats = librosa.frames_to_time(beat_frames, sr=sr)
+        except Exception:
+            tempo, beats = 120.0, []
+        bar_offset = 0
+
+    time_offset = section['start'] / sr
+    if len(beats) >= 4:
+        chords = detect_chords_beat_synced(
+            section['y_harmonic'], sr, beats, key_root, key_scale, time_offset,
+            features=section['features'], vocabulary=vocabulary, bar_offset=bar_offset
+        )
+    else:
+        chords = detect_chords_enhanced(
+            section['y_harmonic'], sr, key_root, key_scale, time_offset,
+            features=section['features'], vocabulary=vocabulary
+        )
+    return tempo, beats, chords
+
+
+STRUCTURE_MIN_BEATS = 8  # これより短いセクションは直前のセクションに含める（拍）
+STRUCTURE_MAX_LABELS = 5  # 構成ラベルの種類の上限
+STRUCTURE_SIMILARITY = 0.6  # 繰り返しとしてコードを共有する小節ごとの chroma 相関の平均
+STRUCTURE_MIN_LENGTH_RATIO = 0.75  # 繰り返しとしてコードを共有する長さの比
+
+
+def structure_label(index: int) -> str:
+    """構成ラベル（A, B, C, ... Z, A2, B2, ...）"""
+    return chr(ord('A') + index % 26) + (str(index // 26 + 1) if index >= 26 else "")
+
+
+def detect_song_structure(features, beat_frames):
+    """
+    曲の構成（繰り返しセクション）を検出する
+
+    ビート同期 chroma の自己類似度行列（再帰行列）と隣接ビートのつながりからグラフを作り、
+    ラプラシアンの固有ベクトルをクラスタリングして各ビートにラベルを付ける
+    （McFee & Ellis, 2014 のラプラシアン構造分割）。同じラベルが続く範囲を1セクションとする。
+
+    Args:
+        features: 曲全体のハーモニック成分の ChromaFeatures
+        beat_frames: 曲全体のビート位置（フレーム番号、hop_length は features と同じ）
+
+    Returns:
+        Optional[dict]: {
+            'beat_times': ビート境界の時刻（ビート数 + 1、先頭 0・末尾は曲の終わり）,
+            'segments': [{'start_beat', 'end_beat', 'label'}, ...]（時刻順、ラベルは出現順に A, B, C, ...）,
+        }（ビートが少なすぎる場合は None）
+    """
+    beat_bounds = librosa.util.fix_frames(beat_frames, x_min=0, x_max=features.n_frames)
+    n_beats = len(beat_bounds) - 1
+    if n_beats < 4 * STRUCTURE_MIN_BEATS:
+        return None
+
+    # ダウンサンプリングしたビート同期 chroma（直前の3拍も並べて短いフレーズ単位で比べる）
+    beat_chroma = librosa.util.sync(features.chroma, beat_bounds, aggregate=np.median, pad=False)
+    stacked = librosa.feature.stack_memory(beat_chroma, n_steps=4, mode='edge')
+
+    # 繰り返し: k 近傍の再帰行列を対角方向に平滑化（同じ進行の繰り返しを強調）
+    recurrence = librosa.segment.recurrence_matrix(stacked, width=3, mode='affinity', sym=True)
+    recurrence = librosa.segment.timelag_filter(scipy.ndimage.median_filter)(recurrence, size=(1, 7))
+
+    # 連続性: 隣り合うビートの chroma が近いほど強くつなぐ
+    step = np.sum(np.diff(beat_chroma, axis=1) ** 2, axis=0)
+    path = np.exp(-step / (np.median(step) + 1e-8))
+    path_links = np.diag(path, 1) + np.diag(path, -1)
+
+    # 両者の次数が釣り合うように重み付けして合成
+    deg_recurrence = recurrence.sum(axis=1)
+    deg_path = path_links.sum(axis=1)
+    mu = deg_path.dot(deg_path + deg_recurrence) / (np.sum((deg_path + deg_recurrence) ** 2) + 1e-8)
+    affinity = mu * recurrence + (1 - mu) * path_links
+
+    laplacian = scipy.sparse.csgraph.laplacian(affinity, normed=True)
+    _, evecs = np.linalg.eigh(laplacian)
+    evecs = scipy.ndimage.median_filter(evecs, size=(9, 1))
+
+    num_labels = int(np.clip(n_beats // 64, 2, STRUCTURE_MAX_LABELS))
+    embedding = evecs[:, :num_labels]
+    embedding = embedding / (np.linalg.norm(embedding, axis=1, keepdims=True) + 1e-8)
+    _, beat_labels = scipy.cluster.vq.kmeans2(embedding, num_labels, minit='++', seed=0)
+
+    # 同じラベルが続く範囲をセクションにまとめる（短すぎる範囲は直前のセクションに含める）
+    segments = []
+    run_start = 0
+    for i in range(1, n_beats + 1):
+        if i < n_beats and beat_labels[i] == beat_labels[run_start]:
+            continue
+        cluster = int(beat_labels[run_start])
+        if segments and (i - run_start < STRUCTURE_MIN_BEATS or segments[-1]['cluster'] == cluster):
+            segments[-1]['end_beat'] = i
+        elif segments and segments[-1]['end_beat'] - segments[-1]['start_beat'] < STRUCTURE_MIN_BEATS:
+            # 先頭の短い範囲は次のセクションに含める
+            segments[-1].update(end_beat=i, cluster=cluster)
+        else:
+            segments.append({'start_beat': run_start, 'end_beat': i, 'cluster': cluster})
+        run_start = i
+
+    # ラベルは出現順に A, B, C, ...
+    label_order = {}
+    for segment in segments:
+        cluster = segment.pop('cluster')
+        segment['label'] = structure_label(label_order.setdefault(cluster, len(label_order)))
+
+    beat_times = librosa.frames_to_time(beat_bounds, sr=features.sr, hop_length=features.hop_length)
+    return {'beat_times': beat_times, 'segments': segments}
+
+
+def detect_structure_chords(structure, features, key_root, key_scale, beats_per_bar=4, vocabulary='full'):
+    """
+    構成ラベルごとに1回だけコード検出を行い、繰り返しセクションにコピーする
+
+    同じラベルのセクションは小節単位で揃えて chroma を比べ、十分に似ている出現は
+    chroma を平均して（繰り返しの分だけノイズが減る）代表の小節と一緒に1回だけ照合する。
+    似ていない出現や、代表より長い出現の余りの小節は個別に照合する。
+
+    Args:
+        structure: detect_song_structure() の結果
+        features: 曲全体のハーモニック成分の ChromaFeatures
+        key_root: キーのルート音
+        key_scale: スケール名
+        beats_per_bar: 1小節の拍数
+        vocabulary: コードの語彙（CHORD_VOCABULARIES のキー）
+
+    Returns:
+        Tuple[List[List[ChordInfo]], int, int]:
+            (セクションごとのコード進行（structure['segments'] と同じ順）, 照合した小節数, 全小節数)
+    """
+    beat_times = structure['beat_times']
+    sr = features.sr
+
+    # セクションの先頭から 4 拍ごとに小節を区切る
+    section_bars = []
+    for segment in structure['segments']:
+        starts = range(segment['start_beat'], segment['end_beat'], beats_per_bar)
+        bars = [(beat_times[b], beat_times[min(b + beats_per_bar, segment['end_beat'])]) for b in starts]
+        chroma = np.stack([features.mean(features.chroma, s, e) for s, e in bars], axis=1)
+        section_bars.append((bars, chroma))
+
+    def centered(chroma):
+        c = chroma - chroma.mean(axis=0, keepdims=True)
+        return c / (np.linalg.norm(c, axis=0, keepdims=True) + 1e-8)
+
+    # 照合する chroma の列（ユニークな小節）と、各小節がどの列の結果を使うか
+    columns = []
+    bar_columns = [[None] * len(bars) for bars, _ in section_bars]
+    occurrences = {}
+    for idx, segment in enumerate(structure['segments']):
+        occurrences.setdefault(segment['label'], []).append(idx)
+
+    for indices in occurrences.values():
+        rep_bars, rep_chroma = section_bars[indices[0]]
+        rep_length = len(rep_bars)
+        rep_centered = centered(rep_chroma)
+        total = rep_chroma.copy()
+        counts = np.ones(rep_length)
+        shared = [(indices[0], rep_length)]
+        for idx in indices[1:]:
+            chroma = section_bars[idx][1]
+            common = min(rep_length, chroma.shape[1])
+            if common / max(rep_length, chroma.shape[1]) < STRUCTURE_MIN_LENGTH_RATIO:
+                continue
+            similarity = float(np.mean(np.sum(rep_centered[:, :common] * centered(chroma[:, :common]), axis=0)))
+            if similarity >= STRUCTURE_SIMILARITY:
+                total[:, :common] += chroma[:, :common]
+                counts[:common] += 1
+                shared.append((idx, common))
+        first = len(columns)
+        columns.extend((total / counts).T)
+        for idx, common in shared:
+            bar_columns[idx][:common] = range(first, first + common)
+
+    for idx, (_, chroma) in enumerate(section_bars):
+        for i, column in enumerate(bar_columns[idx]):
+            if column is None:
+                bar_columns[idx][i] = len(columns)
+                columns.append(chroma[:, i])
+
+    matches = get_chord_templates(vocabulary).match(np.stack(columns, axis=1), key_root, key_scale)
+
+    section_chords = []
+    total_bars = 0
+    for (bars, _), column_ids in zip(section_bars, bar_columns):
+        chords = []
+        for (bar_start, bar_end), column in zip(bars, column_ids):
+            # 短すぎる小節は除外
+            if int(bar_end * sr) - int(bar_start * sr) < 1024:
+                continue
+            chord_name, root_note, quality, confidence = matches[column]
+            chords.append(ChordInfo(
+                startTime=float(bar_start),
+                endTime=float(bar_end),
+                chord=chord_name,
+                rootNote=root_note,
+                quality=quality,
+                confidence=confidence
+            ))
+        total_bars += len(bars)
+        section_chords.append(merge_consecutive_chords(chords))
+    return section_chords, len(columns), total_bars
+
+
+def select_loudest_window(rms, sr, full_duration, target_duration=30.0, hop_length=512):
+    """
+    RMSエネルギーの系列から最も音量が高い target_duration 秒の区間を選ぶ
+
+    Returns:
+        Tuple[float, float]: (開始時刻, 終了時刻)
+    """
+    return select_loudest_sections(rms, sr, full_duration, 1, target_duration, hop_length)[0]
+
+
+def select_loudest_sections(rms, sr, full_duration, count=1, target_duration=30.0, hop_length=512):
+    """
+    RMSエネルギーの系列から、互いに重ならない音量の高い target_duration 秒の区間を最大 count 個選ぶ
+
+    移動平均は累積和の差で O(n) で求め、最大の区間を選ぶたびに重なる開始位置を除外する。
+
+    Returns:
+        List[Tuple[float, float]]: [(開始時刻, 終了時刻), ...]（音量の大きい順）
+    """
     window_frames = int(target_duration * sr / hop_length)
     if window_frames >= len(rms):
-        return y[:int(target_duration * sr)], 0.0, target_duration
+        return [(0.0, target_duration)]
 
-    # 畳み込みで移動平均RMSを計算
-    kernel = np.ones(window_frames) / window_frames
-    smoothed_rms = np.convolve(rms, kernel, mode='valid')
+    # 累積和で target_duration 相当の移動平均RMSを計算
+    cumsum = np.concatenate([[0.0], np.cumsum(rms, dtype=np.float64)])
+    smoothed_rms = (cumsum[window_frames:] - cumsum[:-window_frames]) / window_frames
 
-    # 最大RMSの位置を取得
-    best_frame = np.argmax(smoothed_rms)
-    best_start_time = best_frame * hop_length / sr
-    best_end_time = best_start_time + target_duration
+    sections = []
+    for _ in range(max(1, count)):
+        # 最大RMSの位置を取得
+        best_frame = int(np.argmax(smoothed_rms))
+        if not np.isfinite(smoothed_rms[best_frame]):
+            break
+        best_start_time = best_frame * hop_length / sr
+        best_end_time = best_start_time + target_duration
 
-    # 範囲外チェック
-    if best_end_time > full_duration:
-        best_end_time = full_duration
-        best_start_time = max(0, full_duration - target_duration)
+        # 範囲外チェック
+        if best_end_time > full_duration:
+            best_end_time = full_duration
+            best_start_time = max(0, full_duration - target_duration)
+        sections.append((best_start_time, best_end_time))
 
-    # 波形を切り出し
-    start_sample = int(best_start_time * sr)
-    end_sample = int(best_end_time * sr)
+        # この区間と重なる開始位置を除外
+        lo = max(0, best_frame - window_frames + 1)
+        hi = min(len(smoothed_rms), best_frame + window_frames)
+        smoothed_rms[lo:hi] = -np.inf
 
-    return y[start_sample:end_sample], best_start_time, best_end_time
+    return sections
+
+
+def snap_segment_to_frames(start_time, end_time, sr, n_samples, hop_length=512):
+    """
+    区間の境界を STFT のフレーム境界（hop_length の倍数）に揃える
+
+    全体で計算した HPSS 結果や特徴量を、区間で計算し直さずにそのまま切り出せるようにする。
+
+    Returns:
+        Tuple[int, int]: (開始サンプル, 終了サンプル)
+    """
+    start_sample = int(round(start_time * sr / hop_length)) * hop_length
+    end_sample = min(n_samples, int(round(end_time * sr / hop_length)) * hop_length)
+    return start_sample, max(end_sample, min(n_samples, start_sample + hop_length))
+
+
+def scan_track_in_blocks(
+    y, sr, block_duration=15.0, margin=2.0, hop_length=512, frame_length=2048, estimate_keys=True
+):
+    """
+    長時間の録音をブロック単位で走査し、キー検出とセグメント選択に必要な統計を集める
+
+    ブロックごとに前後 margin 秒を付けて HPSS を掛け（境界の影響を避けるため余白は捨てる）、
+    ハーモニック成分の chroma からブロックのキーを推定する（全ブロック分をまとめて評価）。RMS は全体で計算した場合と同じフレーム位置になるよう
+    ブロックの前後を frame_length/2 だけ重ねて計算する。
+    ブロックの HPSS・Chroma は最大 ANALYSIS_THREADS 本のスレッドで並列に計算する。
+    メモリ使用量はブロック長とスレッド数で決まり、曲の長さに依存しない（y は memmap を想定）。
+
+    Args:
+        y: 音声波形（np.memmap 可）
+        sr: サンプリングレート
+        block_duration: ブロック（= キー検出セグメント）の長さ（秒）
+        margin: HPSS 用に前後に付ける余白（秒）
+        hop_length: RMS のホップ長
+        frame_length: RMS のフレーム長
+        estimate_keys: False の場合は HPSS・キー推定を行わず RMS だけを計算
+
+    Returns:
+        Tuple[List[dict], ndarray, int]: (ブロックごとのキー推定結果, RMS系列, ブロック数)
+    """
+    n = len(y)
+    # ブロック境界を RMS のフレーム境界に揃える
+    block = max(hop_length, int(round(block_duration * sr / hop_length)) * hop_length)
+    pad = int(margin * sr)
+    half = frame_length // 2
+    total_frames = 1 + n // hop_length
+    num_blocks = max(1, int(np.ceil(n / block)))
+
+    def block_key_chroma(i):
+        # ハーモニック成分（余白付きで分離してから切り戻す）
+        start = i * block
+        end = min(n, start + block)
+        lo = max(0, start - pad)
+        hi = min(n, end + pad)
+        y_block = np.array(y[lo:hi], dtype=np.float32)
+        try:
+            y_harmonic = librosa.effects.hpss(y_block)[0][start - lo:end - lo]
+        except Exception:
+            y_harmonic = y_block[start - lo:end - lo]
+        try:
+            return np.mean(ChromaFeatures(y_harmonic, sr).key_chroma, axis=1)
+        except Exception:
+            return None
+
+    # ブロックごとの HPSS・Chroma はスレッドで並列に計算し、ブロック順に集める
+    # （5秒未満のブロック（曲末尾）はキー推定に使わない、detect_keys_with_modulation と同じ）
+    block_chroma = []
+    if estimate_keys:
+        key_blocks = [i for i in range(num_blocks) if min(n, (i + 1) * block) - i * block >= sr * 5]
+        block_chroma = [c for c in map_in_threads(block_key_chroma, key_blocks) if c is not None]
+
+    rms_parts = []
+    for i in range(num_blocks):
+        start = i * block
+        end = min(n, start + block)
+
+        # RMS（center=True・ゼロ埋めと同じ結果になるよう、端は自前でゼロ埋め）
+        first_frame = start // hop_length
+        last_frame = total_frames if i == num_blocks - 1 else end // hop_length
+        frame_lo = first_frame * hop_length - half
+        frame_hi = (last_frame - 1) * hop_length + half
+        window = np.zeros(frame_hi - frame_lo, dtype=np.float32)
+        src_lo = max(0, frame_lo)
+        src_hi = min(n, frame_hi)
+        window[src_lo - frame_lo:src_hi - frame_lo] = y[src_lo:src_hi]
+        rms_parts.append(
+            librosa.feature.rms(y=window, frame_length=frame_length, hop_length=hop_length, center=False)[0]
+        )
+
+    # 全ブロックのキーを24キーとの1回の行列積でまとめて推定
+    segment_keys = []
+    if block_chroma:
+        segment_keys = [
+            {'key': key, 'scale': scale, 'confidence': conf}
+            for key, scale, conf in estimate_keys_from_chroma(np.stack(block_chroma))
+        ]
+
+    return segment_keys, np.concatenate(rms_parts), num_blocks
 
 
 def estimate_key_enhanced(y_harmonic, sr):
@@ -774,70 +4037,120 @@ def estimate_key_enhanced(y_harmonic, sr):
     改善点：
     - CQTベースのChroma（周波数解像度が高い）
     - CENS正規化（エネルギー正規化＋スムージング）
-    - 複数のプロファイル比較
+    - KEY_PROFILE で選べるプロファイル（Krumhansl-Kessler / Temperley / bgate）
 
     Returns:
         Tuple[str, str, float]: (rootNote, scale, confidence)
     """
-    # CQTベースのChroma（より精度が高い）
-    chroma_cqt = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr, hop_length=512)
-
-    # CENS（Chroma Energy Normalized Statistics）で安定化
-    chroma_cens = librosa.feature.chroma_cens(y=y_harmonic, sr=sr, hop_length=512)
-
-    # 両方を組み合わせ（CQTの精度 + CENSの安定性）
-    chroma_combined = (chroma_cqt + chroma_cens) / 2
-
-    # 時間軸で平均化
-    chroma_mean = np.mean(chroma_combined, axis=1)
-
-    # 正規化
-    chroma_mean = chroma_mean / (np.sum(chroma_mean) + 1e-8)
-
-    # Krumhansl-Kessler プロファイル（改良版）
-    # メジャー: 経験的に調整された重み
-    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+    # CQTベースのChroma（より精度が高い）と CENS（Chroma Energy Normalized Statistics）を
+    # 同じ CQT から計算して組み合わせ、時間軸で平均化
+    features = ChromaFeatures(y_harmonic, sr, hop_length=512)
+    return estimate_key_from_chroma(np.mean(features.key_chroma, axis=1))
+
+
+# キー推定のプロファイル: {名前: (メジャー, マイナー)}（C を 0 とする12次元）
+KEY_PROFILES = {
+    # Krumhansl-Kessler（経験的に調整された重み）
+    'krumhansl': (
+        [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88],
+        [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17],
+    ),
+    # Temperley（Kostka-Payne のコーパスから推定）
+    'temperley': (
+        [5.0, 2.0, 3.5, 2.0, 4.5, 4.0, 2.0, 4.5, 2.0, 3.5, 1.5, 4.0],
+        [5.0, 2.0, 3.5, 4.5, 2.0, 4.0, 2.0, 4.5, 3.5, 2.0, 1.5, 4.0],
+    ),
+    # bgate（Essentia の KeyExtractor と同じ）
+    'bgate': (
+        [1.00, 0.00, 0.42, 0.00, 0.53, 0.37, 0.00, 0.77, 0.00, 0.38, 0.21, 0.30],
+        [1.00, 0.00, 0.36, 0.39, 0.00, 0.38, 0.00, 0.74, 0.27, 0.00, 0.42, 0.23],
+    ),
+    # 簡易テンプレート（estimate_key_simple で使用）
+    'simple': (
+        [1.0, 0.2, 0.3, 0.2, 0.8, 0.4, 0.2, 0.9, 0.3, 0.5, 0.3, 0.7],
+        [1.0, 0.2, 0.8, 0.3, 0.4, 0.9, 0.2, 0.5, 0.2, 0.7, 0.3, 0.3],
+    ),
+}
+
+if KEY_PROFILE not in KEY_PROFILES:
+    print(f"⚠ Unknown KEY_PROFILE={KEY_PROFILE}, using krumhansl (available: {', '.join(KEY_PROFILES)})")
+    KEY_PROFILE = 'krumhansl'
+
+_key_profile_matrices = {}
+
+
+def get_key_profile_matrix(profile: Optional[str] = None):
+    """
+    24キー × 12次元の z-score 済みプロファイル行列（プロファイルごとに1回だけ構築）
 
-    # マイナー: 経験的に調整された重み
-    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+    行の並びは C メジャー, C マイナー, C# メジャー, ... （同点の場合は従来のループと同じ順で選ばれる）。
 
-    # 正規化
-    major_profile = major_profile / np.sum(major_profile)
-    minor_profile = minor_profile / np.sum(minor_profile)
+    Returns:
+        Tuple[ndarray, List[Tuple[str, str]]]: (行列 (24, 12), 行ごとの (rootNote, scale))
+    """
+    profile = profile or KEY_PROFILE
+    cached = _key_profile_matrices.get(profile)
+    if cached is not None:
+        return cached
+    if profile not in KEY_PROFILES:
+        raise ValueError(f"Unknown key profile: {profile} (available: {', '.join(KEY_PROFILES)})")
 
     note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-
-    best_score = -1.0
-    best_key = 'C'
-    best_scale = 'メジャー'
-
+    major, minor = (np.asarray(p, dtype=np.float64) for p in KEY_PROFILES[profile])
+    rows = []
+    labels = []
     for i in range(12):
-        # メジャー
-        shifted_major = np.roll(major_profile, i)
-        major_corr = np.corrcoef(chroma_mean, shifted_major)[0, 1]
+        for template, scale in ((major, 'メジャー'), (minor, 'マイナー')):
+            rows.append(np.roll(template, i))
+            labels.append((note_names[i], scale))
+    matrix = np.array(rows)
+    matrix = (matrix - matrix.mean(axis=1, keepdims=True)) / matrix.std(axis=1, keepdims=True)
+    _key_profile_matrices[profile] = (matrix, labels)
+    return matrix, labels
 
-        if major_corr > best_score:
-            best_score = major_corr
-            best_key = note_names[i]
-            best_scale = 'メジャー'
 
-        # マイナー
-        shifted_minor = np.roll(minor_profile, i)
-        minor_corr = np.corrcoef(chroma_mean, shifted_minor)[0, 1]
+def estimate_keys_from_chroma(chroma_means, profile: Optional[str] = None):
+    """
+    複数区間の chroma（各12次元）を24キーすべてと一括で相関を取り、キーを推定
+
+    相関係数は z-score 同士の内積なので、全区間 × 全キーを1回の行列積で計算する。
 
-        if minor_corr > best_score:
-            best_score = minor_corr
-            best_key = note_names[i]
-            best_scale = 'マイナー'
+    Args:
+        chroma_means: (区間数, 12) の行列（区間ごとの時間平均 chroma）
+        profile: KEY_PROFILES の名前（None の場合は KEY_PROFILE）
 
-    # 信頼度（相関係数を0-1にマッピング）
-    confidence = (best_score + 1.0) / 2.0
-    confidence = max(0.0, min(1.0, confidence))
+    Returns:
+        List[Tuple[str, str, float]]: 区間ごとの (rootNote, scale, confidence)
+    """
+    matrix, labels = get_key_profile_matrix(profile)
+    chroma = np.atleast_2d(np.asarray(chroma_means, dtype=np.float64))
+    centered = chroma - chroma.mean(axis=1, keepdims=True)
+    z = centered / (centered.std(axis=1, keepdims=True) + 1e-12)
+    correlations = (z @ matrix.T) / 12.0  # (区間数, 24)
+
+    best = np.argmax(correlations, axis=1)
+    results = []
+    for row, index in enumerate(best):
+        # 信頼度（相関係数を0-1にマッピング）
+        confidence = max(0.0, min(1.0, (float(correlations[row, index]) + 1.0) / 2.0))
+        key, scale = labels[index]
+        results.append((key, scale, confidence))
+    return results
+
+
+def estimate_key_from_chroma(chroma_mean, profile: Optional[str] = None):
+    """
+    時間平均した chroma（12次元）から Krumhansl-Schmuckler 法でキーを推定
 
-    return best_key, best_scale, confidence
+    Returns:
+        Tuple[str, str, float]: (rootNote, scale, confidence)
+    """
+    return estimate_keys_from_chroma(np.reshape(chroma_mean, (1, 12)), profile)[0]
 
 
-def detect_chords_beat_synced(y_harmonic, sr, beats, key_root, key_scale, time_offset=0.0):
+def detect_chords_beat_synced(
+    y_harmonic, sr, beats, key_root, key_scale, time_offset=0.0, features=None, vocabulary='full', bar_offset=0
+):
     """
     ビート同期コード進行検出
 
@@ -851,16 +4164,24 @@ def detect_chords_beat_synced(y_harmonic, sr, beats, key_root, key_scale, time_o
         key_root: キーのルート音
         key_scale: スケール名
         time_offset: 元音源での開始時刻オフセット
+        features: y_harmonic の ChromaFeatures（None の場合はここで計算）
+        vocabulary: コードの語彙（CHORD_VOCABULARIES のキー）
+        bar_offset: 最初の小節頭のビート番号（それより前の拍は弱起として1つの小節にまとめる）
 
     Returns:
         List[ChordInfo]: コード進行
     """
     chord_progression = []
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
-    # 4拍（1小節）ごとにグループ化
+    # Chroma は区間全体で1回だけ計算し、小節ごとにフレームで切り出す
+    if features is None:
+        features = ChromaFeatures(y_harmonic, sr)
+
+    # 小節頭から4拍（1小節）ごとにグループ化（小節頭より前の拍は弱起の小節にする）
     bars = []
-    for i in range(0, len(beats) - 3, 4):
+    if 0 < bar_offset < len(beats):
+        bars.append((beats[0], beats[bar_offset]))
+    for i in range(bar_offset if bar_offset < len(beats) else 0, len(beats) - 3, 4):
         bar_start = beats[i]
         bar_end = beats[min(i + 4, len(beats) - 1)]
         bars.append((bar_start, bar_end))
@@ -871,22 +4192,24 @@ def detect_chords_beat_synced(y_harmonic, sr, beats, key_root, key_scale, time_o
         if beats[-1] > last_bar_end:
             bars.append((last_bar_end, beats[-1]))
 
-    for bar_start, bar_end in bars:
-        start_sample = int(bar_start * sr)
-        end_sample = int(bar_end * sr)
-        segment = y_harmonic[start_sample:end_sample]
+    # 短すぎる小節は除外
+    bars = [(s, e) for s, e in bars if int(e * sr) - int(s * sr) >= 1024]
 
-        if len(segment) < 1024:
-            continue
+    # 小節内のCQTベースのChromaを平均し、全小節をまとめてテンプレートと照合
+    if bars:
+        bar_chroma = np.stack([features.mean(features.chroma, s, e) for s, e in bars], axis=1)
+    else:
+        bar_chroma = np.zeros((12, 0))
+    matches = get_chord_templates(vocabulary).match(bar_chroma, key_root, key_scale)
 
-        # CQTベースのChromaを計算
-        chroma = librosa.feature.chroma_cqt(y=segment, sr=sr, hop_length=256)
-        chroma_mean = np.mean(chroma, axis=1)
+    emitted = 0
 
-        # コードを推定
-        chord_name, root_note, quality, confidence = match_chord_enhanced(
-            chroma_mean, note_names, key_root, key_scale
-        )
+    for bar_idx, ((bar_start, bar_end), match) in enumerate(zip(bars, matches)):
+        # 数小節ごとに確定したコードを部分結果として送る
+        if bar_idx > 0 and bar_idx % CHORD_BATCH_SIZE == 0:
+            emitted = emit_chord_batch(chord_progression, emitted)
+
+        chord_name, root_note, quality, confidence = match
 
         chord_progression.append(ChordInfo(
             startTime=bar_start + time_offset,
@@ -897,17 +4220,20 @@ def detect_chords_beat_synced(y_harmonic, sr, beats, key_root, key_scale, time_o
             confidence=confidence
         ))
 
+    emit_chord_batch(chord_progression, emitted, final=True)
+
     # 連続する同じコードをマージ
     chord_progression = merge_consecutive_chords(chord_progression)
 
     return chord_progression
 
 
-def detect_chords_enhanced(y_harmonic, sr, key_root, key_scale, time_offset=0.0):
+def detect_chords_enhanced(y_harmonic, sr, key_root, key_scale, time_offset=0.0, features=None, vocabulary='full'):
     """
     改良版コード検出（ビート情報がない場合のフォールバック）
 
     2秒区切りでより細かくコードを検出。
+    Chroma は区間全体で1回だけ計算し（features を渡せば再利用）、2秒ごとにフレームで切り出す。
 
     Returns:
         List[ChordInfo]: コード進行
@@ -917,26 +4243,31 @@ def detect_chords_enhanced(y_harmonic, sr, key_root, key_scale, time_offset=0.0)
     num_segments = int(np.ceil(duration / segment_duration))
 
     chord_progression = []
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
+    if features is None:
+        features = ChromaFeatures(y_harmonic, sr)
+
+    windows = []
     for seg_idx in range(num_segments):
         start_time = seg_idx * segment_duration
         end_time = min((seg_idx + 1) * segment_duration, duration)
+        if int(end_time * sr) - int(start_time * sr) >= 1024:
+            windows.append((start_time, end_time))
 
-        start_sample = int(start_time * sr)
-        end_sample = int(end_time * sr)
-        segment = y_harmonic[start_sample:end_sample]
+    # CQTベースのChromaを区間ごとに平均し、まとめてテンプレートと照合
+    if windows:
+        window_chroma = np.stack([features.mean(features.chroma, s, e) for s, e in windows], axis=1)
+    else:
+        window_chroma = np.zeros((12, 0))
+    matches = get_chord_templates(vocabulary).match(window_chroma, key_root, key_scale)
 
-        if len(segment) < 1024:
-            continue
+    emitted = 0
 
-        # CQTベースのChroma
-        chroma = librosa.feature.chroma_cqt(y=segment, sr=sr, hop_length=256)
-        chroma_mean = np.mean(chroma, axis=1)
+    for seg_idx, ((start_time, end_time), match) in enumerate(zip(windows, matches)):
+        if seg_idx > 0 and seg_idx % CHORD_BATCH_SIZE == 0:
+            emitted = emit_chord_batch(chord_progression, emitted)
 
-        chord_name, root_note, quality, confidence = match_chord_enhanced(
-            chroma_mean, note_names, key_root, key_scale
-        )
+        chord_name, root_note, quality, confidence = match
 
         chord_progression.append(ChordInfo(
             startTime=start_time + time_offset,
@@ -947,94 +4278,224 @@ def detect_chords_enhanced(y_harmonic, sr, key_root, key_scale, time_offset=0.0)
             confidence=confidence
         ))
 
+    emit_chord_batch(chord_progression, emitted, final=True)
+
     # 連続する同じコードをマージ
     chord_progression = merge_consecutive_chords(chord_progression)
 
     return chord_progression
 
 
+# コードの種類（品質）: (quality, コード名の接尾辞, {ルートからの半音数: 重み}, 事前重み)
+CHORD_QUALITIES = [
+    ('maj', '', {0: 1.0, 4: 0.7, 7: 0.5}, 1.0),
+    ('min', 'm', {0: 1.0, 3: 0.7, 7: 0.5}, 1.0),
+    ('dim', 'dim', {0: 1.0, 3: 0.7, 6: 0.5}, 1.0),
+    ('aug', 'aug', {0: 1.0, 4: 0.7, 8: 0.5}, 0.95),
+    ('sus4', 'sus4', {0: 1.0, 5: 0.7, 7: 0.5}, 1.0),
+    ('sus2', 'sus2', {0: 1.0, 2: 0.7, 7: 0.5}, 1.0),
+    ('7', '7', {0: 1.0, 4: 0.7, 7: 0.5, 10: 0.5}, 1.02),
+    ('maj7', 'maj7', {0: 1.0, 4: 0.7, 7: 0.5, 11: 0.5}, 1.02),
+    ('m7', 'm7', {0: 1.0, 3: 0.7, 7: 0.5, 10: 0.5}, 1.02),
+    ('m7b5', 'm7b5', {0: 1.0, 3: 0.7, 6: 0.5, 10: 0.5}, 1.02),
+]
+
+# sus の付加音: quality → 付加音（ルートからの半音数）
+# 付加音が3度（長3度・短3度の強い方）の CHORD_SUS_MARGIN 倍以上のときだけ選ぶ。三和音の倍音
+# （5度の倍音 = 2度）や、小節がコードの切り替わりをまたいだときの混ざりで
+# 三和音が sus に化けないようにするため
+CHORD_SUS_TONES = {'sus4': 5, 'sus2': 2}
+CHORD_SUS_MARGIN = 2.0
+
+# 7th の付加音: quality → (7度, 5度)（ルートからの半音数）
+# 7th は3度を含むため、7度をルート・5度の弱い方と比べ、その CHORD_SEVENTH_MARGIN 倍以上の
+# ときだけ選ぶ（倍音や混ざりによる弱い7度では選ばれない）。ベースでルートが強いと、全音同じ
+# 音量の7thでもコサイン類似度は三和音とほぼ同じになるため、CHORD_QUALITIES の事前重みを
+# 三和音よりわずかに高くしてある（この条件を満たした場合だけ効く）
+CHORD_SEVENTH_TONES = {'7': (10, 7), 'maj7': (11, 7), 'm7': (10, 7), 'm7b5': (10, 6)}
+CHORD_SEVENTH_MARGIN = 0.5
+
+# コードの語彙（解析の深さごとの chordVocabulary）: 使う quality（None = CHORD_QUALITIES すべて）
+CHORD_VOCABULARIES = {
+    'triads': ('maj', 'min', 'dim', 'aug'),
+    'full': None,
+}
+
+# キーのスケール構成音（ルートからの半音数）
+KEY_SCALE_DEGREES = {
+    'メジャー': (0, 2, 4, 5, 7, 9, 11),
+    'マイナー': (0, 2, 3, 5, 7, 8, 10),  # ナチュラルマイナー
+}
+
+# よく使われる借用コード: (キーのルートからの半音数, quality)
+BORROWED_CHORDS = {
+    'メジャー': [(10, 'maj'), (8, 'maj')],  # ♭VII, ♭VI
+    'マイナー': [(7, 'maj'), (7, '7')],     # ハーモニックマイナーの V, V7
+}
+
+# キーに対するコードの重み（ダイアトニック > 借用 > ノンダイアトニック）
+CHORD_WEIGHT_DIATONIC = 1.0
+CHORD_WEIGHT_BORROWED = 0.95
+CHORD_WEIGHT_OTHER = 0.85
+
+
+class ChordTemplates:
+    """
+    コードテンプレート行列（12ルート × CHORD_QUALITIES のうち語彙に含まれるもの）
+
+    テンプレートは L2 正規化して1つの行列にまとめておき、chroma（12次元、または
+    12 × フレーム数）との一致度を1回の行列積で計算する。キーごとの重み
+    （ダイアトニックかどうか）は行列と同じ並びのベクトルとしてキャッシュする。
+    """
+
+    NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+    def __init__(self, vocabulary: str = 'full'):
+        allowed = CHORD_VOCABULARIES[vocabulary]
+        # 行の並び: quality ごとに 12 ルート（同点の場合は三和音が優先される）
+        self.qualities = []
+        self.roots = []
+        self.names = []
+        templates = []
+        priors = []
+        sus_rows, sus_notes, seventh_rows, seventh_notes = [], [], [], []
+        for quality, suffix, intervals, prior in CHORD_QUALITIES:
+            if allowed is not None and quality not in allowed:
+                continue
+            for root in range(12):
+                template = np.zeros(12)
+                for interval, weight in intervals.items():
+                    template[(root + interval) % 12] = weight
+                if quality in CHORD_SUS_TONES:
+                    sus_rows.append(len(templates))
+                    sus_notes.append([(root + CHORD_SUS_TONES[quality]) % 12, (root + 3) % 12, (root + 4) % 12])
+                elif quality in CHORD_SEVENTH_TONES:
+                    seventh, fifth = CHORD_SEVENTH_TONES[quality]
+                    seventh_rows.append(len(templates))
+                    seventh_notes.append([(root + seventh) % 12, root, (root + fifth) % 12])
+                templates.append(template / np.linalg.norm(template))
+                priors.append(prior)
+                self.qualities.append(quality)
+                self.roots.append(root)
+                self.names.append(self.NOTE_NAMES[root] + suffix)
+        self.matrix = np.array(templates)  # (テンプレート数, 12)
+        self.priors = np.array(priors)
+        # sus・7th の行と、その付加音・比べる音（chroma の行番号、列0 = 付加音）
+        # sus: (付加音, 短3度, 長3度)、7th: (7度, ルート, 5度)
+        self.sus_rows = np.array(sus_rows, dtype=int)
+        self.sus_notes = np.array(sus_notes, dtype=int).reshape(-1, 3)
+        self.seventh_rows = np.array(seventh_rows, dtype=int)
+        self.seventh_notes = np.array(seventh_notes, dtype=int).reshape(-1, 3)
+        self._key_weights = {}
+
+    def key_weights(self, key_root, key_scale):
+        """キーに対する各テンプレートの重み（テンプレート数、コードの種類の事前重みを含む）"""
+        cache_key = (key_root, key_scale)
+        weights = self._key_weights.get(cache_key)
+        if weights is not None:
+            return weights
+
+        key_index = self.NOTE_NAMES.index(key_root)
+        scale = 'メジャー' if key_scale == 'メジャー' else 'マイナー'
+        scale_notes = {(key_index + d) % 12 for d in KEY_SCALE_DEGREES[scale]}
+        borrowed = {((key_index + offset) % 12, quality) for offset, quality in BORROWED_CHORDS[scale]}
+        intervals_by_quality = {quality: intervals for quality, _, intervals, _ in CHORD_QUALITIES}
+
+        weights = np.full(len(self.names), CHORD_WEIGHT_OTHER)
+        for i, (root, quality) in enumerate(zip(self.roots, self.qualities)):
+            if all((root + interval) % 12 in scale_notes for interval in intervals_by_quality[quality]):
+                weights[i] = CHORD_WEIGHT_DIATONIC
+            elif (root, quality) in borrowed:
+                weights[i] = CHORD_WEIGHT_BORROWED
+        weights = weights * self.priors
+        self._key_weights[cache_key] = weights
+        return weights
+
+    def score(self, chroma, key_root, key_scale):
+        """
+        chroma とすべてのテンプレートの一致度（コサイン類似度 × キー・種類の重み）
+
+        Args:
+            chroma: 12次元ベクトル、または (12, N) の行列（列ごとに評価）
+            key_root: キーのルート音
+            key_scale: スケール名
+
+        Returns:
+            ndarray: (テンプレート数,) または (テンプレート数, N)
+        """
+        chroma = np.asarray(chroma, dtype=np.float64)
+        norms = np.linalg.norm(chroma, axis=0)
+        similarity = (self.matrix @ chroma) / (norms + 1e-8)
+        weights = self.key_weights(key_root, key_scale)
+        scores = similarity * (weights if chroma.ndim == 1 else weights[:, None])
+        if len(self.sus_rows):
+            # 付加音が3度をはっきり上回らない sus は候補から外す
+            notes = chroma[self.sus_notes]
+            weak = notes[:, 0] < CHORD_SUS_MARGIN * notes[:, 1:].max(axis=1)
+            scores[self.sus_rows] = np.where(weak, -np.inf, scores[self.sus_rows])
+        if len(self.seventh_rows):
+            # 7度がルート・5度に比べて弱すぎる 7th は候補から外す
+            notes = chroma[self.seventh_notes]
+            weak = notes[:, 0] < CHORD_SEVENTH_MARGIN * notes[:, 1:].min(axis=1)
+            scores[self.seventh_rows] = np.where(weak, -np.inf, scores[self.seventh_rows])
+        return scores
+
+    def match(self, chroma, key_root, key_scale):
+        """
+        列ごとに最も一致するコードを選ぶ
+
+        Args:
+            chroma: (12, N) の行列（N = フレーム数または小節数）
+
+        Returns:
+            List[Tuple[str, str, str, float]]: 列ごとの (chord_name, root_note, quality, confidence)
+        """
+        chroma = np.asarray(chroma, dtype=np.float64)
+        if chroma.shape[1] == 0:
+            return []
+        scores = self.score(chroma, key_root, key_scale)
+        best = np.argmax(scores, axis=0)
+        confidences = np.clip(scores[best, np.arange(scores.shape[1])], 0.0, 1.0)
+        return [
+            (self.names[i], self.NOTE_NAMES[self.roots[i]], self.qualities[i], float(conf))
+            for i, conf in zip(best, confidences)
+        ]
+
+
+_chord_templates: Dict[str, "ChordTemplates"] = {}
+
+
+def get_chord_templates(vocabulary: str = 'full') -> ChordTemplates:
+    """コードテンプレート行列（語彙ごとに、プロセスごとに1回だけ構築）"""
+    templates = _chord_templates.get(vocabulary)
+    if templates is None:
+        templates = _chord_templates[vocabulary] = ChordTemplates(vocabulary)
+    return templates
+
+
 def match_chord_enhanced(chroma_values, note_names, key_root, key_scale):
     """
     改良版コードマッチング
 
-    ダイアトニックコード + よく使われる借用コードも含めてマッチング。
+    12ルート × CHORD_QUALITIES（三和音・sus・7th）のテンプレートと比較し、
+    ダイアトニックコード・よく使われる借用コードを優先する。
 
     Returns:
         Tuple[str, str, str, float]: (chord_name, root_note, quality, confidence)
     """
-    root_index = note_names.index(key_root)
-
-    # ダイアトニックコード + 借用コード
-    if key_scale == 'メジャー':
-        chord_templates = [
-            {'offset': 0, 'quality': 'maj', 'degree': 'I'},
-            {'offset': 2, 'quality': 'min', 'degree': 'ii'},
-            {'offset': 4, 'quality': 'min', 'degree': 'iii'},
-            {'offset': 5, 'quality': 'maj', 'degree': 'IV'},
-            {'offset': 7, 'quality': 'maj', 'degree': 'V'},
-            {'offset': 9, 'quality': 'min', 'degree': 'vi'},
-            {'offset': 11, 'quality': 'dim', 'degree': 'vii°'},
-            # 借用コード
-            {'offset': 10, 'quality': 'maj', 'degree': 'bVII'},  # ♭VII
-            {'offset': 8, 'quality': 'maj', 'degree': 'bVI'},   # ♭VI
-        ]
-    else:
-        chord_templates = [
-            {'offset': 0, 'quality': 'min', 'degree': 'i'},
-            {'offset': 2, 'quality': 'dim', 'degree': 'ii°'},
-            {'offset': 3, 'quality': 'maj', 'degree': 'III'},
-            {'offset': 5, 'quality': 'min', 'degree': 'iv'},
-            {'offset': 7, 'quality': 'min', 'degree': 'v'},
-            {'offset': 7, 'quality': 'maj', 'degree': 'V'},    # ハーモニックマイナーのV
-            {'offset': 8, 'quality': 'maj', 'degree': 'VI'},
-            {'offset': 10, 'quality': 'maj', 'degree': 'VII'},
-        ]
+    return get_chord_templates().match(np.reshape(chroma_values, (12, 1)), key_root, key_scale)[0]
 
-    best_match_score = -1.0
-    best_chord = chord_templates[0]
-
-    # 正規化
-    chroma_norm = chroma_values / (np.sum(chroma_values) + 1e-8)
-
-    for chord_info in chord_templates:
-        chord_root_index = (root_index + chord_info['offset']) % 12
-
-        # コードテンプレート（ルート、3度、5度）
-        chord_template = np.zeros(12)
-        chord_template[chord_root_index] = 1.0  # ルート
-
-        if chord_info['quality'] == 'maj':
-            chord_template[(chord_root_index + 4) % 12] = 0.7  # 長3度
-            chord_template[(chord_root_index + 7) % 12] = 0.5  # 完全5度
-        elif chord_info['quality'] == 'min':
-            chord_template[(chord_root_index + 3) % 12] = 0.7  # 短3度
-            chord_template[(chord_root_index + 7) % 12] = 0.5  # 完全5度
-        else:  # dim
-            chord_template[(chord_root_index + 3) % 12] = 0.7  # 短3度
-            chord_template[(chord_root_index + 6) % 12] = 0.5  # 減5度
-
-        # 正規化
-        chord_template = chord_template / (np.sum(chord_template) + 1e-8)
-
-        # コサイン類似度で一致度を計算
-        match_score = np.dot(chroma_norm, chord_template)
-
-        if match_score > best_match_score:
-            best_match_score = match_score
-            best_chord = chord_info
-
-    # コード名生成
-    chord_root_note = note_names[(root_index + best_chord['offset']) % 12]
-    if best_chord['quality'] == 'maj':
-        chord_name = chord_root_note
-    elif best_chord['quality'] == 'min':
-        chord_name = chord_root_note + 'm'
-    else:
-        chord_name = chord_root_note + 'dim'
 
-    confidence = min(1.0, max(0.0, best_match_score))
+def match_chord_from_hpcp(hpcp_values, note_names: List[str], key_root: str, key_scale: str) -> tuple:
+    """
+    HPCPからコードを推定
+
+    コードテンプレート行列との一致度で判定（match_chord_enhanced と同じ）。
 
-    return chord_name, chord_root_note, best_chord['quality'], confidence
+    Returns:
+        Tuple[str, str, str, float]: (chord_name, root_note, quality, confidence)
+    """
+    return match_chord_enhanced(hpcp_values, note_names, key_root, key_scale)
 
 
 def merge_consecutive_chords(chord_progression: List[ChordInfo]) -> List[ChordInfo]:
@@ -1092,52 +4553,8 @@ def estimate_key_simple(y, sr):
     # 時間軸で平均化して12次元のピッチクラスプロファイルに
     chroma_mean = np.mean(chroma, axis=1)
 
-    # 正規化
-    chroma_mean = chroma_mean / (np.sum(chroma_mean) + 1e-8)
-
-    # メジャー/マイナースケールのテンプレート（Krumhansl-Kessler profiles）
-    # メジャー: ド(1.0), レ(0.3), ミ(0.8), ファ(0.4), ソ(0.9), ラ(0.5), シ(0.7)
-    major_template = np.array([1.0, 0.2, 0.3, 0.2, 0.8, 0.4, 0.2, 0.9, 0.3, 0.5, 0.3, 0.7])
-
-    # マイナー: ラ(1.0), シ(0.3), ド(0.8), レ(0.4), ミ(0.9), ファ(0.5), ソ(0.7)
-    # （Aマイナーベース → 0から始まるように9つシフト）
-    minor_template = np.array([1.0, 0.2, 0.8, 0.3, 0.4, 0.9, 0.2, 0.5, 0.2, 0.7, 0.3, 0.3])
-
-    # 正規化
-    major_template = major_template / np.sum(major_template)
-    minor_template = minor_template / np.sum(minor_template)
-
-    # 12音すべての可能性を試す（相関係数で評価）
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-
-    best_score = -1.0
-    best_key = 'C'
-    best_scale = 'メジャー'
-
-    for i in range(12):
-        # メジャーテンプレートをi半音分シフト
-        shifted_major = np.roll(major_template, i)
-        major_corr = np.corrcoef(chroma_mean, shifted_major)[0, 1]
-
-        if major_corr > best_score:
-            best_score = major_corr
-            best_key = note_names[i]
-            best_scale = 'メジャー'
-
-        # マイナーテンプレートをi半音分シフト
-        shifted_minor = np.roll(minor_template, i)
-        minor_corr = np.corrcoef(chroma_mean, shifted_minor)[0, 1]
-
-        if minor_corr > best_score:
-            best_score = minor_corr
-            best_key = note_names[i]
-            best_scale = 'マイナー'
-
-    # 信頼度を0-1に正規化（相関係数は-1〜1なので、0.5〜1.0にマッピング）
-    confidence = (best_score + 1.0) / 2.0
-    confidence = max(0.0, min(1.0, confidence))
-
-    return best_key, best_scale, confidence
+    # メジャー/マイナースケールの簡易テンプレートと相関を取る（24キーを一括評価）
+    return estimate_key_from_chroma(chroma_mean, profile='simple')
 
 
 def detect_chords_simple(y, sr, key_root, key_scale):
@@ -1145,7 +4562,7 @@ def detect_chords_simple(y, sr, key_root, key_scale):
     簡易コード進行検出
 
     曲を4秒ごとの区間に分割し、各区間のchromaから
-    そのキーのダイアトニックコードのどれに近いかを判定する。
+    どのコードに近いかを判定する（キーのダイアトニックコードを優先）。
 
     Returns:
         List[ChordInfo]: コード進行
@@ -1155,35 +4572,8 @@ def detect_chords_simple(y, sr, key_root, key_scale):
     segment_duration = 4.0  # 4秒ごと
     num_segments = int(np.ceil(duration / segment_duration))
 
-    # ダイアトニックコードの定義（簡易版）
-    # メジャーキーの場合: I, ii, iii, IV, V, vi, vii°
-    # マイナーキーの場合: i, ii°, III, iv, v, VI, VII
-
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    root_index = note_names.index(key_root)
-
-    if key_scale == 'メジャー':
-        # I, IV, V (maj), ii, iii, vi (min)
-        diatonic_chords = [
-            {'offset': 0, 'quality': 'maj', 'degree': 'I'},    # I (トニック)
-            {'offset': 2, 'quality': 'min', 'degree': 'ii'},   # ii
-            {'offset': 4, 'quality': 'min', 'degree': 'iii'},  # iii
-            {'offset': 5, 'quality': 'maj', 'degree': 'IV'},   # IV (サブドミナント)
-            {'offset': 7, 'quality': 'maj', 'degree': 'V'},    # V (ドミナント)
-            {'offset': 9, 'quality': 'min', 'degree': 'vi'},   # vi (相対マイナー)
-        ]
-    else:  # マイナー
-        # i, iv, v (min), III, VI, VII (maj)
-        diatonic_chords = [
-            {'offset': 0, 'quality': 'min', 'degree': 'i'},    # i (トニック)
-            {'offset': 3, 'quality': 'maj', 'degree': 'III'},  # III
-            {'offset': 5, 'quality': 'min', 'degree': 'iv'},   # iv
-            {'offset': 7, 'quality': 'min', 'degree': 'v'},    # v
-            {'offset': 8, 'quality': 'maj', 'degree': 'VI'},   # VI
-            {'offset': 10, 'quality': 'maj', 'degree': 'VII'}, # VII
-        ]
-
-    chord_progression = []
+    segments = []
+    segment_chroma = []
 
     for seg_idx in range(num_segments):
         start_time = seg_idx * segment_duration
@@ -1197,56 +4587,26 @@ def detect_chords_simple(y, sr, key_root, key_scale):
         if len(y_segment) < sr * 0.5:  # 0.5秒未満なら無視
             continue
 
-        # chroma特徴量を計算
-        chroma_seg = librosa.feature.chroma_stft(y=y_segment, sr=sr)
-        chroma_mean = np.mean(chroma_seg, axis=1)
-
-        # 各ダイアトニックコードとの一致度を計算
-        best_match_score = -1.0
-        best_chord = diatonic_chords[0]  # デフォルトはトニック
-
-        for chord_info in diatonic_chords:
-            chord_root_index = (root_index + chord_info['offset']) % 12
-
-            # コードのルート音、第3音、第5音を強調したテンプレート
-            chord_template = np.zeros(12)
-            chord_template[chord_root_index] = 1.0  # ルート
-
-            if chord_info['quality'] == 'maj':
-                chord_template[(chord_root_index + 4) % 12] = 0.8  # 長3度
-            else:  # min
-                chord_template[(chord_root_index + 3) % 12] = 0.8  # 短3度
-
-            chord_template[(chord_root_index + 7) % 12] = 0.6  # 完全5度
-
-            # 正規化
-            chord_template = chord_template / (np.sum(chord_template) + 1e-8)
-            chroma_mean_norm = chroma_mean / (np.sum(chroma_mean) + 1e-8)
-
-            # 内積で一致度を計算
-            match_score = np.dot(chroma_mean_norm, chord_template)
-
-            if match_score > best_match_score:
-                best_match_score = match_score
-                best_chord = chord_info
-
-        # コード名を生成
-        chord_root_note = note_names[(root_index + best_chord['offset']) % 12]
+        # chroma特徴量を計算
+        chroma_seg = librosa.feature.chroma_stft(y=y_segment, sr=sr)
+        segments.append((start_time, end_time))
+        segment_chroma.append(np.mean(chroma_seg, axis=1))
 
-        if best_chord['quality'] == 'maj':
-            chord_name = chord_root_note
-        else:
-            chord_name = chord_root_note + 'm'
+    # 全区間をまとめてコードテンプレートと照合
+    if segment_chroma:
+        matches = get_chord_templates().match(np.stack(segment_chroma, axis=1), key_root, key_scale)
+    else:
+        matches = []
 
-        # 信頼度を0-1にマッピング
-        confidence = min(1.0, max(0.0, best_match_score))
+    chord_progression = []
 
+    for (start_time, end_time), (chord_name, root_note, quality, confidence) in zip(segments, matches):
         chord_progression.append(ChordInfo(
             startTime=start_time,
             endTime=end_time,
             chord=chord_name,
-            rootNote=chord_root_note,
-            quality=best_chord['quality'],
+            rootNote=root_note,
+            quality=quality,
             confidence=confidence
         ))
 
@@ -1323,7 +4683,100 @@ def generate_scale_match(detected_key: str, scale_name: str, chord_progression:
 # Essentia ベース解析ロジック（高精度モード）
 # ============================================
 
-def analyze_audio_essentia(file_path: str, options: Dict) -> AnalysisResult:
+ESSENTIA_KEY_FRAME_SIZE = 4096  # KeyExtractor のフレーム長・ホップ長（重なりなし）
+
+# Essentia のアルゴリズムは設定ごとにワーカーで1回だけ生成して使い回す
+# （生成時に内部バッファやフィルタバンクを確保するものがあるため、リクエストごとに作らない）。
+# インスタンスはスレッドセーフではないため、スレッドごとに持つ。
+ESSENTIA_ALGORITHMS = {
+    "key_extractor": lambda: es.KeyExtractor(profileType='bgate'),
+    "rhythm_extractor": lambda: es.RhythmExtractor2013(method="multifeature"),
+    "spectrum": lambda: es.Spectrum(),
+    "spectral_peaks": lambda: es.SpectralPeaks(
+        orderBy="magnitude",
+        magnitudeThreshold=0.00001,
+        minFrequency=20,
+        maxFrequency=3500,
+        maxPeaks=60
+    ),
+    "hpcp": lambda: es.HPCP(
+        size=12,
+        referenceFrequency=440,
+        harmonics=8,
+        bandPreset=True,
+        minFrequency=20,
+        maxFrequency=3500,
+        weightType="cosine",
+        nonLinear=False,
+        windowSize=1.0
+    ),
+    # 曲全体のキー推定（estimate_key_essentia_blocks）用: KeyExtractor の内部と同じ設定
+    "key_windowing": lambda: es.Windowing(type="hann", size=ESSENTIA_KEY_FRAME_SIZE),
+    "key_spectral_peaks": lambda: es.SpectralPeaks(
+        orderBy="magnitude",
+        magnitudeThreshold=0.0001,
+        minFrequency=25,
+        maxFrequency=3500,
+        maxPeaks=60
+    ),
+    "key_spectral_whitening": lambda: es.SpectralWhitening(maxFrequency=3500),
+    "key_hpcp": lambda: es.HPCP(
+        size=12,
+        referenceFrequency=440,
+        harmonics=4,
+        bandPreset=False,
+        minFrequency=25,
+        maxFrequency=3500,
+        weightType="cosine",
+        nonLinear=False,
+        windowSize=1.0
+    ),
+    "key_from_hpcp": lambda: es.Key(
+        profileType='bgate',
+        numHarmonics=4,
+        pcpSize=12,
+        slope=0.6,
+        usePolyphony=True,
+        useThreeChords=True
+    ),
+}
+
+_essentia_algorithms = threading.local()
+
+
+def get_essentia_algorithm(name: str):
+    """
+    このスレッド用の Essentia アルゴリズムのインスタンス（初回だけ生成）
+
+    Args:
+        name: ESSENTIA_ALGORITHMS のキー
+    """
+    instances = getattr(_essentia_algorithms, "instances", None)
+    if instances is None:
+        instances = _essentia_algorithms.instances = {}
+    algorithm = instances.get(name)
+    if algorithm is None:
+        algorithm = instances[name] = ESSENTIA_ALGORITHMS[name]()
+    return algorithm
+
+
+def reset_essentia_algorithms():
+    """
+    このスレッドのアルゴリズムの内部状態をリセットする（ジョブの開始時に呼ぶ）
+
+    前のジョブの状態（RhythmExtractor2013 の内部バッファなど）が次のジョブに残らないようにする。
+    """
+    instances = getattr(_essentia_algorithms, "instances", {})
+    for name, algorithm in list(instances.items()):
+        try:
+            algorithm.reset()
+        except Exception as e:
+            # リセットできないインスタンスは破棄し、次に使うときに作り直す
+            print(f"  ⚠ Failed to reset Essentia algorithm {name}: {e}")
+            instances.pop(name, None)
+
+
+def analyze_audio_essentia(file_path: str, options: Dict, audio: Optional[DecodedAudio] = None) -> AnalysisResult:
     """
     Essentiaベースの高精度音源解析
 
@@ -1331,10 +4784,13 @@ def analyze_audio_essentia(file_path: str, options: Dict) -> AnalysisResult:
     - KeyExtractor (bgateプロファイル) でキー検出精度90%+
     - RhythmExtractor2013 でビート検出
     - ChordsDetectionBeats でビート同期コード検出
+    - 解析区間は ESSENTIA_EXCERPT_MODE で選択（先頭ではなく、最も音量が大きい区間や曲全体から抜き出した区間）
+    - 解析区間の長さとコードの語彙は解析の深さ（ANALYSIS_TIERS）で切り替え
 
     Args:
         file_path: 音源ファイルのパス
         options: 解析オプション
+        audio: デコード済み音声（None の場合はここでデコード）
 
     Returns:
         AnalysisResult: 解析結果
@@ -1342,20 +4798,45 @@ def analyze_audio_essentia(file_path: str, options: Dict) -> AnalysisResult:
 
     print(f"\n[Essentia Analysis] Starting high-precision analysis...")
     print(f"  File: {file_path}")
+    reset_essentia_algorithms()
 
-    # 1. 音声読み込み（MonoLoader: 44100Hz, モノラル）
+    # 1. 音声読み込み（44100Hz, モノラル）と解析区間の選択
+    sample_rate = 44100
     try:
         print(f"  Step 1/5: Loading audio file...")
-        loader = es.MonoLoader(filename=file_path, sampleRate=44100)
-        audio = loader()
-        duration = len(audio) / 44100.0
-        print(f"    ✓ Loaded: {duration:.2f}s, sr=44100Hz, samples={len(audio)}")
-
-        # 60秒に制限（長い曲の処理時間短縮）
-        if duration > 60.0:
-            audio = audio[:int(60.0 * 44100)]
-            duration = 60.0
-            print(f"    → Truncated to 60.0s for processing efficiency")
+        progress_stage_start("load", 1, 5, "Loading audio file")
+        decoded = audio if audio is not None else DecodedAudio(file_path)
+        if ESSENTIA_EXCERPT_MODE == "full":
+            # 曲全体はディスク上の PCM を memmap で読む（区間の選択と切り出しのみ）
+            track = decoded.stream(sample_rate)
+        else:
+            track = decoded.at(sample_rate)
+        duration = len(track) / float(sample_rate)
+        print(f"    ✓ Loaded: {duration:.2f}s, sr={sample_rate}Hz, samples={len(track)}")
+        depth, tier = resolve_analysis_tier(options, duration)
+        print(f"    ✓ Analysis depth: {depth}")
+
+        # 計算量を一定に保つため、解析は essentiaExcerptDuration 秒分の区間に絞る
+        excerpt_windows = select_excerpt_windows(
+            track, sample_rate, ESSENTIA_EXCERPT_MODE, tier["essentiaExcerptDuration"], ESSENTIA_EXCERPT_WINDOWS
+        )
+        excerpts = [
+            (start / sample_rate, np.array(track[start:end], dtype=np.float32))
+            for start, end in excerpt_windows
+        ]
+        audio = excerpts[0][1] if len(excerpts) == 1 else np.concatenate([x for _, x in excerpts])
+        if len(audio) < len(track):
+            ranges = ", ".join(f"{s / sample_rate:.1f}s-{e / sample_rate:.1f}s" for s, e in excerpt_windows)
+            print(f"    → Analyzing {'windows' if ESSENTIA_EXCERPT_MODE == 'windows' else 'loudest'} excerpt: {ranges}")
+        progress_stage_end(
+            "load",
+            duration=duration,
+            sampleRate=sample_rate,
+            excerpts=[[s / sample_rate, e / sample_rate] for s, e in excerpt_windows],
+        )
+        # full モードのキー推定は曲全体の PCM（memmap）をそのまま使う（ファイルを再デコードしない）
+        full_track = track if ESSENTIA_EXCERPT_MODE == "full" else None
+        del track
     except Exception as e:
         print(f"    ✗ Failed to load audio file: {str(e)}")
         raise Exception(f"Failed to load audio file: {str(e)}")
@@ -1363,57 +4844,106 @@ def analyze_audio_essentia(file_path: str, options: Dict) -> AnalysisResult:
     # 2. キー検出（KeyExtractor + bgateプロファイル）
     try:
         print(f"  Step 2/5: Detecting key with KeyExtractor (bgate profile)...")
-        detected_key, scale_name, confidence = estimate_key_essentia(audio)
+        progress_stage_start("key", 2, 5, "Detecting key with KeyExtractor")
+        if full_track is not None:
+            try:
+                detected_key, scale_name, confidence = estimate_key_essentia_blocks(full_track, sample_rate)
+            except Exception as e:
+                print(f"    ⚠ Full-track key extraction failed: {e}, using excerpt")
+                detected_key, scale_name, confidence = estimate_key_essentia(audio)
+            finally:
+                del full_track
+        else:
+            detected_key, scale_name, confidence = estimate_key_essentia(audio)
         print(f"    ✓ Key detected: {detected_key} {scale_name} (confidence: {confidence:.2f})")
+        key_status = "ok"
     except Exception as e:
         print(f"    ⚠ Key detection failed: {e}, using librosa fallback")
-        # librosaフォールバック
-        y, sr = librosa.load(file_path, sr=None, mono=True, duration=60.0)
-        detected_key, scale_name, confidence = estimate_key_simple(y, sr)
+        # librosaフォールバック（デコード済みの音声を再利用）
+        detected_key, scale_name, confidence = estimate_key_simple(audio, sample_rate)
+        key_status = "fallback"
+
+    progress_stage_end(
+        "key", status=key_status, detectedKey=detected_key, scale=scale_name, confidence=float(confidence)
+    )
 
-    # 3. テンポ・ビート検出（RhythmExtractor2013）
+    # 3. テンポ・ビート検出（RhythmExtractor2013、区間ごと）
     try:
         print(f"  Step 3/5: Detecting tempo and beats...")
-        tempo, beats = detect_tempo_essentia(audio)
-        print(f"    ✓ Tempo detected: {tempo:.1f} BPM, {len(beats)} beats")
+        progress_stage_start("tempo", 3, 5, "Detecting tempo and beats")
+        tempos = []
+        excerpt_beats = []
+        for offset, excerpt in excerpts:
+            excerpt_tempo, beats = detect_tempo_essentia(excerpt)
+            tempos.append(excerpt_tempo)
+            excerpt_beats.append(beats)
+        tempo = float(np.median(tempos))
+        beat_count = sum(len(beats) for beats in excerpt_beats)
+        print(f"    ✓ Tempo detected: {tempo:.1f} BPM, {beat_count} beats")
+        progress_stage_end("tempo", tempo=tempo, beatCount=beat_count)
     except Exception as e:
         print(f"    ⚠ Tempo detection failed: {e}, using default 120 BPM")
         tempo = 120.0
-        beats = []
+        excerpt_beats = [[] for _ in excerpts]
+        progress_stage_end("tempo", status="fallback", tempo=tempo, beatCount=0)
+
+    # メタデータの構築（キーとテンポが確定した時点で部分結果として先に送る）
+    metadata = AnalysisMetadata(
+        duration=duration,
+        tempo=tempo,
+        timeSignature="4/4",
+        detectedKey=detected_key,
+        scale=scale_name,
+        confidence=confidence,
+        analysisDepth=depth
+    )
+    progress_partial("metadata", metadata=metadata.dict())
 
-    # 4. コード進行検出（ビート同期）
+    # 4. コード進行検出（ビート同期、区間ごと）
     try:
         print(f"  Step 4/5: Detecting chord progression...")
-        if len(beats) >= 2:
-            chord_progression = detect_chords_essentia(audio, beats, detected_key, scale_name)
-        else:
-            # ビートが少ない場合は4秒区切りフォールバック
-            chord_progression = detect_chords_essentia_simple(audio, duration, detected_key, scale_name)
+        progress_stage_start("chords", 4, 5, "Detecting chord progression")
+        chord_progression = []
+        for (offset, excerpt), beats in zip(excerpts, excerpt_beats):
+            frames = HPCPFrames(excerpt, sample_rate)
+            if len(beats) >= 2:
+                chord_progression += detect_chords_essentia(
+                    excerpt, beats, detected_key, scale_name, frames=frames, time_offset=offset,
+                    vocabulary=tier["chordVocabulary"]
+                )
+            else:
+                # ビートが少ない場合は4秒区切りフォールバック
+                chord_progression += detect_chords_essentia_simple(
+                    excerpt, len(excerpt) / float(sample_rate), detected_key, scale_name,
+                    frames=frames, time_offset=offset, vocabulary=tier["chordVocabulary"]
+                )
         print(f"    ✓ Detected {len(chord_progression)} chord segments")
         if len(chord_progression) > 0:
             print(f"    First chord: {chord_progression[0].chord} ({chord_progression[0].startTime:.1f}s - {chord_progression[0].endTime:.1f}s)")
+        chords_status = "ok"
     except Exception as e:
         print(f"    ⚠ Chord detection failed: {e}, using fallback")
         chord_progression = generate_fallback_chords(detected_key, duration)
+        chords_status = "fallback"
+        progress_partial("chords", chords=[c.dict() for c in chord_progression], reset=True)
+
+    progress_stage_end(
+        "chords",
+        status=chords_status,
+        chordProgression=[c.dict() for c in chord_progression],
+    )
 
     # 5. スケールマッチング
     try:
         print(f"  Step 5/5: Generating scale matches...")
+        progress_stage_start("scales", 5, 5, "Generating scale matches")
         scale_match = generate_scale_match(detected_key, scale_name, chord_progression)
         print(f"    ✓ Generated {len(scale_match.matchingScales)} scale matches")
+        progress_stage_end("scales", scaleMatch=scale_match.dict())
     except Exception as e:
         print(f"    ⚠ Scale matching failed: {e}")
         scale_match = ScaleMatchResult(matchingScales=[])
-
-    # 6. メタデータの構築
-    metadata = AnalysisMetadata(
-        duration=duration,
-        tempo=tempo,
-        timeSignature="4/4",
-        detectedKey=detected_key,
-        scale=scale_name,
-        confidence=confidence
-    )
+        progress_stage_end("scales", status="fallback")
 
     print(f"\n[Essentia Analysis] Analysis completed successfully!")
     print(f"  Result: {detected_key} {scale_name}, {tempo:.1f} BPM, {len(chord_progression)} chords")
@@ -1438,8 +4968,8 @@ def estimate_key_essentia(audio) -> tuple:
         Tuple[str, str, float]: (rootNote, scale, confidence)
     """
 
-    # KeyExtractorアルゴリズム（bgateプロファイル）
-    key_extractor = es.KeyExtractor(profileType='bgate')
+    # KeyExtractorアルゴリズム（bgateプロファイル、ワーカーで使い回す）
+    key_extractor = get_essentia_algorithm("key_extractor")
     key, scale, strength = key_extractor(audio)
 
     # Essentiaのスケール名を日本語に変換
@@ -1451,271 +4981,299 @@ def estimate_key_essentia(audio) -> tuple:
     return key, scale_name, confidence
 
 
-def detect_tempo_essentia(audio) -> tuple:
+def estimate_key_essentia_blocks(track, sample_rate=44100, block_frames=256) -> tuple:
     """
-    Essentiaベースのテンポ・ビート検出
+    曲全体のキー推定（デコード済みの PCM をブロックごとに KeyExtractor と同じ処理に通す）
 
-    RhythmExtractor2013を使用して高精度なビート検出を行う。
+    KeyExtractor の内部と同じ Windowing → Spectrum → SpectralPeaks → SpectralWhitening → HPCP を
+    フレームごとに計算して足し合わせ、最後に HPCP の平均を Key に渡す。一度に読むのは
+    block_frames フレーム分だけなので、track が memmap なら曲の長さに関係なくメモリ使用量が一定。
+    ファイルを開き直さないため、デコードは DecodedAudio の1回で済む。
+
+    Args:
+        track: 曲全体の音声波形（sample_rate、モノラル、memmap でよい）
+        sample_rate: サンプリングレート（44100Hz 前提の設定）
+        block_frames: 一度に読むフレーム数
 
     Returns:
-        Tuple[float, List[float]]: (tempo, beats)
+        Tuple[str, str, float]: (rootNote, scale, confidence)
     """
+    windowing = get_essentia_algorithm("key_windowing")
+    spectrum = get_essentia_algorithm("spectrum")
+    spectral_peaks = get_essentia_algorithm("key_spectral_peaks")
+    spectral_whitening = get_essentia_algorithm("key_spectral_whitening")
+    hpcp = get_essentia_algorithm("key_hpcp")
+
+    frame_size = ESSENTIA_KEY_FRAME_SIZE
+    n_frames = len(track) // frame_size
+    hpcp_sum = np.zeros(12)
+    count = 0
+    for first in range(0, n_frames, block_frames):
+        last = min(n_frames, first + block_frames)
+        block = np.array(track[first * frame_size:last * frame_size], dtype=np.float32).reshape(-1, frame_size)
+        for frame in block:
+            frame_spectrum = spectrum(windowing(frame))
+            frequencies, magnitudes = spectral_peaks(frame_spectrum)
+            if len(frequencies) == 0:
+                continue
+            magnitudes = spectral_whitening(frame_spectrum, frequencies, magnitudes)
+            hpcp_sum += hpcp(frequencies, magnitudes)
+            count += 1
+    if count == 0:
+        raise ValueError("No tonal frames found")
+
+    key, scale, strength, _ = get_essentia_algorithm("key_from_hpcp")((hpcp_sum / count).astype(np.float32))
 
-    rhythm_extractor = es.RhythmExtractor2013(method="multifeature")
-    bpm, beats, beats_confidence, _, beats_intervals = rhythm_extractor(audio)
+    scale_name = 'メジャー' if scale == 'major' else 'マイナー'
+    confidence = min(1.0, max(0.0, float(strength)))
 
-    return float(bpm), list(beats)
+    return key, scale_name, confidence
 
 
-def detect_chords_essentia(audio, beats: List[float], key_root: str, key_scale: str) -> List[ChordInfo]:
+def select_excerpt_windows(y, sr, mode="loudest", duration=60.0, num_windows=3, hop_length=512):
     """
-    Essentiaベースのビート同期コード検出
+    解析する区間を選ぶ（合計 duration 秒）
 
-    ビート区間ごとにHPCP (Harmonic Pitch Class Profile) を計算し、
-    コードを推定する。
+    loudest / full は最も音量が大きい区間を1つ、windows は曲を num_windows 等分した
+    各区間の中央から同じ長さずつ取り出す。RMS はブロック単位で計算するため、y は memmap でもよい。
 
     Args:
-        audio: 音声データ
-        beats: ビート位置のリスト
-        key_root: キーのルート音
-        key_scale: スケール名
+        y: 音声波形（曲全体）
+        sr: サンプリングレート
+        mode: ESSENTIA_EXCERPT_MODE
+        duration: 解析する長さの合計（秒）
+        num_windows: windows モードの区間数
+        hop_length: RMS / 区間境界のホップ長
 
     Returns:
-        List[ChordInfo]: コード進行
+        List[Tuple[int, int]]: [(開始サンプル, 終了サンプル), ...]
     """
+    n = len(y)
+    if duration <= 0 or n <= duration * sr:
+        return [(0, n)]
 
-    sample_rate = 44100
-    chord_progression = []
+    if mode == "windows":
+        num_windows = max(1, num_windows)
+        window = max(hop_length, int(duration * sr / num_windows) // hop_length * hop_length)
+        windows = []
+        for i in range(num_windows):
+            center = (i + 0.5) * n / num_windows
+            start = int(max(0, min(n - window, center - window / 2))) // hop_length * hop_length
+            windows.append((start, min(n, start + window)))
+        return windows
 
-    # HPCP計算用アルゴリズム
-    spectrum = es.Spectrum()
-    spectral_peaks = es.SpectralPeaks(
-        orderBy="magnitude",
-        magnitudeThreshold=0.00001,
-        minFrequency=20,
-        maxFrequency=3500,
-        maxPeaks=60
-    )
-    hpcp = es.HPCP(
-        size=12,
-        referenceFrequency=440,
-        harmonics=8,
-        bandPreset=True,
-        minFrequency=20,
-        maxFrequency=3500,
-        weightType="cosine",
-        nonLinear=False,
-        windowSize=1.0
-    )
+    _, rms, _ = scan_track_in_blocks(y, sr, hop_length=hop_length, estimate_keys=False)
+    start_time, end_time = select_loudest_window(rms, sr, n / sr, duration, hop_length)
+    return [snap_segment_to_frames(start_time, end_time, sr, n, hop_length)]
 
-    # コードテンプレート（メジャー・マイナー）
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
-    # ビートをグループ化（2-4ビートごと）
-    beat_groups = []
-    group_size = 4  # 4ビートごとにコード検出
-    for i in range(0, len(beats) - 1, group_size):
-        start_beat = beats[i]
-        end_idx = min(i + group_size, len(beats) - 1)
-        end_beat = beats[end_idx] if end_idx < len(beats) else beats[-1]
-        beat_groups.append((start_beat, end_beat))
+def detect_tempo_essentia(audio) -> tuple:
+    """
+    Essentiaベースのテンポ・ビート検出
 
-    for start_time, end_time in beat_groups:
-        # この区間の音声を切り出し
-        start_sample = int(start_time * sample_rate)
-        end_sample = int(end_time * sample_rate)
-        segment = audio[start_sample:end_sample]
+    RhythmExtractor2013を使用して高精度なビート検出を行う。
 
-        if len(segment) < 2048:
-            continue
+    Returns:
+        Tuple[float, List[float]]: (tempo, beats)
+    """
 
-        # フレームごとにHPCPを計算して平均
-        frame_size = 2048
-        hop_size = 1024
-        hpcp_values = []
+    rhythm_extractor = get_essentia_algorithm("rhythm_extractor")
+    bpm, beats, beats_confidence, _, beats_intervals = rhythm_extractor(audio)
 
-        for frame_start in range(0, len(segment) - frame_size, hop_size):
-            frame = segment[frame_start:frame_start + frame_size]
-            windowed = frame * np.hanning(len(frame))
-            spec = spectrum(windowed)
-            frequencies, magnitudes = spectral_peaks(spec)
-            if len(frequencies) > 0:
-                hpcp_frame = hpcp(frequencies, magnitudes)
-                hpcp_values.append(hpcp_frame)
+    return float(bpm), list(beats)
 
-        if not hpcp_values:
-            continue
 
-        # HPCPの平均を計算
-        hpcp_mean = np.mean(hpcp_values, axis=0)
+class HPCPFrames:
+    """
+    音源全体のフレームごとの HPCP（Harmonic Pitch Class Profile）
 
-        # コードを推定
-        chord_name, root_note, quality, confidence = match_chord_from_hpcp(
-            hpcp_mean, note_names, key_root, key_scale
-        )
+    窓関数は1回だけ作り、全フレームを1回だけ Spectrum → SpectralPeaks → HPCP に通す。
+    区間の平均は累積和の差から求めるため、ビートグループが重なってもフレームを計算し直さない。
+    """
 
-        chord_progression.append(ChordInfo(
-            startTime=start_time,
-            endTime=end_time,
-            chord=chord_name,
-            rootNote=root_note,
-            quality=quality,
-            confidence=confidence
-        ))
+    FRAME_SIZE = 2048
+    HOP_SIZE = 1024
 
-    return chord_progression
+    def __init__(self, audio, sample_rate=44100):
+        self.sample_rate = sample_rate
 
+        spectrum = get_essentia_algorithm("spectrum")
+        spectral_peaks = get_essentia_algorithm("spectral_peaks")
+        hpcp = get_essentia_algorithm("hpcp")
+
+        audio = np.asarray(audio, dtype=np.float32)
+        window = np.hanning(self.FRAME_SIZE).astype(np.float32)
+        if len(audio) >= self.FRAME_SIZE:
+            frames = np.lib.stride_tricks.sliding_window_view(audio, self.FRAME_SIZE)[::self.HOP_SIZE]
+        else:
+            frames = np.zeros((0, self.FRAME_SIZE), dtype=np.float32)
 
-def detect_chords_essentia_simple(audio, duration: float, key_root: str, key_scale: str) -> List[ChordInfo]:
+        values = np.zeros((len(frames), 12))
+        valid = np.zeros(len(frames))
+        for i, frame in enumerate(frames):
+            frequencies, magnitudes = spectral_peaks(spectrum(frame * window))
+            if len(frequencies) > 0:
+                values[i] = hpcp(frequencies, magnitudes)
+                valid[i] = 1.0
+
+        # 区間平均用の累積和（先頭に 0 行を足して差で引けるようにする）
+        self.n_frames = len(frames)
+        self._cumsum = np.vstack([np.zeros((1, 12)), np.cumsum(values, axis=0)])
+        self._count = np.concatenate([[0.0], np.cumsum(valid)])
+
+    def mean(self, start_time, end_time):
+        """
+        区間内に収まるフレームの HPCP 平均（12次元）
+
+        区間がフレームより短く、収まるフレームがない場合は区間の中央に最も近いフレームを使う
+        （ChromaFeatures.frames と同じく最低1フレーム）。
+
+        Returns:
+            Optional[ndarray]: 有効なフレームがない場合は None
+        """
+        if self.n_frames == 0:
+            return None
+        start_sample = int(start_time * self.sample_rate)
+        end_sample = int(end_time * self.sample_rate)
+        # 開始が start_sample 以降で、終わりが end_sample 以前のフレーム [f0, f1)
+        f0 = min(self.n_frames, -(-start_sample // self.HOP_SIZE))
+        f1 = min(self.n_frames, (end_sample - self.FRAME_SIZE) // self.HOP_SIZE + 1)
+        if f1 <= f0:
+            center = (start_sample + end_sample) / 2 - self.FRAME_SIZE / 2
+            f0 = min(self.n_frames - 1, max(0, int(round(center / self.HOP_SIZE))))
+            f1 = f0 + 1
+        count = self._count[f1] - self._count[f0]
+        if count <= 0:
+            return None
+        return (self._cumsum[f1] - self._cumsum[f0]) / count
+
+
+def match_hpcp_windows(
+    frames: HPCPFrames, windows, key_root: str, key_scale: str, time_offset: float = 0.0, vocabulary: str = 'full'
+) -> List[ChordInfo]:
     """
-    Essentiaベースの簡易コード検出（4秒区切り）
+    区間ごとの HPCP 平均をまとめてコードテンプレートと照合する
 
-    ビート情報がない場合のフォールバック。
+    Args:
+        frames: 音源全体の HPCPFrames
+        windows: [(開始時刻, 終了時刻), ...]
+        key_root: キーのルート音
+        key_scale: スケール名
+        time_offset: 元音源での開始時刻オフセット
+        vocabulary: コードの語彙（CHORD_VOCABULARIES のキー）
 
     Returns:
-        List[ChordInfo]: コード進行
+        List[ChordInfo]: コード進行（確定したものから数区間ずつ部分結果として送る）
     """
-
-    sample_rate = 44100
-    segment_duration = 4.0
-    num_segments = int(np.ceil(duration / segment_duration))
-
-    chord_progression = []
-    note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-
-    # HPCP計算用
-    spectrum = es.Spectrum()
-    spectral_peaks = es.SpectralPeaks(
-        orderBy="magnitude",
-        magnitudeThreshold=0.00001,
-        minFrequency=20,
-        maxFrequency=3500,
-        maxPeaks=60
-    )
-    hpcp = es.HPCP(
-        size=12,
-        referenceFrequency=440,
-        harmonics=8,
-        bandPreset=True,
-        minFrequency=20,
-        maxFrequency=3500
-    )
-
-    for seg_idx in range(num_segments):
-        start_time = seg_idx * segment_duration
-        end_time = min((seg_idx + 1) * segment_duration, duration)
-
-        start_sample = int(start_time * sample_rate)
-        end_sample = int(end_time * sample_rate)
-        segment = audio[start_sample:end_sample]
-
-        if len(segment) < 2048:
+    matched_windows = []
+    window_hpcp = []
+    for start_time, end_time in windows:
+        if int(end_time * frames.sample_rate) - int(start_time * frames.sample_rate) < HPCPFrames.FRAME_SIZE:
             continue
+        hpcp_mean = frames.mean(start_time, end_time)
+        if hpcp_mean is None:
+            continue
+        matched_windows.append((start_time, end_time))
+        window_hpcp.append(hpcp_mean)
 
-        # フレームごとにHPCPを計算
-        frame_size = 2048
-        hop_size = 1024
-        hpcp_values = []
-
-        for frame_start in range(0, len(segment) - frame_size, hop_size):
-            frame = segment[frame_start:frame_start + frame_size]
-            windowed = frame * np.hanning(len(frame))
-            spec = spectrum(windowed)
-            frequencies, magnitudes = spectral_peaks(spec)
-            if len(frequencies) > 0:
-                hpcp_frame = hpcp(frequencies, magnitudes)
-                hpcp_values.append(hpcp_frame)
+    if window_hpcp:
+        matches = get_chord_templates(vocabulary).match(np.stack(window_hpcp, axis=1), key_root, key_scale)
+    else:
+        matches = []
 
-        if not hpcp_values:
-            continue
+    chord_progression = []
+    emitted = 0
 
-        hpcp_mean = np.mean(hpcp_values, axis=0)
-        chord_name, root_note, quality, confidence = match_chord_from_hpcp(
-            hpcp_mean, note_names, key_root, key_scale
-        )
+    for idx, ((start_time, end_time), (chord_name, root_note, quality, confidence)) in enumerate(
+        zip(matched_windows, matches)
+    ):
+        if idx > 0 and idx % CHORD_BATCH_SIZE == 0:
+            emitted = emit_chord_batch(chord_progression, emitted, merge=False)
 
         chord_progression.append(ChordInfo(
-            startTime=start_time,
-            endTime=end_time,
+            startTime=start_time + time_offset,
+            endTime=end_time + time_offset,
             chord=chord_name,
             rootNote=root_note,
             quality=quality,
             confidence=confidence
         ))
 
+    emit_chord_batch(chord_progression, emitted, final=True, merge=False)
+
     return chord_progression
 
 
-def match_chord_from_hpcp(hpcp_values, note_names: List[str], key_root: str, key_scale: str) -> tuple:
+def detect_chords_essentia(
+    audio,
+    beats: List[float],
+    key_root: str,
+    key_scale: str,
+    frames: Optional[HPCPFrames] = None,
+    time_offset: float = 0.0,
+    vocabulary: str = 'full',
+) -> List[ChordInfo]:
     """
-    HPCPからコードを推定
+    Essentiaベースのビート同期コード検出
+
+    音源全体のフレームごとの HPCP (Harmonic Pitch Class Profile) を1回だけ計算し、
+    ビート区間ごとに平均してコードを推定する。
 
-    ダイアトニックコードテンプレートとの一致度で判定。
+    Args:
+        audio: 音声データ
+        beats: ビート位置のリスト
+        key_root: キーのルート音
+        key_scale: スケール名
+        frames: audio の HPCPFrames（None の場合はここで計算）
+        time_offset: 元音源での開始時刻オフセット
+        vocabulary: コードの語彙（CHORD_VOCABULARIES のキー）
 
     Returns:
-        Tuple[str, str, str, float]: (chord_name, root_note, quality, confidence)
+        List[ChordInfo]: コード進行
     """
+    if frames is None:
+        frames = HPCPFrames(audio)
 
-    root_index = note_names.index(key_root)
-
-    # ダイアトニックコード定義
-    if key_scale == 'メジャー':
-        diatonic_chords = [
-            {'offset': 0, 'quality': 'maj', 'degree': 'I'},
-            {'offset': 2, 'quality': 'min', 'degree': 'ii'},
-            {'offset': 4, 'quality': 'min', 'degree': 'iii'},
-            {'offset': 5, 'quality': 'maj', 'degree': 'IV'},
-            {'offset': 7, 'quality': 'maj', 'degree': 'V'},
-            {'offset': 9, 'quality': 'min', 'degree': 'vi'},
-        ]
-    else:
-        diatonic_chords = [
-            {'offset': 0, 'quality': 'min', 'degree': 'i'},
-            {'offset': 3, 'quality': 'maj', 'degree': 'III'},
-            {'offset': 5, 'quality': 'min', 'degree': 'iv'},
-            {'offset': 7, 'quality': 'min', 'degree': 'v'},
-            {'offset': 8, 'quality': 'maj', 'degree': 'VI'},
-            {'offset': 10, 'quality': 'maj', 'degree': 'VII'},
-        ]
-
-    best_match_score = -1.0
-    best_chord = diatonic_chords[0]
-
-    for chord_info in diatonic_chords:
-        chord_root_index = (root_index + chord_info['offset']) % 12
-
-        # コードテンプレート（ルート、3度、5度）
-        chord_template = np.zeros(12)
-        chord_template[chord_root_index] = 1.0
-
-        if chord_info['quality'] == 'maj':
-            chord_template[(chord_root_index + 4) % 12] = 0.8  # 長3度
-        else:
-            chord_template[(chord_root_index + 3) % 12] = 0.8  # 短3度
+    # ビートをグループ化（2-4ビートごと）
+    beat_groups = []
+    group_size = 4  # 4ビートごとにコード検出
+    for i in range(0, len(beats) - 1, group_size):
+        start_beat = beats[i]
+        end_idx = min(i + group_size, len(beats) - 1)
+        end_beat = beats[end_idx] if end_idx < len(beats) else beats[-1]
+        beat_groups.append((start_beat, end_beat))
 
-        chord_template[(chord_root_index + 7) % 12] = 0.6  # 完全5度
+    return match_hpcp_windows(frames, beat_groups, key_root, key_scale, time_offset, vocabulary)
 
-        # 正規化
-        chord_template = chord_template / (np.sum(chord_template) + 1e-8)
-        hpcp_norm = hpcp_values / (np.sum(hpcp_values) + 1e-8)
 
-        # 内積で一致度
-        match_score = np.dot(hpcp_norm, chord_template)
+def detect_chords_essentia_simple(
+    audio,
+    duration: float,
+    key_root: str,
+    key_scale: str,
+    frames: Optional[HPCPFrames] = None,
+    time_offset: float = 0.0,
+    vocabulary: str = 'full',
+) -> List[ChordInfo]:
+    """
+    Essentiaベースの簡易コード検出（4秒区切り）
 
-        if match_score > best_match_score:
-            best_match_score = match_score
-            best_chord = chord_info
+    ビート情報がない場合のフォールバック。
 
-    # コード名生成
-    chord_root_note = note_names[(root_index + best_chord['offset']) % 12]
-    if best_chord['quality'] == 'maj':
-        chord_name = chord_root_note
-    else:
-        chord_name = chord_root_note + 'm'
+    Returns:
+        List[ChordInfo]: コード進行
+    """
+    if frames is None:
+        frames = HPCPFrames(audio)
 
-    confidence = min(1.0, max(0.0, best_match_score))
+    segment_duration = 4.0
+    num_segments = int(np.ceil(duration / segment_duration))
+    windows = [
+        (seg_idx * segment_duration, min((seg_idx + 1) * segment_duration, duration))
+        for seg_idx in range(num_segments)
+    ]
 
-    return chord_name, chord_root_note, best_chord['quality'], confidence
+    return match_hpcp_windows(frames, windows, key_root, key_scale, time_offset, vocabulary)
 
 
 # ============================================
@@ -1737,53 +5295,3 @@ if __name__ == "__main__":
         reload=True,  # コード変更時に自動リロード
         log_level="info"
     )
-
-"""
-【Phase 4 以降で実装予定の関数】
-
-def separate_stems(file_path: str) -> Dict[str, str]:
-    \"\"\"
-    stem 分解（Demucs 使用）
-
-    Args:
-        file_path: 音源ファイルのパス
-
-    Returns:
-        Dict[str, str]: stem別のファイルパス
-            - vocals: ボーカルトラック
-            - drums: ドラムトラック
-            - bass: ベーストラック
-            - other: その他トラック
-    \"\"\"
-    # TODO: Demucs を使った実装
-    pass
-
-
-def detect_chords(y: np.ndarray, sr: int) -> List[ChordInfo]:
-    \"\"\"
-    コード進行検出（madmom or librosa 使用）
-
-    Args:
-        y: 音源データ
-        sr: サンプリングレート
-
-    Returns:
-        List[ChordInfo]: コード進行
-    \"\"\"
-    # TODO: madmom or librosa を使った実装
-    pass
-
-
-def estimate_key(chroma: np.ndarray) -> Tuple[str, str]:
-    \"\"\"
-    キー検出
-
-    Args:
-        chroma: クロマグラム
-
-    Returns:
-        Tuple[str, str]: (キー, スケール)
-    \"\"\"
-    # TODO: キー検出アルゴリズムの実装
-    pass
-"""